@@ -0,0 +1,26 @@
+"""Recipe listing order indexes
+
+Revision ID: 3c5e1f0a9b2d
+Revises: afd070c8e270
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c5e1f0a9b2d'
+down_revision = 'afd070c8e270'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_recipes_created_at_id', 'recipes', ['created_at', 'id'], unique=False)
+    op.create_index('ix_recipes_author_id_created_at_id', 'recipes', ['author_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_recipes_author_id_created_at_id', table_name='recipes')
+    op.drop_index('ix_recipes_created_at_id', table_name='recipes')
@@ -0,0 +1,36 @@
+"""Recipe counts
+
+Revision ID: 7d2b4a6c8e10
+Revises: 3c5e1f0a9b2d
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2b4a6c8e10'
+down_revision = '3c5e1f0a9b2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('recipe_counts',
+    sa.Column('author_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('author_id')
+    )
+    # Backfill the counters. Author 0 counts all recipes.
+    op.execute(
+        "INSERT INTO recipe_counts (author_id, count) "
+        "SELECT author_id, COUNT(id) FROM recipes GROUP BY author_id"
+    )
+    op.execute(
+        "INSERT INTO recipe_counts (author_id, count) SELECT 0, COUNT(id) FROM recipes"
+    )
+
+
+def downgrade():
+    op.drop_table('recipe_counts')
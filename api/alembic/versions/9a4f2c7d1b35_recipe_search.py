@@ -0,0 +1,64 @@
+"""Recipe full-text search
+
+Revision ID: 9a4f2c7d1b35
+Revises: 7d2b4a6c8e10
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f2c7d1b35'
+down_revision = '7d2b4a6c8e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE recipe_search USING fts5("
+            "name, ingredients, steps, tokenize='porter unicode61')"
+        )
+        # Backfill the index with every existing recipe.
+        op.execute(
+            "INSERT INTO recipe_search (rowid, name, ingredients, steps) "
+            "SELECT recipes.id, recipes.name, "
+            "(SELECT group_concat(content, ' ') FROM ingredients "
+            "WHERE ingredients.recipe_id = recipes.id), "
+            "(SELECT group_concat(content, ' ') FROM recipe_steps "
+            "WHERE recipe_steps.recipe_id = recipes.id) "
+            "FROM recipes"
+        )
+    else:
+        op.create_table('recipe_search',
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+        sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('recipe_id')
+        )
+        op.create_index('ix_recipe_search_document', 'recipe_search', ['document'], unique=False, postgresql_using='gin')
+        # Backfill the index with every existing recipe.
+        op.execute(
+            "INSERT INTO recipe_search (recipe_id, document) "
+            "SELECT recipes.id, "
+            "setweight(to_tsvector('english', recipes.name), 'A') "
+            "|| setweight(to_tsvector('english', coalesce("
+            "(SELECT string_agg(content, ' ') FROM ingredients "
+            "WHERE ingredients.recipe_id = recipes.id), '')), 'B') "
+            "|| setweight(to_tsvector('english', coalesce("
+            "(SELECT string_agg(content, ' ') FROM recipe_steps "
+            "WHERE recipe_steps.recipe_id = recipes.id), '')), 'C') "
+            "FROM recipes"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE recipe_search")
+    else:
+        op.drop_index('ix_recipe_search_document', table_name='recipe_search')
+        op.drop_table('recipe_search')
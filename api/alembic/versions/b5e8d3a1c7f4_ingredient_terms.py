@@ -0,0 +1,104 @@
+"""Ingredient terms index
+
+Revision ID: b5e8d3a1c7f4
+Revises: 9a4f2c7d1b35
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e8d3a1c7f4'
+down_revision = '9a4f2c7d1b35'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+# The ingredient normalizer of api.ingredients as of this revision. It is copied, so
+# that later changes to the app's normalizer do not change what this backfills.
+WORD_PATTERN = re.compile(r"[a-z]+")
+# fmt: off
+UNITS = {
+    "bag", "bottle", "box", "bunch", "can", "clove", "container", "cup", "dash",
+    "gallon", "gram", "handful", "head", "inch", "jar", "kg", "kilogram", "lb",
+    "liter", "litre", "ml", "ounce", "oz", "package", "pinch", "pint", "piece",
+    "pkg", "pound", "quart", "slice", "sprig", "stick", "tablespoon", "tbsp",
+    "teaspoon", "tsp",
+}
+PREPARATIONS = {
+    "chopped", "crushed", "cubed", "cut", "diced", "divided", "drained", "finely",
+    "fresh", "freshly", "grated", "halved", "large", "medium", "melted", "minced",
+    "optional", "packed", "peeled", "rinsed", "roughly", "shredded", "sliced",
+    "small", "softened", "taste", "thinly",
+}
+STOP_WORDS = {
+    "a", "about", "an", "and", "at", "for", "in", "into", "more", "of", "or",
+    "plus", "the", "to", "with",
+}
+# fmt: on
+IGNORED_WORDS = UNITS | PREPARATIONS | STOP_WORDS
+
+
+def singular(word):
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def ingredient_terms(content):
+    words = (singular(word) for word in WORD_PATTERN.findall(content.lower()))
+    return frozenset(
+        word for word in words if len(word) > 1 and word not in IGNORED_WORDS
+    )
+
+
+def upgrade():
+    ingredient_terms_table = op.create_table('ingredient_terms',
+    sa.Column('ingredient_id', sa.Integer(), nullable=False),
+    sa.Column('term', sa.String(), nullable=False),
+    sa.Column('recipe_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['ingredient_id'], ['ingredients.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['recipe_id'], ['recipes.id'], ),
+    sa.PrimaryKeyConstraint('ingredient_id', 'term')
+    )
+    op.create_index('ix_ingredient_terms_author_id_term', 'ingredient_terms', ['author_id', 'term', 'ingredient_id', 'recipe_id'], unique=False)
+    op.create_index('ix_ingredient_terms_recipe_id', 'ingredient_terms', ['recipe_id'], unique=False)
+
+    # Backfill the index with every existing ingredient. The ingredients are
+    # streamed, rather than all loaded into memory at once.
+    ingredients = op.get_bind().execution_options(stream_results=True).execute(sa.text(
+        "SELECT ingredients.id, ingredients.recipe_id, recipes.author_id, "
+        "ingredients.content FROM ingredients "
+        "JOIN recipes ON recipes.id = ingredients.recipe_id"
+    ))
+    rows = []
+    for ingredient in ingredients:
+        for term in sorted(ingredient_terms(ingredient.content)):
+            rows.append(dict(
+                ingredient_id=ingredient.id,
+                term=term,
+                recipe_id=ingredient.recipe_id,
+                author_id=ingredient.author_id,
+            ))
+        if len(rows) >= BACKFILL_BATCH_SIZE:
+            op.bulk_insert(ingredient_terms_table, rows)
+            rows = []
+    if rows:
+        op.bulk_insert(ingredient_terms_table, rows)
+
+
+def downgrade():
+    op.drop_index('ix_ingredient_terms_recipe_id', table_name='ingredient_terms')
+    op.drop_index('ix_ingredient_terms_author_id_term', table_name='ingredient_terms')
+    op.drop_table('ingredient_terms')
@@ -0,0 +1,71 @@
+"""Unique step and ingredient positions
+
+Revision ID: c3f7a2e9d4b6
+Revises: b5e8d3a1c7f4
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from itertools import groupby
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f7a2e9d4b6'
+down_revision = 'b5e8d3a1c7f4'
+branch_labels = None
+depends_on = None
+
+TABLES = ['ingredients', 'recipe_steps']
+RENUMBER_BATCH_SIZE = 100  # recipes renumbered at a time, at most
+
+# The sort key spacing of api.ordering as of this revision. It is copied, so that
+# later changes to the app's ordering do not change what this migration writes.
+POSITION_GAP = 1024
+
+
+def initial_keys(count):
+    return [n * POSITION_GAP for n in range(count)]
+
+
+def renumber_duplicate_positions(table):
+    """Renumbers the rows of every recipe that has two rows at one position, in their
+    current order. Ties keep the order they were created in. The recipes are read
+    RENUMBER_BATCH_SIZE at a time, rather than all at once, and each batch is
+    renumbered before the next is read, so no cursor is open on the table while it
+    is updated."""
+    bind = op.get_bind()
+    after = 0
+    while True:
+        rows = bind.execute(sa.text(
+            f"SELECT id, recipe_id FROM {table} WHERE recipe_id IN ("
+            f"SELECT recipe_id FROM {table} WHERE recipe_id > :after "
+            "GROUP BY recipe_id, position HAVING COUNT(*) > 1 "
+            "ORDER BY recipe_id LIMIT :batch_size) "
+            "ORDER BY recipe_id, position, id"
+        ), dict(after=after, batch_size=RENUMBER_BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        updates = []
+        for _, recipe_rows in groupby(rows, key=lambda row: row.recipe_id):
+            recipe_rows = list(recipe_rows)
+            for row, position in zip(recipe_rows, initial_keys(len(recipe_rows))):
+                updates.append(dict(row_id=row.id, new_position=position))
+        bind.execute(
+            sa.text(f"UPDATE {table} SET position = :new_position WHERE id = :row_id"),
+            updates,
+        )
+        after = rows[-1].recipe_id
+
+
+def upgrade():
+    for table in TABLES:
+        renumber_duplicate_positions(table)
+    op.create_index('ix_ingredients_recipe_id_position', 'ingredients', ['recipe_id', 'position'], unique=True)
+    op.create_index('ix_recipe_steps_recipe_id_position', 'recipe_steps', ['recipe_id', 'position'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_recipe_steps_recipe_id_position', table_name='recipe_steps')
+    op.drop_index('ix_ingredients_recipe_id_position', table_name='ingredients')
@@ -0,0 +1,38 @@
+"""Cookbook jobs
+
+Revision ID: e1a4b7c2d9f3
+Revises: c3f7a2e9d4b6
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a4b7c2d9f3'
+down_revision = 'c3f7a2e9d4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cookbook_jobs',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('stage', sa.String(length=20), nullable=False),
+    sa.Column('progress', sa.Float(), nullable=False),
+    sa.Column('detail', sa.String(), nullable=True),
+    sa.Column('pdf_path', sa.String(), nullable=True),
+    sa.Column('updated_at', sa.TIMESTAMP(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_cookbook_jobs_author_id'), 'cookbook_jobs', ['author_id'], unique=False)
+    op.create_index(op.f('ix_cookbook_jobs_updated_at'), 'cookbook_jobs', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_cookbook_jobs_updated_at'), table_name='cookbook_jobs')
+    op.drop_index(op.f('ix_cookbook_jobs_author_id'), table_name='cookbook_jobs')
+    op.drop_table('cookbook_jobs')
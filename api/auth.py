@@ -1,5 +1,5 @@
 from starlette.middleware.cors import CORSMiddleware
-from api.models import OAuth2Token
+from api.models import OAuth2Token, Role
 from datetime import timedelta, datetime
 from typing import Optional
 
@@ -7,13 +7,13 @@ from typing import Optional
 from fastapi import Depends, APIRouter, status, Response
 from fastapi.exceptions import HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import argon2
 from jose import JWTError, jwt
 
 from api import schemas, crud
 from api.crud import get_user_by_email
-from api.database import get_db
+from api.database import get_db, get_read_db
 from api.settings import settings
 from api.utils import OAuth2PasswordBearerWithCookie
 
@@ -33,7 +33,7 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 
 
 async def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(get_read_db), token: str = Depends(oauth2_scheme)
 ) -> schemas.AuthenticatedUser:
 
     credentials_exception = HTTPException(
@@ -49,7 +49,7 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = get_user_by_email(db, email=email)
+    user = await get_user_by_email(db, email=email)
     if user is None:
         raise credentials_exception
 
@@ -75,13 +75,23 @@ async def get_current_user(
     return authenticated_user
 
 
+async def get_current_admin(
+    user: schemas.AuthenticatedUser = Depends(get_current_user),
+) -> schemas.AuthenticatedUser:
+    if user.role != Role.ADMIN.value:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required."
+        )
+    return user
+
+
 # Auth Routes
 
 
 @router.post("/users/", response_model=schemas.User)
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     # If user already exists, do not attempt to recreate.
-    if crud.get_user_by_email(db, user.email):
+    if await crud.get_user_by_email(db, user.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=(
@@ -89,7 +99,7 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
                 "Please sign in with your username and password."
             ),
         )
-    db_user = crud.create_user(db, user)
+    db_user = await crud.create_user(db, user)
     if db_user:
         return schemas.User(
             id=db_user.id,
@@ -107,9 +117,9 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 async def login(
     response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    authenticated_user = authenticate_user(
+    authenticated_user = await authenticate_user(
         db, form_data.username, schemas.PasswordStr(form_data.password)
     )
     if not authenticated_user:
@@ -139,7 +149,10 @@ async def login(
         expires_at=expires_at,
     )
 
-    crud.update_or_create_user_token(db, authenticated_user.id, token)
+    # The user's next requests are authenticated with the new token. Committing it
+    # marks the response with a recent write, so they do not read it from a replica
+    # that does not have it yet.
+    await crud.update_or_create_user_token(db, authenticated_user.id, token)
 
     response.set_cookie(
         key="access_token",
@@ -154,11 +167,11 @@ async def login(
 # Helpers
 
 
-def authenticate_user(
-    db: Session, email: str, password: schemas.PasswordStr
+async def authenticate_user(
+    db: AsyncSession, email: str, password: schemas.PasswordStr
 ) -> Optional[schemas.User]:
     """Returns a user if the email and password cominbation is correct for this user. None otherwise."""
-    user = get_user_by_email(db, email=email)
+    user = await get_user_by_email(db, email=email)
 
     if not user:
         # Can't find the user.
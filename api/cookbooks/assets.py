@@ -0,0 +1,126 @@
+import hashlib
+import io
+import logging
+import os
+from os import path
+from typing import Dict, List, NamedTuple, Tuple
+
+from PIL import Image, ImageOps
+from weasyprint import default_url_fetcher
+
+from api.cookbooks.cache import content_key
+
+logger = logging.getLogger(__name__)
+
+ASSET_SCHEME = "asset:"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PAGE_SIZE_INCHES = (8.27, 11.69)  # A4, the page size of every layout.
+JPEG_QUALITY = 85
+
+assets_dir = path.join(path.dirname(__file__), "templates", "assets")
+
+
+class Asset(NamedTuple):
+    data: bytes
+    mime_type: str
+
+
+def asset_url(name: str) -> str:
+    """Returns the URL templates use to reference the named asset."""
+    return ASSET_SCHEME + name
+
+
+def is_asset_file(filename: str) -> bool:
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def print_size(dpi: int) -> Tuple[int, int]:
+    """Pixel size of a full page printed at the given resolution."""
+    width, height = PAGE_SIZE_INCHES
+    return round(width * dpi), round(height * dpi)
+
+
+def prepare_image(data: bytes, dpi: int) -> Asset:
+    """
+    Shrinks the image so that it is no larger than needed to cover a full page at
+    the given print resolution, and re-encodes it. Images that are already small
+    enough are only re-encoded. Raises PIL.UnidentifiedImageError for data that is
+    not an image.
+    """
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)  # Apply the camera's rotation.
+
+    page_width, page_height = print_size(dpi)
+    # Scale so the image still covers the page on both axes, like object-fit: cover.
+    scale = max(page_width / image.width, page_height / image.height)
+    if scale < 1:
+        image = image.resize(
+            (round(image.width * scale), round(image.height * scale)),
+            Image.LANCZOS,
+        )
+
+    output = io.BytesIO()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(output, format="PNG", optimize=True)
+        return Asset(output.getvalue(), "image/png")
+    image.convert("RGB").save(
+        output, format="JPEG", quality=JPEG_QUALITY, optimize=True, dpi=(dpi, dpi)
+    )
+    return Asset(output.getvalue(), "image/jpeg")
+
+
+class AssetStore:
+    """
+    Images used by the cookbook templates. Templates reference them through
+    asset_url(), and url_fetcher serves them to WeasyPrint from memory, already
+    resized to print resolution. Nothing is read from disk or resized during a
+    render once the store is loaded.
+    """
+
+    def __init__(self, directory: str, dpi: int):
+        self.directory = directory
+        self.dpi = dpi
+        self._assets: Dict[str, Asset] = {}
+
+    def names(self) -> List[str]:
+        if not path.isdir(self.directory):
+            return []
+        return sorted(
+            filename
+            for filename in os.listdir(self.directory)
+            if is_asset_file(filename)
+        )
+
+    def load(self):
+        """Prepare every asset in the store directory."""
+        for name in self.names():
+            self.get(name)
+
+    def digest(self) -> str:
+        """Returns a digest of the stored images."""
+        digests = []
+        for name in self.names():
+            with open(path.join(self.directory, name), "rb") as asset_file:
+                digests.append((name, hashlib.sha256(asset_file.read()).hexdigest()))
+        return content_key(digests)
+
+    def get(self, name: str) -> Asset:
+        """Returns the prepared asset. Raises KeyError for unknown assets."""
+        if name not in self._assets:
+            if path.basename(name) != name or not is_asset_file(name):
+                raise KeyError(name)
+            try:
+                with open(path.join(self.directory, name), "rb") as asset_file:
+                    data = asset_file.read()
+            except FileNotFoundError:
+                raise KeyError(name)
+            logger.debug(f"Preparing cookbook asset {name}")
+            self._assets[name] = prepare_image(data, self.dpi)
+        return self._assets[name]
+
+    def url_fetcher(self, url: str, *args, **kwargs) -> dict:
+        """WeasyPrint url_fetcher that serves asset: URLs from the store."""
+        if not url.startswith(ASSET_SCHEME):
+            return default_url_fetcher(url, *args, **kwargs)
+        asset = self.get(url[len(ASSET_SCHEME) :])
+        return dict(string=asset.data, mime_type=asset.mime_type, redirected_url=url)
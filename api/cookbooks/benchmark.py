@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+import os
+import random
+import resource
+import sys
+import time
+from typing import Any, Dict, List
+
+from api.cookbooks import generator
+from api.cookbooks.cache import pdf_cache
+from api.cookbooks.engine import RenderEngine
+from api.schemas import RecipeInDB, RecipeIngredientInDB, RecipeStepInDB, User
+from api.settings import settings
+
+COOKBOOK_SIZES = [1, 10, 100, 1000]
+
+# Ranges of ingredient and step counts, taken from typical home cooking recipes.
+INGREDIENT_COUNT = (5, 14)
+STEP_COUNT = (3, 10)
+
+QUANTITIES = ["1", "2", "3", "1/2", "1/4", "3/4", "1 1/2", "200", "400"]
+UNITS = ["cups", "tbsp", "tsp", "grams", "ml", "cloves", "cans", "pinches", ""]
+INGREDIENTS = [
+    "all-purpose flour",
+    "yellow onion, diced",
+    "garlic, minced",
+    "olive oil",
+    "unsalted butter",
+    "kosher salt",
+    "black pepper, freshly ground",
+    "crushed tomatoes",
+    "chicken stock",
+    "brown sugar",
+    "black beans, drained and rinsed",
+    "ground cumin",
+    "smoked paprika",
+    "fresh cilantro, chopped",
+    "lime juice",
+    "whole milk",
+    "large eggs",
+    "baking powder",
+]
+STEPS = [
+    "Preheat the oven to 350°F and grease a 9x13 inch baking dish.",
+    "Heat the oil in a large pot over medium heat until it shimmers.",
+    "Add the onion and cook, stirring occasionally, until soft and translucent, "
+    "about 8 minutes.",
+    "Stir in the garlic and spices and cook until fragrant, about 1 minute.",
+    "Whisk the dry ingredients together in a large bowl.",
+    "Pour in the wet ingredients and fold gently until just combined. A few lumps "
+    "are fine.",
+    "Bring to a boil, then reduce the heat and simmer uncovered for 25 minutes, "
+    "stirring every now and then so nothing catches on the bottom of the pot.",
+    "Season to taste with salt and pepper.",
+    "Bake until golden brown and a toothpick inserted in the center comes out "
+    "clean, 30 to 35 minutes.",
+    "Let rest for 10 minutes before serving.",
+]
+DISHES = ["Chili", "Cornbread", "Lasagna", "Curry", "Pancakes", "Stew", "Salad"]
+ADJECTIVES = ["Grandma's", "Smoky", "Weeknight", "Spicy", "Classic", "Sunday"]
+
+
+def synthetic_author() -> User:
+    return User(id=1, email="bench@example.com", first_name="Bench", last_name="Marker")
+
+
+def synthetic_cookbook(recipe_count: int, seed: int = 0) -> List[RecipeInDB]:
+    """Returns recipe_count recipes with realistic ingredient and step counts.
+    The same count and seed always give the same recipes."""
+    rng = random.Random(seed)
+    author = synthetic_author()
+    recipes = []
+    for recipe_id in range(1, recipe_count + 1):
+        ingredients = [
+            RecipeIngredientInDB(
+                id=recipe_id * 100 + position,
+                recipe_id=recipe_id,
+                position=position,
+                content=" ".join(
+                    [rng.choice(QUANTITIES), rng.choice(UNITS), rng.choice(INGREDIENTS)]
+                ),
+            )
+            for position in range(rng.randint(*INGREDIENT_COUNT))
+        ]
+        steps = [
+            RecipeStepInDB(
+                id=recipe_id * 100 + position,
+                recipe_id=recipe_id,
+                position=position,
+                content=rng.choice(STEPS),
+            )
+            for position in range(rng.randint(*STEP_COUNT))
+        ]
+        recipes.append(
+            RecipeInDB(
+                id=recipe_id,
+                name=f"{rng.choice(ADJECTIVES)} {rng.choice(DISHES)} #{recipe_id}",
+                created_at=datetime.datetime(2021, 11, 14)
+                + datetime.timedelta(hours=recipe_id),
+                author_id=author.id,
+                author=author,
+                ingredients=ingredients,
+                steps=steps,
+            )
+        )
+    return recipes
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def measure(recipe_count: int, shards: int = 1) -> Dict[str, Any]:
+    """
+    Renders a synthetic cookbook without the PDF and fragment caches, and returns
+    the cost of the render. Peak RSS covers the whole process, so call this once per
+    fresh process to get comparable numbers. With shards > 1 the cookbook is split
+    like the app splits large cookbooks, and rendered by a render engine with a
+    worker per shard. CPU time and peak RSS then do not include those workers.
+    """
+    recipes = synthetic_cookbook(recipe_count)
+    author = synthetic_author()
+    generator.fragment_cache.clear()
+
+    setup_start = time.perf_counter()
+    generator.get_context()  # Fonts, templates and assets are loaded at startup.
+    setup_seconds = time.perf_counter() - setup_start
+    rss_before_render = peak_rss_bytes()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if shards > 1:
+        pdf_bytes = render_in_engine(author, recipes, shards)
+    else:
+        pdf_bytes = len(
+            generator.generate_pdf_from_recipes(author, recipes, use_cache=False)
+        )
+    cpu_seconds = time.process_time() - cpu_start
+    wall_seconds = time.perf_counter() - wall_start
+
+    return {
+        "recipes": recipe_count,
+        "shards": shards,
+        "ingredients": sum(len(recipe.ingredients) for recipe in recipes),
+        "steps": sum(len(recipe.steps) for recipe in recipes),
+        "setup_seconds": setup_seconds,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "rss_before_render_bytes": rss_before_render,
+        "pdf_bytes": pdf_bytes,
+    }
+
+
+def render_in_engine(author: User, recipes: List[RecipeInDB], shards: int) -> int:
+    """Renders the recipes in shards in a new render engine and returns the size of
+    the PDF. The PDF is removed from the PDF cache before and after the render."""
+    engine = RenderEngine(
+        workers=shards,
+        timeout=settings.pdf_render_timeout,
+        queue_depth=0,
+        shards=shards,
+    )
+    pdf_path = pdf_cache.path_for(generator.cookbook_cache_key(author, recipes))
+    try:
+        remove_file(pdf_path)
+        with asyncio.run(engine.render(author, recipes)) as pdf_file:
+            return os.fstat(pdf_file.fileno()).st_size
+    finally:
+        engine.shutdown()
+        remove_file(pdf_path)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Iterator, Optional
+
+from api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(*parts: Any) -> str:
+    """Return a stable sha256 hex digest of the given JSON serializable parts."""
+    serialized = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class PDFCache:
+    """
+    Content-addressed store of rendered PDFs on local disk.
+    Files are named after the hash of everything that went into the render, so a
+    key never needs invalidating: changed recipes or templates produce a new key.
+    The least recently used files are evicted once the directory exceeds max_bytes.
+    Writes are atomic, so worker processes can share one cache directory.
+    """
+
+    SUFFIX = ".pdf"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """Returns the cached PDF opened for reading, or None on a cache miss.
+        An open file stays readable even if the PDF is evicted afterwards."""
+        path = self.path_for(key)
+        try:
+            pdf_file = open(path, "rb")
+        except FileNotFoundError:
+            logger.debug(f"PDF cache miss for {key}")
+            return None
+        try:
+            os.utime(path)  # Mark as recently used.
+        except FileNotFoundError:
+            pass
+        logger.debug(f"PDF cache hit for {key}")
+        return pdf_file
+
+    def get(self, key: str) -> Optional[bytes]:
+        pdf_file = self.open(key)
+        if pdf_file is None:
+            return None
+        with pdf_file:
+            return pdf_file.read()
+
+    @contextmanager
+    def writer(self, key: str) -> Iterator[BinaryIO]:
+        """Context manager yielding a file to write the PDF for key into. The PDF
+        only appears in the cache once the block exits without an error."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                yield tmp_file
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, self.path_for(key))
+        self.evict(keep=key)
+
+    def put(self, key: str, pdf: bytes):
+        with self.writer(key) as pdf_file:
+            pdf_file.write(pdf)
+
+    def evict(self, keep: Optional[str] = None):
+        """Delete the least recently used PDFs until the cache fits in max_bytes.
+        The PDF for the keep key is never evicted, so that it can be read back."""
+        keep_path = self.path_for(keep) if keep else None
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.directory) as dir_entries:
+            for entry in dir_entries:
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Evicted by another process.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith(self.SUFFIX):
+                os.remove(os.path.join(self.directory, filename))
+
+
+class MemoryLRUCache:
+    """A process-local cache that keeps the max_entries most recently used values."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+pdf_cache = PDFCache(settings.pdf_cache_dir, settings.pdf_cache_max_bytes)
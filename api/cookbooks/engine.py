@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, List, Optional, Union
+
+from api import models, schemas
+from api.cookbooks import generator
+from api.cookbooks.cache import pdf_cache
+from api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Raised when every worker is busy and the render queue is already full."""
+
+
+class RenderTimeout(Exception):
+    """Raised when a render job does not finish within the configured timeout."""
+
+
+class RenderEngine:
+    """
+    Runs cookbook PDF renders in a bounded pool of worker processes.
+    WeasyPrint layout is CPU bound and holds the GIL, so rendering in the request
+    handler would stall every other request on the worker. Handlers await `render`
+    instead, which keeps the event loop free while a worker process does the work.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        timeout: float,
+        queue_depth: int,
+        shards: int = 1,
+        shard_min_recipes: int = 0,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.queue_depth = queue_depth
+        self.shards = shards
+        self.shard_min_recipes = shard_min_recipes
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Slots of the jobs that are running or waiting for a worker. A sharded
+        # render takes one for each shard.
+        self._pending = 0
+        # Jobs finish on the pool's thread, which returns their slots.
+        self._lock = threading.Lock()
+
+    @property
+    def max_pending(self) -> int:
+        return self.workers + self.queue_depth
+
+    def shards_for(self, recipes: List[schemas.RecipeInDB]) -> int:
+        """Large cookbooks are split into shards, which the pool's workers render in
+        parallel before one of them assembles the cookbook. There are never more
+        shards than workers, so a sharded render can occupy the whole pool, but its
+        shards do not queue behind each other."""
+        if len(recipes) < self.shard_min_recipes:
+            return 1
+        return min(self.shards, self.workers, len(recipes))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # The pool is created lazily so that importing the app does not fork workers.
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Load fonts, templates and stylesheets before the first job arrives.
+                initializer=generator.get_context,
+            )
+        return self._pool
+
+    async def render(
+        self,
+        author: Union[models.User, schemas.User],
+        recipes: List[schemas.RecipeInDB],
+        html_template_name: str = "html/recipe-card.html",
+        css_template_name: str = "css/recipe-card.css",
+    ) -> BinaryIO:
+        """Render the recipes to a PDF in a worker process and return the PDF opened
+        for reading. Cached PDFs are opened directly, without using a worker.
+        The caller is responsible for closing the file.
+        Raises TemplateNotFound for unknown templates before using a worker."""
+        layout = generator.get_layout(html_template_name, css_template_name)
+        cached_pdf = pdf_cache.open(
+            generator.cookbook_cache_key(
+                author, recipes, html_template_name, css_template_name
+            )
+        )
+        if cached_pdf:
+            return cached_pdf
+
+        # A sharded render keeps a worker busy for each of its shards, so it takes
+        # a slot for each of them.
+        shards = self.shards_for(recipes) if layout.is_incremental else 1
+        if self._pending + shards > self.max_pending:
+            raise RenderQueueFull(
+                f"{self._pending} render jobs are already queued or running"
+            )
+
+        with self._lock:
+            self._pending += shards
+        shard_dir = tempfile.mkdtemp(prefix="cookbook-shards-") if shards > 1 else None
+        jobs: List[Future] = []
+        # ORM objects do not cross processes.
+        author = schemas.User.from_orm(author)
+        try:
+            pdf_path = await asyncio.wait_for(
+                self._render_in_pool(
+                    jobs,
+                    shards,
+                    shard_dir,
+                    author,
+                    recipes,
+                    html_template_name,
+                    css_template_name,
+                ),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"PDF render timed out after {self.timeout} seconds")
+            raise RenderTimeout(f"PDF render took longer than {self.timeout} seconds")
+        finally:
+            self._release_when_done(jobs, shards, shard_dir)
+        # The worker wrote the PDF into the cache. Opening it straight away keeps
+        # it readable even if the cache evicts it before the response is sent.
+        return open(pdf_path, "rb")
+
+    async def _render_in_pool(
+        self,
+        jobs: List[Future],
+        shards: int,
+        shard_dir: Optional[str],
+        author: schemas.User,
+        recipes: List[schemas.RecipeInDB],
+        html_template_name: str,
+        css_template_name: str,
+    ) -> str:
+        """Renders the cookbook's shards into files in shard_dir, if it is split
+        into more than one, then the cookbook, and returns the path of its PDF.
+        Every job submitted to the pool is added to jobs."""
+        shard_results = None
+        if shard_dir:
+            layout = generator.get_layout(html_template_name, css_template_name)
+            shard_results = await asyncio.gather(
+                *(
+                    self._submit(jobs, generator.render_shard, shard, layout, shard_dir)
+                    for shard in generator.split_shards(recipes, shards)
+                )
+            )
+        return await self._submit(
+            jobs,
+            generator.render_pdf_file,
+            author,
+            recipes,
+            html_template_name,
+            css_template_name,
+            shard_results,
+        )
+
+    async def _submit(self, jobs: List[Future], fn: Callable, *args) -> Any:
+        job = self._get_pool().submit(fn, *args)
+        jobs.append(job)
+        return await asyncio.wrap_future(job)
+
+    def _release_when_done(
+        self, jobs: List[Future], slots: int, shard_dir: Optional[str]
+    ):
+        """
+        Returns the render's slots and removes its shard files once none of its jobs
+        is running anymore, rather than when the caller stops waiting for them. A
+        job that times out keeps its worker busy until WeasyPrint finishes, so it
+        still counts against max_pending until then. Jobs that time out before a
+        worker picked them up are cancelled.
+        """
+        running = [job for job in jobs if not job.done()]
+        remaining = len(running)
+
+        def job_done(_):
+            nonlocal remaining
+            with self._lock:
+                remaining -= 1
+                if remaining:
+                    return
+            release()
+
+        def release():
+            if shard_dir:
+                shutil.rmtree(shard_dir, ignore_errors=True)
+            self._release(slots)
+
+        if not running:
+            release()
+        for job in running:
+            job.add_done_callback(job_done)
+
+    def _release(self, slots: int):
+        with self._lock:
+            self._pending -= slots
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+render_engine = RenderEngine(
+    workers=settings.pdf_render_workers,
+    timeout=settings.pdf_render_timeout,
+    queue_depth=settings.pdf_render_queue_depth,
+    shards=settings.pdf_render_shards,
+    shard_min_recipes=settings.pdf_render_shard_min_recipes,
+)
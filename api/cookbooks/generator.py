@@ -1,22 +1,104 @@
+import io
 import logging
+import math
+import os
 from os import path
 import random
 import string
-from typing import List, Optional
+import tempfile
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
 
-from weasyprint import HTML, CSS
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
+from pypdf.generic import Fit
+from weasyprint import HTML, CSS, Document, Page
 from weasyprint.text.fonts import FontConfiguration
-from jinja2 import Environment, PackageLoader, select_autoescape
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    PackageLoader,
+    Template,
+    TemplateNotFound,
+    select_autoescape,
+)
 
 from api.models import User
+from api import schemas
 from api.schemas import RecipeInDB
+from api.cookbooks.assets import AssetStore, asset_url, assets_dir, is_asset_file
+from api.cookbooks.cache import MemoryLRUCache, content_key, pdf_cache
+from api.settings import settings
 
 FILENAME_LENGTH = 40
+MAX_FRONT_MATTER_PASSES = 3
+PX_TO_PT = 0.75  # WeasyPrint positions are in CSS pixels, PDF positions in points.
+TEMPLATE_EXTENSIONS = ["html", "css"]
+
+
+class Layout(NamedTuple):
+    """The templates that make up a cookbook layout. Layouts with front, recipe and
+    page numbers templates are built incrementally from separately rendered
+    recipes."""
+
+    html_template_name: str
+    css_template_name: str
+    front_template_name: Optional[str] = None
+    recipe_template_name: Optional[str] = None
+    page_numbers_template_name: Optional[str] = None
+
+    @property
+    def is_incremental(self) -> bool:
+        return bool(
+            self.front_template_name
+            and self.recipe_template_name
+            and self.page_numbers_template_name
+        )
+
+
+class Fragment(NamedTuple):
+    """A recipe laid out on pages of its own, written to a PDF without page
+    numbers. The pages are numbered when the cookbook is assembled."""
+
+    pdf: bytes
+    page_count: int
+    anchors: Dict[str, Tuple[int, float, float]]  # Name to (page in fragment, x, y).
+
+
+class ShardResult(NamedTuple):
+    """The fragments of consecutive recipes, written to a PDF file by a render
+    worker so that they can be assembled by another."""
+
+    pdf: str  # Path of the PDF file.
+    page_counts: List[int]  # Pages of each recipe in the shard.
+    anchors: Dict[str, Tuple[int, float, float]]  # Name to (page in shard, x, y).
+
+
+LAYOUTS = {
+    "recipe-card": Layout(
+        html_template_name="html/recipe-card.html",
+        css_template_name="css/recipe-card.css",
+        front_template_name="html/recipe-card-front.html",
+        recipe_template_name="html/recipe-card-recipe.html",
+        page_numbers_template_name="html/recipe-card-page-numbers.html",
+    ),
+}
 
 
 logger = logging.getLogger(__name__)
-env = Environment(loader=PackageLoader("api.cookbooks"))
+
+# Outside of debug mode templates are compiled once, when this module is imported,
+# and template or asset changes are only picked up after a restart.
+auto_reload = settings.debug
+os.makedirs(settings.pdf_template_cache_dir, exist_ok=True)
+env = Environment(
+    loader=PackageLoader("api.cookbooks"),
+    bytecode_cache=FileSystemBytecodeCache(settings.pdf_template_cache_dir),
+    auto_reload=auto_reload,
+)
+env.globals["asset_url"] = asset_url
 template_dir = path.abspath(path.join(path.curdir, "api", "cookbooks", "templates"))
+template_source_dir = path.join(path.dirname(__file__), "templates")
+fragment_cache = MemoryLRUCache(settings.pdf_fragment_cache_size)
 
 
 def generate_filename() -> str:
@@ -28,37 +110,471 @@ def generate_filename() -> str:
     )
 
 
+def template_sources_digest() -> str:
+    """Returns a digest of every template source, including partials, CSS and
+    image assets."""
+    return content_key(
+        [
+            (name, env.loader.get_source(env, name)[0])
+            for name in env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+        ],
+        AssetStore(assets_dir, settings.pdf_image_dpi).digest(),
+    )
+
+
+def _template_mtimes() -> Dict[str, float]:
+    mtimes = {}
+    for dirpath, _, filenames in os.walk(template_source_dir):
+        for filename in filenames:
+            if filename.endswith((".html", ".css")) or is_asset_file(filename):
+                filepath = path.join(dirpath, filename)
+                mtimes[filepath] = os.stat(filepath).st_mtime
+    return mtimes
+
+
+_sources_digest: Optional[str] = None
+_sources_digest_mtimes: Dict[str, float] = {}
+
+
+def current_sources_digest() -> str:
+    """Returns template_sources_digest(), only re-reading the sources when a
+    template file changed."""
+    global _sources_digest, _sources_digest_mtimes
+    if _sources_digest is not None and not auto_reload:
+        return _sources_digest
+    mtimes = _template_mtimes()
+    if _sources_digest is None or mtimes != _sources_digest_mtimes:
+        _sources_digest = template_sources_digest()
+        _sources_digest_mtimes = mtimes
+    return _sources_digest
+
+
+class GeneratorContext:
+    """
+    Everything a render needs that does not depend on the recipes: a warmed font
+    configuration, compiled templates, parsed stylesheets, resized image assets and
+    the images WeasyPrint decoded from them. One context is shared by all renders in
+    a process and replaced when a template or asset file changes.
+    """
+
+    def __init__(self):
+        self.font_config = FontConfiguration()
+        self.template_mtimes = _template_mtimes()
+        self.assets = AssetStore(assets_dir, settings.pdf_image_dpi)
+        self.image_cache: Dict[str, object] = {}
+        self._templates: Dict[str, Template] = {}
+        self._stylesheets: Dict[str, CSS] = {}
+
+    def warm(self):
+        """Compile the templates, parse the stylesheets of every layout and resize
+        the image assets."""
+        self.assets.load()
+        for layout in LAYOUTS.values():
+            for template_name in layout:
+                if template_name:
+                    self.template(template_name)
+            self.stylesheet(layout.css_template_name)
+
+    def is_stale(self) -> bool:
+        return _template_mtimes() != self.template_mtimes
+
+    def template(self, name: str) -> Template:
+        if name not in self._templates:
+            self._templates[name] = get_template(name)
+        return self._templates[name]
+
+    def stylesheet(self, name: str) -> CSS:
+        if name not in self._stylesheets:
+            css_content = self.template(name).render(template_dir=template_dir)
+            self._stylesheets[name] = CSS(
+                string=css_content, font_config=self.font_config
+            )
+        return self._stylesheets[name]
+
+
+_context: Optional[GeneratorContext] = None
+
+
+def get_context() -> GeneratorContext:
+    """Returns this process's generator context. In debug mode the context is
+    rebuilt when a template changed."""
+    global _context
+    if _context is None or (auto_reload and _context.is_stale()):
+        logger.debug("Loading cookbook templates, stylesheets and fonts")
+        _context = GeneratorContext()
+        _context.warm()
+    return _context
+
+
+def get_template(name: str) -> Template:
+    """Returns the compiled template. Raises TemplateNotFound, listing the known
+    templates, for unknown names."""
+    try:
+        return env.get_template(name)
+    except TemplateNotFound:
+        known_templates = ", ".join(env.list_templates(extensions=TEMPLATE_EXTENSIONS))
+        raise TemplateNotFound(
+            name,
+            f"Unknown cookbook template {name!r}. Known templates: {known_templates}",
+        )
+
+
+def compile_templates() -> Dict[str, Template]:
+    """Compiles every template, and checks that the templates of every layout exist."""
+    templates = {
+        name: env.get_template(name)
+        for name in env.list_templates(extensions=TEMPLATE_EXTENSIONS)
+    }
+    for layout in LAYOUTS.values():
+        for name in layout:
+            if name:
+                get_template(name)
+    return templates
+
+
+def get_layout(html_template_name: str, css_template_name: str) -> Layout:
+    """Returns the registered layout using the given templates. Other combinations of
+    templates are rendered as a single document. Raises TemplateNotFound for
+    unknown templates."""
+    for layout in LAYOUTS.values():
+        if (layout.html_template_name, layout.css_template_name) == (
+            html_template_name,
+            css_template_name,
+        ):
+            return layout
+    get_template(html_template_name)
+    get_template(css_template_name)
+    return Layout(html_template_name, css_template_name)
+
+
+def cookbook_cache_key(
+    author: Union[User, schemas.User],
+    recipes: List[RecipeInDB],
+    html_template_name: str = "html/recipe-card.html",
+    css_template_name: str = "css/recipe-card.css",
+) -> str:
+    """Returns a key that changes whenever anything rendered into the PDF changes:
+    the recipes, the author's name or the template and CSS sources."""
+    return content_key(
+        [recipe.dict() for recipe in recipes],
+        {"first_name": author.first_name, "last_name": author.last_name},
+        html_template_name,
+        css_template_name,
+        current_sources_digest(),
+    )
+
+
 def generate_pdf_from_recipes(
-    author: User,
+    author: Union[User, schemas.User],
     recipes: List[RecipeInDB],
     html_template_name: str = "html/recipe-card.html",
     css_template_name: str = "css/recipe-card.css",
+    use_cache: bool = True,
 ) -> bytes:
     """Generates a byte stream of a PDF file containing the given recipes
-    formatted to the given template"""
+    formatted to the given template. Previously rendered PDFs are served from the
+    PDF cache without rendering."""
 
-    html_template = env.get_template(html_template_name)
-    css_template = env.get_template(css_template_name)
-    # Put CSS in style tag of the HTML.
-    css_content = css_template.render(template_dir=template_dir)
+    cache_key = None
+    if use_cache:
+        cache_key = cookbook_cache_key(
+            author, recipes, html_template_name, css_template_name
+        )
+        cached_pdf = pdf_cache.get(cache_key)
+        if cached_pdf:
+            return cached_pdf
+
+    pdf = write_cookbook_pdf(author, recipes, html_template_name, css_template_name)
+
+    if pdf:
+        if cache_key:
+            pdf_cache.put(cache_key, pdf)
+        return pdf
+    else:
+        raise Exception("Failed to generate PDF")
 
-    html = html_template.render(
+
+def render_pdf_file(
+    author: Union[User, schemas.User],
+    recipes: List[RecipeInDB],
+    html_template_name: str = "html/recipe-card.html",
+    css_template_name: str = "css/recipe-card.css",
+    shards: Optional[List[ShardResult]] = None,
+) -> str:
+    """Renders the recipes into the PDF cache and returns the path of the PDF, so
+    that its bytes are not sent back from the render worker. Incremental layouts
+    take the recipe fragments from shards rendered by render_shard, when they are
+    given, and are assembled in memory before the PDF is written."""
+    cache_key = cookbook_cache_key(
+        author, recipes, html_template_name, css_template_name
+    )
+    cached_pdf = pdf_cache.open(cache_key)
+    if cached_pdf:
+        cached_pdf.close()
+    else:
+        with pdf_cache.writer(cache_key) as pdf_file:
+            write_cookbook_pdf(
+                author,
+                recipes,
+                html_template_name,
+                css_template_name,
+                target=pdf_file,
+                shards=shards,
+            )
+    return pdf_cache.path_for(cache_key)
+
+
+def write_cookbook_pdf(
+    author: Union[User, schemas.User],
+    recipes: List[RecipeInDB],
+    html_template_name: str,
+    css_template_name: str,
+    target: Optional[BinaryIO] = None,
+    shards: Optional[List[ShardResult]] = None,
+) -> Optional[bytes]:
+    """Renders the cookbook and writes the PDF to target, or returns its bytes if
+    there is no target. Layouts that are built incrementally can take the recipe
+    fragments from shards rendered beforehand."""
+    layout = get_layout(html_template_name, css_template_name)
+    if layout.is_incremental:
+        if shards:
+            page_counts = [count for shard in shards for count in shard.page_counts]
+            return assemble_cookbook(
+                author, recipes, layout, shards, page_counts, target
+            )
+        return write_incremental_pdf(author, recipes, layout, target=target)
+    document = render_document(
+        layout.html_template_name,
+        layout.css_template_name,
         cookbook_name=f"{author.last_name} Family Cookbook",
         by_line=f"By {author.first_name} {author.last_name}",
         recipes=recipes,
-        template_base_url=template_dir,
-        css_content=css_content,
     )
+    return document.write_pdf(target=target)
 
-    font_config = FontConfiguration()
+
+def render_document(template_name: str, css_template_name: str, **context) -> Document:
+    """Renders the HTML template and lays it out into pages."""
+    generator_context = get_context()
+    html = generator_context.template(template_name).render(
+        template_base_url=template_dir, **context
+    )
 
     logger.debug(f"Generated HTML: {html}")
 
-    pdf: Optional[bytes] = HTML(string=html).write_pdf(
-        font_config=font_config,
+    return HTML(string=html, url_fetcher=generator_context.assets.url_fetcher).render(
+        stylesheets=[generator_context.stylesheet(css_template_name)],
+        font_config=generator_context.font_config,
+        image_cache=generator_context.image_cache,
     )
 
-    if pdf:
-        return pdf
-    else:
-        raise Exception("Failed to generate PDF")
+
+def write_incremental_pdf(
+    author: Union[User, schemas.User],
+    recipes: List[RecipeInDB],
+    layout: Layout,
+    target: Optional[BinaryIO] = None,
+) -> Optional[bytes]:
+    """
+    Builds a cookbook from a freshly rendered cover and table of contents followed by
+    one separately rendered fragment per recipe. Fragments do not depend on where
+    the recipe ends up in the cookbook, so rebuilding a cookbook only lays out the
+    recipes that changed.
+    """
+    fragments = [render_recipe_fragment(recipe, layout) for recipe in recipes]
+    page_counts = [fragment.page_count for fragment in fragments]
+    return assemble_cookbook(author, recipes, layout, fragments, page_counts, target)
+
+
+def render_recipe_fragment(recipe: RecipeInDB, layout: Layout) -> Fragment:
+    """Returns the pages of a single recipe, laid out without page numbers."""
+    key = content_key(recipe.dict(), layout, current_sources_digest())
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        document = render_document(
+            layout.recipe_template_name, layout.css_template_name, recipe=recipe
+        )
+        fragment = Fragment(
+            document.write_pdf(), len(document.pages), page_anchors(document.pages)
+        )
+        fragment_cache.put(key, fragment)
+    return fragment
+
+
+def page_anchors(pages: List[Page]) -> Dict[str, Tuple[int, float, float]]:
+    """Returns the position of every anchor on the pages, by name."""
+    anchors: Dict[str, Tuple[int, float, float]] = {}
+    for page_index, page in enumerate(pages):
+        for name, (x, y) in page.anchors.items():
+            anchors.setdefault(name, (page_index, x, y))
+    return anchors
+
+
+def split_shards(recipes: List[RecipeInDB], shards: int) -> List[List[RecipeInDB]]:
+    """Splits the recipes into at most that many shards of consecutive recipes."""
+    shard_size = math.ceil(len(recipes) / shards)
+    return [
+        recipes[start : start + shard_size]
+        for start in range(0, len(recipes), shard_size)
+    ]
+
+
+def render_shard(
+    recipes: List[RecipeInDB], layout: Layout, directory: str
+) -> ShardResult:
+    """Renders the fragments of consecutive recipes into a new PDF file in
+    directory. Shards of a cookbook are rendered by render workers in parallel."""
+    fragments = [render_recipe_fragment(recipe, layout) for recipe in recipes]
+    writer = PdfWriter()
+    anchors = append_pdfs(writer, fragments)
+    fd, pdf_path = tempfile.mkstemp(dir=directory, suffix=".pdf")
+    with os.fdopen(fd, "wb") as pdf_file:
+        writer.write(pdf_file)
+    return ShardResult(
+        pdf_path, [fragment.page_count for fragment in fragments], anchors
+    )
+
+
+def render_front_matter(
+    author: Union[User, schemas.User],
+    recipes: List[RecipeInDB],
+    layout: Layout,
+    page_counts: List[int],
+) -> Document:
+    """Lays out the cover and table of contents of recipes that take up the given
+    numbers of pages, in order."""
+    front_context = dict(
+        cookbook_name=f"{author.last_name} Family Cookbook",
+        by_line=f"By {author.first_name} {author.last_name}",
+        recipes=recipes,
+    )
+    # The length of the table of contents hardly depends on the page numbers in it,
+    # so a first pass with placeholder numbers tells us where the recipes start.
+    page_numbers = {recipe.id: 0 for recipe in recipes}
+    front = render_document(
+        layout.front_template_name,
+        layout.css_template_name,
+        page_numbers=page_numbers,
+        **front_context,
+    )
+
+    for _ in range(MAX_FRONT_MATTER_PASSES):
+        front_page_count = len(front.pages)
+        next_page = front_page_count + 1
+        page_numbers = {}
+        for recipe, page_count in zip(recipes, page_counts):
+            page_numbers[recipe.id] = next_page
+            next_page += page_count
+
+        front = render_document(
+            layout.front_template_name,
+            layout.css_template_name,
+            page_numbers=page_numbers,
+            **front_context,
+        )
+        if len(front.pages) == front_page_count:
+            return front
+        # Longer page numbers pushed the table of contents onto another page.
+        # Lay out again so that the recipe page numbers account for it.
+    raise Exception("Could not lay out the cookbook's table of contents")
+
+
+def assemble_cookbook(
+    author: Union[User, schemas.User],
+    recipes: List[RecipeInDB],
+    layout: Layout,
+    parts: Sequence[Union[Fragment, ShardResult]],
+    page_counts: List[int],
+    target: Optional[BinaryIO] = None,
+) -> Optional[bytes]:
+    """
+    Appends the recipe pages of the parts, fragments or shards, to the cover and
+    table of contents, numbers them and links the table of contents to the recipes.
+    page_counts are the pages of each recipe. Writes the PDF to target, or returns
+    its bytes if there is no target.
+    """
+    front = render_front_matter(author, recipes, layout, page_counts)
+    writer = PdfWriter()
+    front_pdf = PdfReader(io.BytesIO(front.write_pdf()))
+    writer.append(front_pdf)
+    if front_pdf.metadata:
+        writer.add_metadata(front_pdf.metadata)
+
+    anchors = append_pdfs(writer, parts)
+    number_pages(writer, layout, first_index=len(front.pages))
+    link_contents(writer, front, anchors)
+
+    if target is not None:
+        writer.write(target)
+        return None
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def append_pdfs(
+    writer: PdfWriter, parts: Sequence[Union[Fragment, ShardResult]]
+) -> Dict[str, Tuple[int, float, float]]:
+    """Appends the pages of the parts' PDFs, given as bytes or file paths, to the
+    writer. Returns the parts' anchors as (page in writer, x, y), by name."""
+    anchors: Dict[str, Tuple[int, float, float]] = {}
+    for part in parts:
+        page_offset = len(writer.pages)
+        pdf = part.pdf if isinstance(part.pdf, str) else io.BytesIO(part.pdf)
+        writer.append(PdfReader(pdf))
+        for name, (page_index, x, y) in part.anchors.items():
+            anchors.setdefault(name, (page_offset + page_index, x, y))
+    return anchors
+
+
+def number_pages(writer: PdfWriter, layout: Layout, first_index: int):
+    """Draws page numbers onto the writer's pages from first_index on, which were
+    laid out without them. The numbers are laid out in a document of their own,
+    with the layout's stylesheet."""
+    page_count = len(writer.pages) - first_index
+    if page_count <= 0:
+        return
+    numbers = render_document(
+        layout.page_numbers_template_name,
+        layout.css_template_name,
+        first_page=first_index + 1,
+        page_count=page_count,
+    )
+    numbers_pdf = PdfReader(io.BytesIO(numbers.write_pdf()))
+    for page, numbers_page in zip(writer.pages[first_index:], numbers_pdf.pages):
+        page.merge_page(numbers_page)
+        page.compress_content_streams()
+
+
+def link_contents(
+    writer: PdfWriter, front: Document, anchors: Dict[str, Tuple[int, float, float]]
+):
+    """Links the table of contents to the anchors, given as (page, x, y) in the
+    writer. WeasyPrint drops links to anchors outside of the front matter when it
+    is written on its own, so they are added again here."""
+    for page_index, page in enumerate(front.pages):
+        page_top = float(writer.pages[page_index].mediabox.top)
+        for link_type, anchor, (x1, y1, x2, y2), _ in page.links:
+            if link_type != "internal" or anchor not in anchors:
+                continue
+            target_index, x, y = anchors[anchor]
+            target_top = float(writer.pages[target_index].mediabox.top)
+            writer.add_annotation(
+                page_index,
+                Link(
+                    rect=(
+                        x1 * PX_TO_PT,
+                        page_top - y2 * PX_TO_PT,
+                        x2 * PX_TO_PT,
+                        page_top - y1 * PX_TO_PT,
+                    ),
+                    target_page_index=target_index,
+                    fit=Fit.xyz(left=x * PX_TO_PT, top=target_top - y * PX_TO_PT),
+                ),
+            )
+
+
+# Compile every template up front, so that no render pays for it. Forked render
+# workers inherit the compiled templates, and new processes load their bytecode
+# from the bytecode cache instead of compiling them again.
+compile_templates()
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api import crud, models, schemas
+from api.cookbooks.engine import render_engine
+from api.database import AsyncSessionLocal, read_sessionmaker
+from api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STAGES = ("done", "failed")
+JOB_POLL_INTERVAL = 0.5  # Seconds between reads of a job whose events are streamed.
+
+
+class TooManyJobs(Exception):
+    """Raised when an author already has the maximum number of unfinished jobs."""
+
+
+def job_status(job: models.CookbookJob) -> schemas.CookbookJobStatus:
+    return schemas.CookbookJobStatus(
+        id=job.id,
+        author_id=job.author_id,
+        stage=job.stage,
+        progress=job.progress,
+        detail=job.detail,
+        download_url=f"/cookbook-jobs/{job.id}/pdf/" if job.pdf_path else None,
+    )
+
+
+def expired_before() -> datetime:
+    """Jobs that were last updated before this are expired."""
+    return datetime.utcnow() - timedelta(seconds=settings.pdf_job_ttl)
+
+
+async def create_job(db: AsyncSession, author_id: int) -> models.CookbookJob:
+    """
+    Creates a queued job for the author. An author keeps at most pdf_jobs_per_author
+    jobs: their oldest finished jobs are removed to make room for the new one, and
+    TooManyJobs is raised when all of them are still running.
+    """
+    await prune_jobs(db)
+    result = await db.execute(
+        select(models.CookbookJob)
+        .where(models.CookbookJob.author_id == author_id)
+        .order_by(models.CookbookJob.updated_at)
+    )
+    jobs = result.scalars().all()
+    finished = [job for job in jobs if job.stage in FINISHED_STAGES]
+    excess = len(jobs) + 1 - settings.pdf_jobs_per_author
+    if excess > len(finished):
+        raise TooManyJobs(
+            f"{len(jobs) - len(finished)} cookbooks are already being generated"
+        )
+    for job in finished[: max(excess, 0)]:
+        await remove_job(db, job)
+
+    job = models.CookbookJob(
+        id=uuid.uuid4().hex,
+        author_id=author_id,
+        stage="queued",
+        progress=0.0,
+        updated_at=datetime.utcnow(),
+    )
+    db.add(job)
+    await db.commit()
+    return job
+
+
+async def get_job(db: AsyncSession, job_id: str) -> Optional[models.CookbookJob]:
+    """Returns the job, or None if it does not exist or expired."""
+    result = await db.execute(
+        select(models.CookbookJob)
+        .where(models.CookbookJob.id == job_id)
+        .where(models.CookbookJob.updated_at >= expired_before())
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+
+async def update_job(
+    db: AsyncSession,
+    job: models.CookbookJob,
+    stage: str,
+    progress: float,
+    detail: Optional[str] = None,
+):
+    job.stage = stage
+    job.progress = progress
+    job.detail = detail
+    job.updated_at = datetime.utcnow()
+    await db.commit()
+
+
+async def remove_job(db: AsyncSession, job: models.CookbookJob):
+    if job.pdf_path:
+        # Downloads that already opened the PDF can still finish.
+        remove_job_pdf(job.pdf_path)
+    await db.delete(job)
+
+
+async def prune_jobs(db: AsyncSession):
+    """Removes the jobs that expired, and their PDFs. Unfinished jobs expire too, so
+    that jobs of a process that stopped do not count against their author."""
+    result = await db.execute(
+        select(models.CookbookJob.pdf_path).where(
+            models.CookbookJob.updated_at < expired_before(),
+            models.CookbookJob.pdf_path.isnot(None),
+        )
+    )
+    for pdf_path in result.scalars():
+        remove_job_pdf(pdf_path)
+    await db.execute(
+        delete(models.CookbookJob)
+        .where(models.CookbookJob.updated_at < expired_before())
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def job_statuses(job_id: str) -> AsyncIterator[schemas.CookbookJobStatus]:
+    """
+    Yields the job's current status, then every change until it finishes. The job
+    may be run by another process, so its row is read again every
+    JOB_POLL_INTERVAL seconds, each time in a session of its own. No connection, or
+    old snapshot of the row, is held while it waits, and the stream does not depend
+    on the request's session, which may be closed before the stream ends.
+    """
+    last_status = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            job = await get_job(db, job_id)
+            status = job_status(job) if job else None
+        if status is None:
+            return
+        if status != last_status:
+            yield status
+            last_status = status
+        if status.stage in FINISHED_STAGES:
+            return
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+def keep_job_pdf(job_id: str, pdf_file: BinaryIO) -> str:
+    """
+    Keeps the rendered PDF for the job's downloads, outside of the PDF cache, which
+    may evict it before the job expires. The file is linked to the cached PDF when
+    it can be, and copied from the open file otherwise. Returns its path.
+    """
+    os.makedirs(settings.pdf_job_dir, exist_ok=True)
+    job_path = os.path.join(settings.pdf_job_dir, f"{job_id}.pdf")
+    try:
+        os.link(pdf_file.name, job_path)
+    except OSError:  # Evicted, or the job directory is on another file system.
+        pdf_file.seek(0)
+        with open(job_path, "wb") as job_file:
+            shutil.copyfileobj(pdf_file, job_file)
+    return job_path
+
+
+def remove_job_pdf(pdf_path: str):
+    try:
+        os.remove(pdf_path)
+    except FileNotFoundError:
+        pass
+
+
+async def load_cookbook(
+    author_id: int,
+) -> Tuple[Optional[schemas.User], List[schemas.RecipeInDB]]:
+    """Loads the author and their recipes from the primary, which has the recipes
+    they just wrote, in a session that is closed before the cookbook is rendered."""
+    async with read_sessionmaker(True)() as read_db:
+        author = await crud.get_user(read_db, author_id)
+        if not author:
+            return None, []
+        recipes = await crud.get_author_recipes(read_db, author.id)
+        return (
+            schemas.User.from_orm(author),
+            [schemas.RecipeInDB.from_orm(recipe) for recipe in recipes],
+        )
+
+
+async def run_cookbook_job(job_id: str):
+    """
+    Renders the author's recipes into the job's PDF file. Jobs run after their
+    request's response was sent, so they open sessions of their own, like the
+    maintenance tasks, rather than using the request's. The job's progress is
+    written in a session on the primary.
+    """
+    async with AsyncSessionLocal() as db:
+        job = await get_job(db, job_id)
+        if not job:  # Expired before it started.
+            return
+        try:
+            await update_job(db, job, "loading", 0.1)
+            author, recipe_list = await load_cookbook(job.author_id)
+            if not author:
+                await update_job(db, job, "failed", 1.0, detail="User does not exist")
+                return
+
+            await update_job(db, job, "rendering", 0.3)
+            with await render_engine.render(author, recipe_list) as pdf_file:
+                job.pdf_path = keep_job_pdf(job.id, pdf_file)
+            await update_job(db, job, "done", 1.0)
+        except Exception as e:
+            logger.exception(f"Cookbook job {job.id} failed")
+            await db.rollback()
+            await update_job(db, job, "failed", 1.0, detail=str(e) or type(e).__name__)
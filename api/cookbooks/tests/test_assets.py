@@ -0,0 +1,57 @@
+import io
+import os
+import tempfile
+from unittest import TestCase
+
+from PIL import Image
+
+from api.cookbooks.assets import AssetStore, asset_url, print_size
+
+
+def make_image(width: int, height: int) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color=(251, 200, 71)).save(output, "JPEG")
+    return output.getvalue()
+
+
+class AssetStoreTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = AssetStore(self.tmp_dir.name, dpi=10)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_large_images_are_resized_to_print_resolution(self):
+        page_width, page_height = print_size(10)
+        with open(os.path.join(self.tmp_dir.name, "cover.jpg"), "wb") as image_file:
+            image_file.write(make_image(page_width * 4, page_height * 8))
+
+        asset = self.store.get("cover.jpg")
+
+        image = Image.open(io.BytesIO(asset.data))
+        self.assertEqual(asset.mime_type, "image/jpeg")
+        # Still covers the page, without the extra pixels.
+        self.assertEqual(image.width, page_width)
+        self.assertGreaterEqual(image.height, page_height)
+        self.assertLess(image.height, page_height * 8)
+
+    def test_url_fetcher_serves_assets_from_memory(self):
+        image_path = os.path.join(self.tmp_dir.name, "cover.jpg")
+        with open(image_path, "wb") as image_file:
+            image_file.write(make_image(20, 20))
+        self.store.load()
+        os.remove(image_path)
+
+        url = asset_url("cover.jpg")
+        result = self.store.url_fetcher(url)
+
+        self.assertEqual(url, "asset:cover.jpg")
+        self.assertEqual(result["mime_type"], "image/jpeg")
+        self.assertEqual(result["string"], self.store.get("cover.jpg").data)
+
+    def test_unknown_and_unsafe_names_are_rejected(self):
+        with self.assertRaises(KeyError):
+            self.store.url_fetcher("asset:missing.jpg")
+        with self.assertRaises(KeyError):
+            self.store.get("../salad.jpg")
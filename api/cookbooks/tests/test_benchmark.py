@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from api.cookbooks.benchmark import (
+    INGREDIENT_COUNT,
+    STEP_COUNT,
+    measure,
+    synthetic_cookbook,
+)
+
+
+class BenchmarkTest(TestCase):
+    def test_synthetic_cookbook_is_realistic_and_repeatable(self):
+        recipes = synthetic_cookbook(10)
+
+        self.assertEqual(len(recipes), 10)
+        self.assertEqual(recipes, synthetic_cookbook(10))
+        for recipe in recipes:
+            self.assertGreaterEqual(len(recipe.ingredients), INGREDIENT_COUNT[0])
+            self.assertLessEqual(len(recipe.ingredients), INGREDIENT_COUNT[1])
+            self.assertGreaterEqual(len(recipe.steps), STEP_COUNT[0])
+            self.assertLessEqual(len(recipe.steps), STEP_COUNT[1])
+
+    def test_measure(self):
+        result = measure(1)
+
+        self.assertEqual(result["recipes"], 1)
+        self.assertGreater(result["pdf_bytes"], 0)
+        self.assertGreater(result["wall_seconds"], 0)
+        self.assertGreaterEqual(
+            result["peak_rss_bytes"], result["rss_before_render_bytes"]
+        )
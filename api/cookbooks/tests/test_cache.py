@@ -0,0 +1,77 @@
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from api.cookbooks import generator
+from api.cookbooks.benchmark import synthetic_author, synthetic_cookbook
+from api.cookbooks.cache import PDFCache
+
+
+class PDFCacheTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = PDFCache(self.tmp_dir.name, max_bytes=100)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_and_get(self):
+        self.assertIsNone(self.cache.get("missing"))
+
+        self.cache.put("abc", b"%PDF-1.7 abc")
+
+        self.assertEqual(self.cache.get("abc"), b"%PDF-1.7 abc")
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put("first", b"1" * 40)
+        self.cache.put("second", b"2" * 40)
+        # Age both files, then read "first" so that "second" is the oldest.
+        for key in ("first", "second"):
+            old = time.time() - 60
+            os.utime(self.cache.path_for(key), (old, old))
+        self.cache.get("first")
+
+        self.cache.put("third", b"3" * 40)  # 120 bytes is over budget.
+
+        self.assertIsNotNone(self.cache.get("first"))
+        self.assertIsNone(self.cache.get("second"))
+        self.assertIsNotNone(self.cache.get("third"))
+
+
+class CookbookCacheKeyTest(TestCase):
+    def setUp(self):
+        self.author = synthetic_author()
+        (self.recipe,) = synthetic_cookbook(1)
+
+    def test_key_is_stable(self):
+        self.assertEqual(
+            generator.cookbook_cache_key(self.author, [self.recipe]),
+            generator.cookbook_cache_key(self.author, [self.recipe.copy(deep=True)]),
+        )
+
+    def test_key_changes_with_content(self):
+        key = generator.cookbook_cache_key(self.author, [self.recipe])
+
+        edited = self.recipe.copy(deep=True)
+        edited.steps[0].content = "Shake, don't stir."
+        renamed_author = self.author.copy(update={"last_name": "Franklin"})
+
+        self.assertNotEqual(key, generator.cookbook_cache_key(self.author, [edited]))
+        self.assertNotEqual(
+            key, generator.cookbook_cache_key(renamed_author, [self.recipe])
+        )
+
+    def test_cache_hit_skips_rendering(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = PDFCache(tmp_dir, max_bytes=1024 * 1024)
+            key = generator.cookbook_cache_key(self.author, [self.recipe])
+            cache.put(key, b"%PDF-1.7 cached")
+
+            with mock.patch.object(generator, "pdf_cache", cache), mock.patch.object(
+                generator, "HTML"
+            ) as html:
+                pdf = generator.generate_pdf_from_recipes(self.author, [self.recipe])
+
+            html.assert_not_called()
+            self.assertEqual(pdf, b"%PDF-1.7 cached")
@@ -1,13 +1,23 @@
+import asyncio
 import datetime
-from typing import Optional
+import io
+import os
+import tempfile
+from typing import List, Optional
+from unittest import TestCase, mock
 
 from fastapi import status
+from jinja2 import TemplateNotFound
+from pypdf import PdfReader
 
 from api.testutils.testcase import DBTestCase
 from api import models
 from api.crud import create_user
+from api.cookbooks import generator, jobs
+from api.cookbooks.benchmark import synthetic_author, synthetic_cookbook
 from api.cookbooks.generator import generate_pdf_from_recipes
 from api.schemas import RecipeInDB, UserCreate
+from api.settings import settings
 
 
 class CookbookMakerAPITest(DBTestCase):
@@ -56,6 +66,13 @@ class CookbookMakerAPITest(DBTestCase):
         response = self.client.get(f"/recipes/{recipe.id}/generate-pdf/")
         self.assertEqual(response.status_code, status.HTTP_200_OK, response)
         self.assertEqual(response.headers.get("content-type"), "application/pdf")
+        self.assertEqual(
+            response.headers.get("content-disposition"),
+            'attachment; filename="my-recipe.pdf"',
+        )
+        self.assertEqual(
+            response.headers.get("content-length"), str(len(response.content))
+        )
         self.assertIsNotNone(response.content)
         self.assertIn(b"Test Recipe", response.content)
 
@@ -186,3 +203,346 @@ class CookbookMakerAPITest(DBTestCase):
         self.assertEqual(response.headers.get("content-type"), "application/pdf")
         self.assertIsNotNone(response.content)
         self.assertIn(b"Test Recipe", response.content)
+
+
+class CookbookRecipesTestCase(TestCase):
+    """Five synthetic recipes, with an empty fragment cache."""
+
+    def setUp(self):
+        generator.fragment_cache.clear()
+        self.author = synthetic_author()
+        self.recipes = synthetic_cookbook(5)
+
+
+class IncrementalCookbookTest(CookbookRecipesTestCase):
+    def rendered_recipe_ids(self, recipes) -> list[int]:
+        """Build a cookbook and return the ids of the recipes that were laid out."""
+        with mock.patch.object(
+            generator, "render_document", wraps=generator.render_document
+        ) as render_document:
+            generate_pdf_from_recipes(self.author, recipes, use_cache=False)
+        return [
+            call.kwargs["recipe"].id
+            for call in render_document.call_args_list
+            if "recipe" in call.kwargs
+        ]
+
+    def test_rebuild_only_renders_changed_recipes(self):
+        self.assertEqual(self.rendered_recipe_ids(self.recipes), [1, 2, 3, 4, 5])
+
+        # Nothing changed, so every recipe comes from the fragment cache.
+        self.assertEqual(self.rendered_recipe_ids(self.recipes), [])
+
+        # Edit a single step of one recipe.
+        edited_recipes = [recipe.copy(deep=True) for recipe in self.recipes]
+        edited_recipes[2].steps[0].content = "Add 1 chia egg"
+        self.assertEqual(self.rendered_recipe_ids(edited_recipes), [3])
+
+    def test_edit_that_moves_later_recipes_renders_one_fragment(self):
+        self.rendered_recipe_ids(self.recipes)
+
+        # The first recipe grows, which pushes every later recipe back.
+        edited_recipes = [recipe.copy(deep=True) for recipe in self.recipes]
+        edited_recipes[0].steps[0].content = "Stir well. " * 1000
+        self.assertEqual(self.rendered_recipe_ids(edited_recipes), [1])
+
+        # Without it, every later recipe moves forward.
+        self.assertEqual(self.rendered_recipe_ids(edited_recipes[1:]), [])
+
+    def test_table_of_contents_has_page_numbers(self):
+        with mock.patch.object(
+            generator, "render_document", wraps=generator.render_document
+        ) as render_document:
+            pdf = generate_pdf_from_recipes(self.author, self.recipes, use_cache=False)
+
+        front_calls = [
+            call
+            for call in render_document.call_args_list
+            if "page_numbers" in call.kwargs
+        ]
+        page_numbers = front_calls[-1].kwargs["page_numbers"]
+        layout = generator.LAYOUTS["recipe-card"]
+        # Each recipe starts on the page after the previous one ends.
+        next_page = min(page_numbers.values())
+        for recipe in self.recipes:
+            self.assertEqual(page_numbers[recipe.id], next_page)
+            next_page += generator.render_recipe_fragment(recipe, layout).page_count
+        self.assertEqual(len(PdfReader(io.BytesIO(pdf)).pages), next_page - 1)
+
+        # The recipe pages are numbered from the first recipe's page.
+        (numbers_call,) = [
+            call
+            for call in render_document.call_args_list
+            if "first_page" in call.kwargs
+        ]
+        self.assertEqual(numbers_call.kwargs["first_page"], page_numbers[1])
+        self.assertEqual(numbers_call.kwargs["page_count"], next_page - page_numbers[1])
+
+
+class ShardedCookbookTest(CookbookRecipesTestCase):
+    def front_page_numbers(self, shards: int) -> tuple[bytes, dict]:
+        """Build a cookbook from that many shards, rendered in this process, and
+        return it with the page numbers in its contents."""
+        layout = generator.LAYOUTS["recipe-card"]
+        with tempfile.TemporaryDirectory() as shard_dir, mock.patch.object(
+            generator, "render_document", wraps=generator.render_document
+        ) as render_document:
+            shard_results = [
+                generator.render_shard(recipes, layout, shard_dir)
+                for recipes in generator.split_shards(self.recipes, shards)
+            ]
+            pdf = generator.write_cookbook_pdf(
+                self.author,
+                self.recipes,
+                layout.html_template_name,
+                layout.css_template_name,
+                shards=shard_results,
+            )
+        front_calls = [
+            call
+            for call in render_document.call_args_list
+            if "page_numbers" in call.kwargs
+        ]
+        return pdf, front_calls[-1].kwargs["page_numbers"]
+
+    def test_sharded_cookbook_matches_single_render(self):
+        pdf, page_numbers = self.front_page_numbers(shards=1)
+        sharded_pdf, sharded_page_numbers = self.front_page_numbers(shards=2)
+
+        self.assertEqual(sharded_page_numbers, page_numbers)
+        self.assertEqual(
+            len(PdfReader(io.BytesIO(sharded_pdf)).pages),
+            len(PdfReader(io.BytesIO(pdf)).pages),
+        )
+
+    def test_contents_link_to_recipe_pages(self):
+        pdf, page_numbers = self.front_page_numbers(shards=3)
+
+        reader = PdfReader(io.BytesIO(pdf))
+        link_pages = []
+        for page in reader.pages[: min(page_numbers.values()) - 1]:
+            for annotation in page.get("/Annots", []):
+                destination = annotation.get_object()["/Dest"]
+                link_pages.append(reader.get_page_number(destination[0]) + 1)
+        self.assertEqual(
+            link_pages, [page_numbers[recipe.id] for recipe in self.recipes]
+        )
+
+
+class GeneratorContextTest(TestCase):
+    def test_context_is_reused_between_renders(self):
+        context = generator.get_context()
+
+        self.assertIs(generator.get_context(), context)
+        self.assertIs(
+            context.stylesheet("css/recipe-card.css"),
+            context.stylesheet("css/recipe-card.css"),
+        )
+
+    def test_context_is_rebuilt_when_templates_change(self):
+        context = generator.get_context()
+
+        with mock.patch.object(context, "template_mtimes", {}):
+            self.assertIsNot(generator.get_context(), context)
+
+    def test_production_context_ignores_template_changes(self):
+        context = generator.get_context()
+
+        with mock.patch.object(generator, "auto_reload", False), mock.patch.object(
+            context, "template_mtimes", {}
+        ):
+            self.assertIs(generator.get_context(), context)
+
+
+class CookbookLayoutTest(TestCase):
+    def setUp(self):
+        self.author = synthetic_author()
+        self.recipes = synthetic_cookbook(1)
+
+    def test_unknown_templates_fail_before_rendering(self):
+        with mock.patch.object(generator, "HTML") as html:
+            with self.assertRaisesRegex(TemplateNotFound, "html/missing.html"):
+                generate_pdf_from_recipes(
+                    self.author,
+                    self.recipes,
+                    html_template_name="html/missing.html",
+                    use_cache=False,
+                )
+        html.assert_not_called()
+
+    def test_alternate_layout(self):
+        # Templates that are not a registered layout render as a single document.
+        layout = generator.get_layout(
+            "html/recipe-card-front.html", "css/recipe-card.css"
+        )
+        self.assertIsNone(layout.recipe_template_name)
+
+        pdf_bytes = generate_pdf_from_recipes(
+            self.author,
+            self.recipes,
+            html_template_name="html/recipe-card-front.html",
+            css_template_name="css/recipe-card.css",
+            use_cache=False,
+        )
+        self.assertIn(self.recipes[0].name.encode(), pdf_bytes)
+
+
+class CookbookJobAPITest(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_and_login_user()
+        recipe = models.Recipe(
+            name="Test Recipe",
+            author_id=self.user.id,
+            created_at=datetime.datetime.utcnow(),
+        )
+        self.db.add(recipe)
+        self.db.commit()
+
+    def test_cookbook_job_lifecycle(self):
+        response = self.client.post(f"/users/{self.user.id}/recipes/generate-pdf/jobs/")
+        self.assertEqual(
+            response.status_code, status.HTTP_202_ACCEPTED, response.json()
+        )
+        job_id = response.json()["id"]
+        self.assertEqual(response.json()["stage"], "queued")
+
+        response = self.client.get(f"/cookbook-jobs/{job_id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.assertEqual(response.json()["stage"], "done")
+        self.assertEqual(response.json()["progress"], 1.0)
+        download_url = response.json()["download_url"]
+        self.assertEqual(download_url, f"/cookbook-jobs/{job_id}/pdf/")
+
+        response = self.client.get(f"/cookbook-jobs/{job_id}/events/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(
+            response.headers["content-type"].startswith("text/event-stream")
+        )
+        self.assertIn("event: done", response.text)
+
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers.get("content-type"), "application/pdf")
+        self.assertIn(b"Test Recipe", response.content)
+
+    def start_job(self) -> str:
+        response = self.client.post(f"/users/{self.user.id}/recipes/generate-pdf/jobs/")
+        self.assertEqual(
+            response.status_code, status.HTTP_202_ACCEPTED, response.json()
+        )
+        return response.json()["id"]
+
+    def add_job_of_another_process(self, job_id: str):
+        # A job started and run by another app process is only known from its row.
+        job = models.CookbookJob(
+            id=job_id,
+            author_id=self.user.id,
+            stage="rendering",
+            progress=0.3,
+            updated_at=datetime.datetime.utcnow(),
+        )
+        self.db.add(job)
+        self.db.commit()
+
+    def test_jobs_run_in_sessions_of_their_own(self):
+        # Jobs run after their request, so they only get the job's id.
+        self.add_job_of_another_process("queued-job")
+
+        self.run_async(jobs.run_cookbook_job("queued-job"))
+
+        response = self.client.get("/cookbook-jobs/queued-job/")
+        self.assertEqual(response.json()["stage"], "done")
+        response = self.client.get("/cookbook-jobs/queued-job/pdf/")
+        self.assertIn(b"Test Recipe", response.content)
+
+    def test_jobs_are_served_by_every_process(self):
+        self.add_job_of_another_process("other-process")
+
+        response = self.client.get("/cookbook-jobs/other-process/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.assertEqual(response.json()["stage"], "rendering")
+        response = self.client.get("/cookbook-jobs/other-process/pdf/")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    @mock.patch.object(jobs, "JOB_POLL_INTERVAL", 0.01)
+    def test_job_events_follow_updates_of_other_processes(self):
+        self.add_job_of_another_process("other-process")
+
+        async def follow() -> List[str]:
+            return [
+                job_status.stage
+                async for job_status in jobs.job_statuses("other-process")
+            ]
+
+        async def finish():
+            await asyncio.sleep(0.1)
+            async with self.AsyncTestingSessionLocal() as db:
+                job = await jobs.get_job(db, "other-process")
+                await jobs.update_job(db, job, "done", 1.0)
+
+        stages, _ = self.run_async(asyncio.gather(follow(), finish()))
+
+        self.assertEqual(stages, ["rendering", "done"])
+
+    def test_expired_jobs_remove_their_pdf(self):
+        job_id = self.start_job()
+        job = self.db.get(models.CookbookJob, job_id)
+        pdf_path = job.pdf_path
+        download = open(pdf_path, "rb")  # A download that is still streaming.
+
+        job.updated_at -= datetime.timedelta(seconds=settings.pdf_job_ttl + 1)
+        self.db.commit()
+        response = self.client.get(f"/cookbook-jobs/{job_id}/pdf/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Expired jobs are removed when the next job starts.
+        self.start_job()
+        self.assertFalse(os.path.exists(pdf_path))
+        self.assertIsNone(self.db.get(models.CookbookJob, job_id))
+        with download:
+            self.assertIn(b"Test Recipe", download.read())
+
+    @mock.patch.object(settings, "pdf_jobs_per_author", 2)
+    def test_finished_jobs_make_room_for_new_ones(self):
+        first_job_id = self.start_job()
+        first_pdf_path = self.db.get(models.CookbookJob, first_job_id).pdf_path
+        self.start_job()
+        self.start_job()
+
+        self.assertEqual(self.db.query(models.CookbookJob).count(), 2)
+        response = self.client.get(f"/cookbook-jobs/{first_job_id}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(os.path.exists(first_pdf_path))
+
+    @mock.patch.object(settings, "pdf_jobs_per_author", 2)
+    def test_unfinished_jobs_are_capped_per_author(self):
+        self.start_job()
+        self.start_job()
+        self.db.query(models.CookbookJob).update(
+            {models.CookbookJob.stage: "rendering"}
+        )
+        self.db.commit()
+
+        response = self.client.post(f"/users/{self.user.id}/recipes/generate-pdf/jobs/")
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.db.query(models.CookbookJob).count(), 2)
+
+    def test_cookbook_jobs_are_private(self):
+        response = self.client.post(f"/users/{self.user.id}/recipes/generate-pdf/jobs/")
+        job_id = response.json()["id"]
+
+        self.create_and_login_user(email="test2@example.com")
+
+        response = self.client.post(f"/users/{self.user.id}/recipes/generate-pdf/jobs/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(f"/cookbook-jobs/{job_id}/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(f"/cookbook-jobs/{job_id}/pdf/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_missing_cookbook_job(self):
+        response = self.client.get("/cookbook-jobs/missing/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,122 @@
+import asyncio
+import glob
+import io
+import os
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from pypdf import PdfReader
+
+from api.cookbooks import generator
+from api.cookbooks.benchmark import remove_file, synthetic_author, synthetic_cookbook
+from api.cookbooks.cache import pdf_cache
+from api.cookbooks.engine import RenderEngine, RenderQueueFull, RenderTimeout
+from api.schemas import RecipeInDB
+
+
+def uncached_cookbook(recipe_count: int) -> list[RecipeInDB]:
+    """A synthetic cookbook that is not in the PDF cache, so that it is rendered."""
+    recipes = synthetic_cookbook(recipe_count)
+    remove_file(
+        pdf_cache.path_for(generator.cookbook_cache_key(synthetic_author(), recipes))
+    )
+    return recipes
+
+
+class RenderEngineTest(TestCase):
+    def setUp(self):
+        self.author = synthetic_author()
+
+    def test_render_in_worker_process(self):
+        engine = RenderEngine(workers=1, timeout=60, queue_depth=1)
+        try:
+            pdf_file = asyncio.run(engine.render(self.author, uncached_cookbook(1)))
+        finally:
+            engine.shutdown()
+
+        with pdf_file:
+            self.assertIn(b"Spicy Salad #1", pdf_file.read())
+
+    def test_full_queue_rejects_jobs(self):
+        engine = RenderEngine(workers=1, timeout=60, queue_depth=0)
+
+        async def render_twice():
+            return await asyncio.gather(
+                engine.render(self.author, uncached_cookbook(1)),
+                engine.render(self.author, uncached_cookbook(1)),
+                return_exceptions=True,
+            )
+
+        try:
+            results = asyncio.run(render_twice())
+        finally:
+            engine.shutdown()
+
+        self.assertIsInstance(results[1], RenderQueueFull)
+        with results[0] as pdf_file:
+            self.assertTrue(pdf_file.read().startswith(b"%PDF"))
+
+    def test_slow_render_times_out(self):
+        engine = RenderEngine(workers=1, timeout=0.001, queue_depth=0)
+
+        async def time_out_then_render():
+            with self.assertRaises(RenderTimeout):
+                await engine.render(self.author, uncached_cookbook(20))
+            # The worker is still rendering, so its job keeps the slot.
+            with self.assertRaises(RenderQueueFull):
+                await engine.render(self.author, uncached_cookbook(1))
+
+        try:
+            asyncio.run(time_out_then_render())
+            # The slot is returned once the worker finishes.
+            deadline = time.monotonic() + 60
+            while engine._pending and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(engine._pending, 0)
+        finally:
+            engine.shutdown()
+
+    def test_shards_render_in_the_engine_pool(self):
+        recipes = uncached_cookbook(5)
+        engine = RenderEngine(workers=2, timeout=60, queue_depth=0, shards=2)
+        shard_dirs = os.path.join(tempfile.gettempdir(), "cookbook-shards-*")
+        existing_shard_dirs = set(glob.glob(shard_dirs))
+        try:
+            with mock.patch.object(engine, "_submit", wraps=engine._submit) as submit:
+                pdf_file = asyncio.run(engine.render(self.author, recipes))
+        finally:
+            engine.shutdown()
+
+        self.assertEqual(
+            [call.args[1] for call in submit.call_args_list],
+            [generator.render_shard, generator.render_shard, generator.render_pdf_file],
+        )
+        with pdf_file:
+            page_count = len(PdfReader(pdf_file).pages)
+        pdf = generator.generate_pdf_from_recipes(self.author, recipes, use_cache=False)
+        self.assertEqual(page_count, len(PdfReader(io.BytesIO(pdf)).pages))
+        # The shard files are removed once the cookbook is assembled.
+        self.assertEqual(set(glob.glob(shard_dirs)), existing_shard_dirs)
+
+    def test_sharded_renders_take_a_slot_per_shard(self):
+        engine = RenderEngine(workers=2, timeout=60, queue_depth=1, shards=4)
+        self.assertEqual(engine.shards_for(uncached_cookbook(5)), 2)
+
+        async def render_twice():
+            return await asyncio.gather(
+                engine.render(self.author, uncached_cookbook(5)),
+                engine.render(self.author, uncached_cookbook(6)),
+                return_exceptions=True,
+            )
+
+        try:
+            results = asyncio.run(render_twice())
+            # The first render returned both of its slots.
+            self.assertEqual(engine._pending, 0)
+        finally:
+            engine.shutdown()
+
+        self.assertIsInstance(results[1], RenderQueueFull)
+        with results[0] as pdf_file:
+            self.assertTrue(pdf_file.read().startswith(b"%PDF"))
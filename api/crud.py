@@ -1,24 +1,41 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Type, Union
 from datetime import datetime
-
-from sqlalchemy import update
-from sqlalchemy.orm import Session
+import base64
+import json
+
+from sqlalchemy import bindparam, delete, func, insert, literal, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.sql import Select
 from argon2 import PasswordHasher
 
-from . import models, schemas
+from . import ingredients, models, ordering, schemas, search
+from .recipe_cache import recipe_cache
 
 ph = PasswordHasher()
 
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+class InvalidCursor(ValueError):
+    """Raised for pagination cursors that were not issued by get_recipes."""
+
 
+async def get_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    return result.scalars().first()
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
 
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    """Returns the user with the given email, with their token loaded."""
+    result = await db.execute(
+        select(models.User)
+        .options(selectinload(models.User.token))
+        .where(models.User.email == email)
+    )
+    return result.scalars().first()
 
-def create_user(db: Session, user: schemas.UserCreate):
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
     db_user = models.User(
         email=user.email,
         first_name=user.first_name,
@@ -26,22 +43,21 @@ def create_user(db: Session, user: schemas.UserCreate):
         hashed_password=ph.hash(user.password.get_secret_value()),
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
-def update_or_create_user_token(
-    db: Session, user_id: int, token: schemas.Token
+async def update_or_create_user_token(
+    db: AsyncSession, user_id: int, token: schemas.Token
 ) -> models.OAuth2Token:
     # See if existing user token exists.
-    existing_token = (
-        db.query(models.OAuth2Token)
-        .filter(
+    result = await db.execute(
+        select(models.OAuth2Token).where(
             models.OAuth2Token.user_id == user_id, models.OAuth2Token.name == token.name
         )
-        .first()
     )
+    existing_token = result.scalars().first()
     if existing_token:
         db_token = existing_token
         setattr(db_token, "name", token.name)
@@ -58,141 +74,807 @@ def update_or_create_user_token(
             expires_at=token.expires_at,
         )
         db.add(db_token)
-    db.commit()
-    db.refresh(db_token)
+    await db.commit()
+    await db.refresh(db_token)
     return db_token
 
 
-def get_recipe(db: Session, recipe_id: int):
-    return db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
+def select_recipes() -> Select:
+    """
+    Select for recipes that are serialized with their author, steps and ingredients.
+    Each relationship is loaded for all of the returned recipes in one extra query.
+    Relationships cannot be lazily loaded by an AsyncSession, so recipes that are
+    serialized must be loaded with this.
+    """
+    return select(models.Recipe).options(
+        selectinload(models.Recipe.author),
+        selectinload(models.Recipe.steps),
+        selectinload(models.Recipe.ingredients),
+    )
 
 
-def get_recipes(
-    db: Session, recipe_params: schemas.RecipeSearch, author_id: Optional[int] = None
+def select_recipe_list(view: str) -> Select:
+    """
+    Select for the recipes of a listing in the requested view. The full view loads
+    recipes with their details, and the summary view selects only the columns of
+    RecipeSummary, without touching the authors, steps or ingredients.
+    """
+    if view == "summary":
+        return select(
+            models.Recipe.id,
+            models.Recipe.name,
+            models.Recipe.created_at,
+            models.Recipe.author_id,
+        )
+    return select_recipes()
+
+
+async def fetch_recipe_list(db: AsyncSession, recipe_qs: Select, view: str) -> list:
+    """Runs a select_recipe_list select. Summaries are rows, not Recipe objects."""
+    result = await db.execute(recipe_qs)
+    return result.all() if view == "summary" else result.scalars().all()
+
+
+def serialize_recipe_list(
+    recipes: list, view: str
+) -> List[Union[schemas.RecipeInDB, schemas.RecipeSummary]]:
+    schema = schemas.RecipeSummary if view == "summary" else schemas.RecipeInDB
+    return [schema.from_orm(recipe) for recipe in recipes]
+
+
+async def get_recipe(
+    db: AsyncSession, recipe_id: int, with_details: bool = False
+) -> Optional[models.Recipe]:
+    recipe_qs = select_recipes() if with_details else select(models.Recipe)
+    result = await db.execute(recipe_qs.where(models.Recipe.id == recipe_id))
+    return result.scalars().first()
+
+
+async def get_recipe_details(
+    db: AsyncSession, recipe_id: int
+) -> Optional[schemas.RecipeInDB]:
+    """Returns the serialized recipe from the recipe cache, or loads and caches it."""
+    cached = await recipe_cache.get(recipe_id)
+    if cached:
+        return cached
+    recipe = await get_recipe(db, recipe_id, with_details=True)
+    if not recipe:
+        return None
+    serialized = schemas.RecipeInDB.from_orm(recipe)
+    await recipe_cache.put(serialized)
+    return serialized
+
+
+async def get_author_recipes(db: AsyncSession, author_id: int) -> List[models.Recipe]:
+    """All of the author's recipes, with their details loaded."""
+    result = await db.execute(
+        select_recipes()
+        .where(models.Recipe.author_id == author_id)
+        .order_by(models.Recipe.id)
+    )
+    return result.scalars().all()
+
+
+def encode_cursor(recipe: models.Recipe, direction: str) -> str:
+    """Returns an opaque cursor for the recipes after ("next") or before ("prev")
+    the given recipe in (created_at, id) order."""
+    payload = {
+        "created_at": recipe.created_at.isoformat(),
+        "id": recipe.id,
+        "direction": direction,
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, str]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(payload["created_at"])
+        recipe_id = int(payload["id"])
+        direction = payload["direction"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Invalid pagination cursor") from e
+    if direction not in ("next", "prev"):
+        raise InvalidCursor("Invalid pagination cursor")
+    return created_at, recipe_id, direction
+
+
+async def get_recipes(
+    db: AsyncSession,
+    recipe_params: schemas.RecipeSearch,
+    author_id: Optional[int] = None,
 ) -> schemas.PaginatedRecipes:
-    recipe_qs = db.query(models.Recipe)
+    """
+    Returns a page of recipes ordered by (created_at, id). Pages are requested by
+    page number, or by a cursor from a previous page. Cursor pages are found with
+    the (created_at, id) index, so they cost the same however deep they are, and
+    they do not shift when recipes are added.
+    Searches, with a q parameter, are ordered by relevance instead, and are only
+    paginated by page number.
+    Raises InvalidCursor for malformed cursors, or cursors used with a search.
+    """
+    if recipe_params.q:
+        if recipe_params.cursor:
+            raise InvalidCursor("Pagination cursors cannot be used with a search")
+        return await search_recipes(db, recipe_params, author_id)
+
+    view = recipe_params.view
+    recipe_qs = select_recipe_list(view)
 
     # Filter by author, if required.
     if author_id:
-        recipe_qs = recipe_qs.filter(models.Recipe.author_id == author_id)
-    total_recipe_count = recipe_qs.count()
-    max_page = max(
-        total_recipe_count // recipe_params.per_page
-        + (
-            total_recipe_count % recipe_params.per_page > 1 & 1
-        ),  # Add one if there is any remainder
-        1,
-    )
-    offset = recipe_params.per_page * (recipe_params.page - 1)
-    recipe_qs = recipe_qs.limit(recipe_params.per_page).offset(offset)
+        recipe_qs = recipe_qs.where(models.Recipe.author_id == author_id)
+    total_recipe_count = await get_recipe_count(db, author_id)
+    max_page = max(-(-total_recipe_count // recipe_params.per_page), 1)  # Rounds up.
+
+    sort_key = tuple_(models.Recipe.created_at, models.Recipe.id)
+    ascending = (models.Recipe.created_at.asc(), models.Recipe.id.asc())
+    descending = (models.Recipe.created_at.desc(), models.Recipe.id.desc())
+    # One extra recipe tells whether there is another page.
+    limit = recipe_params.per_page + 1
+
+    if recipe_params.cursor:
+        created_at, recipe_id, direction = decode_cursor(recipe_params.cursor)
+        boundary = tuple_(
+            literal(created_at, models.Recipe.created_at.type),
+            literal(recipe_id, models.Recipe.id.type),
+        )
+        if direction == "next":
+            recipes = await fetch_recipe_list(
+                db,
+                recipe_qs.where(sort_key > boundary).order_by(*ascending).limit(limit),
+                view,
+            )
+            has_next, has_prev = len(recipes) > recipe_params.per_page, True
+            recipes = recipes[: recipe_params.per_page]
+        else:
+            recipes = await fetch_recipe_list(
+                db,
+                recipe_qs.where(sort_key < boundary).order_by(*descending).limit(limit),
+                view,
+            )
+            has_next, has_prev = True, len(recipes) > recipe_params.per_page
+            recipes = list(reversed(recipes[: recipe_params.per_page]))
+        page = None
+    else:
+        offset = recipe_params.per_page * (recipe_params.page - 1)
+        recipes = await fetch_recipe_list(
+            db, recipe_qs.order_by(*ascending).limit(limit).offset(offset), view
+        )
+        has_next, has_prev = len(recipes) > recipe_params.per_page, offset > 0
+        recipes = recipes[: recipe_params.per_page]
+        page = recipe_params.page
+
     return schemas.PaginatedRecipes(
-        page=recipe_params.page,
+        page=page,
         max_page=max_page,
         per_page=recipe_params.per_page,
         result_count=total_recipe_count,
-        data=[schemas.RecipeInDB.from_orm(recipe) for recipe in recipe_qs],
+        data=serialize_recipe_list(recipes, view),
+        next_cursor=(
+            encode_cursor(recipes[-1], "next") if recipes and has_next else None
+        ),
+        prev_cursor=(
+            encode_cursor(recipes[0], "prev") if recipes and has_prev else None
+        ),
+    )
+
+
+async def search_recipes(
+    db: AsyncSession,
+    recipe_params: schemas.RecipeSearch,
+    author_id: Optional[int] = None,
+) -> schemas.PaginatedRecipes:
+    """Returns a page of the recipes whose name, ingredients or steps contain every
+    term of recipe_params.q, best matches first."""
+    terms = search.search_terms(recipe_params.q)
+    view = recipe_params.view
+    recipes = []
+    total_recipe_count = 0
+    if terms:
+        matches = search.ranked_matches(db.bind.dialect.name, terms)
+        recipe_qs = select_recipe_list(view).join(
+            matches, matches.c.recipe_id == models.Recipe.id
+        )
+        count_qs = select(func.count(models.Recipe.id)).join(
+            matches, matches.c.recipe_id == models.Recipe.id
+        )
+        if author_id:
+            recipe_qs = recipe_qs.where(models.Recipe.author_id == author_id)
+            count_qs = count_qs.where(models.Recipe.author_id == author_id)
+        total_recipe_count = (await db.execute(count_qs)).scalar_one()
+
+        offset = recipe_params.per_page * (recipe_params.page - 1)
+        recipes = await fetch_recipe_list(
+            db,
+            recipe_qs.order_by(matches.c.score.desc(), models.Recipe.id)
+            .limit(recipe_params.per_page)
+            .offset(offset),
+            view,
+        )
+
+    return schemas.PaginatedRecipes(
+        page=recipe_params.page,
+        max_page=max(-(-total_recipe_count // recipe_params.per_page), 1),
+        per_page=recipe_params.per_page,
+        result_count=total_recipe_count,
+        data=serialize_recipe_list(recipes, view),
+    )
+
+
+async def create_recipe(
+    db: AsyncSession, author_id: int, recipe: schemas.RecipeCreate
+) -> models.Recipe:
+    [recipe_id] = await create_recipes(db, author_id, [recipe])
+    await recipe_cache.invalidate(recipe_id)
+    # Load the author, steps and ingredients, which are not loaded on a new recipe.
+    return await get_recipe(db, recipe_id, with_details=True)
+
+
+async def create_recipes(
+    db: AsyncSession, author_id: int, recipes: List[schemas.RecipeCreate]
+) -> List[int]:
+    """
+    Creates the author's recipes with their ingredients and steps in one transaction,
+    and returns their ids. Ingredients, steps and their index rows are inserted with
+    one executemany each, however many recipes there are.
+    """
+    created_at = datetime.utcnow()
+    # One multi-row INSERT, rather than the ORM's INSERT per recipe.
+    statement = insert(models.Recipe).values(
+        [
+            dict(name=recipe.name, author_id=author_id, created_at=created_at)
+            for recipe in recipes
+        ]
+    )
+    if db.bind.dialect.implicit_returning:
+        statement = statement.returning(models.Recipe.id)
+        recipe_ids = list((await db.execute(statement)).scalars())
+    else:
+        # SQLAlchemy has no RETURNING for SQLite, which only reports the id of the
+        # last row. The transaction holds SQLite's write lock from the INSERT on, so
+        # the recipes are read back up to that row.
+        last_id = (await db.execute(statement)).lastrowid
+        result = await db.execute(
+            select(models.Recipe.id)
+            .where(
+                models.Recipe.author_id == author_id,
+                models.Recipe.created_at == created_at,
+                models.Recipe.id <= last_id,
+            )
+            .order_by(models.Recipe.id.desc())
+            .limit(len(recipes))
+        )
+        recipe_ids = sorted(result.scalars())
+    if len(recipe_ids) != len(recipes):
+        raise RuntimeError(
+            f"Inserted {len(recipes)} recipes, but got {len(recipe_ids)} ids back"
+        )
+    await change_recipe_counts(db, author_id, len(recipes))
+
+    ingredient_rows = [
+        dict(content=ingredient.content, recipe_id=recipe_id, position=key)
+        for recipe_id, recipe in zip(recipe_ids, recipes)
+        for ingredient, key in zip(
+            recipe.ingredients, ordering.initial_keys(len(recipe.ingredients))
+        )
+    ]
+    if ingredient_rows:
+        await db.execute(insert(models.RecipeIngredient), ingredient_rows)
+        # Only the new ingredients' ids are read back. Their index rows are built
+        # from the contents in memory, and there are no old ones to delete.
+        contents = {
+            (row["recipe_id"], row["position"]): row["content"]
+            for row in ingredient_rows
+        }
+        result = await db.execute(
+            select(
+                models.RecipeIngredient.id,
+                models.RecipeIngredient.recipe_id,
+                models.RecipeIngredient.position,
+            ).where(models.RecipeIngredient.recipe_id.in_(recipe_ids))
+        )
+        await ingredients.index_new_ingredients(
+            db,
+            (
+                (ingredient_id, recipe_id, contents[recipe_id, position])
+                for ingredient_id, recipe_id, position in result
+            ),
+            author_id,
+        )
+    step_rows = [
+        dict(content=step.content, recipe_id=recipe_id, position=key)
+        for recipe_id, recipe in zip(recipe_ids, recipes)
+        for step, key in zip(recipe.steps, ordering.initial_keys(len(recipe.steps)))
+    ]
+    if step_rows:
+        await db.execute(insert(models.RecipeStep), step_rows)
+    await search.index_new_recipes(
+        db,
+        [
+            search.search_row(
+                recipe_id,
+                recipe.name,
+                [ingredient.content for ingredient in recipe.ingredients],
+                [step.content for step in recipe.steps],
+            )
+            for recipe_id, recipe in zip(recipe_ids, recipes)
+        ],
     )
+    await db.commit()
+    return recipe_ids
 
 
-def create_recipe(db: Session, author_id: int, recipe: schemas.RecipeCreate):
-    db_recipe = models.Recipe(
-        name=recipe.name,
-        author_id=author_id,
-        created_at=datetime.utcnow(),
+def count_recipes(author_id: Optional[int] = None) -> Select:
+    count_qs = select(func.count(models.Recipe.id))
+    if author_id:
+        count_qs = count_qs.where(models.Recipe.author_id == author_id)
+    return count_qs
+
+
+async def get_recipe_count(db: AsyncSession, author_id: Optional[int] = None) -> int:
+    """
+    Returns the number of recipes of the author, or of all recipes, from the
+    recipe_counts table. Without a counter the recipes are counted instead. Counters
+    are only seeded by writes, so this can run on a read-only replica.
+    """
+    counter_id = author_id or models.RecipeCount.ALL_AUTHORS
+    counter = await db.get(models.RecipeCount, counter_id)
+    if counter:
+        return counter.count
+    return (await db.execute(count_recipes(author_id))).scalar_one()
+
+
+async def change_recipe_counts(db: AsyncSession, author_id: int, delta: int):
+    """
+    Adds delta to the author's and the global recipe counters, as part of the
+    transaction that inserts or deletes the recipes. Every path that inserts or
+    deletes recipes must call this. A counter that does not exist yet is seeded by
+    counting the recipes, which includes this transaction's own.
+    """
+    counter_ids = [author_id, models.RecipeCount.ALL_AUTHORS]
+    result = await db.execute(
+        update(models.RecipeCount)
+        .where(models.RecipeCount.author_id.in_(counter_ids))
+        .values(count=models.RecipeCount.count + delta)
+        .execution_options(synchronize_session=False)
     )
-    db.add(db_recipe)
-    db.commit()
-    return db_recipe
+    if result.rowcount == len(counter_ids):
+        return
 
+    existing = await db.execute(
+        select(models.RecipeCount.author_id).where(
+            models.RecipeCount.author_id.in_(counter_ids)
+        )
+    )
+    for counter_id in set(counter_ids) - set(existing.scalars()):
+        count = (await db.execute(count_recipes(counter_id))).scalar_one()
+        try:
+            async with db.begin_nested():
+                await db.execute(
+                    insert(models.RecipeCount).values(author_id=counter_id, count=count)
+                )
+        except IntegrityError:
+            # Another transaction seeded the counter first, without these recipes.
+            await db.execute(
+                update(models.RecipeCount)
+                .where(models.RecipeCount.author_id == counter_id)
+                .values(count=models.RecipeCount.count + delta)
+                .execution_options(synchronize_session=False)
+            )
+
+
+async def reconcile_recipe_counts(db: AsyncSession):
+    """Recounts the recipes of every counter, correcting any drift, for example from
+    recipes written outside of this module."""
+    author_count = (
+        select(func.count(models.Recipe.id))
+        .where(models.Recipe.author_id == models.RecipeCount.author_id)
+        .scalar_subquery()
+    )
+    total_count = select(func.count(models.Recipe.id)).scalar_subquery()
+    await db.execute(
+        update(models.RecipeCount)
+        .where(models.RecipeCount.author_id != models.RecipeCount.ALL_AUTHORS)
+        .values(count=author_count)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        update(models.RecipeCount)
+        .where(models.RecipeCount.author_id == models.RecipeCount.ALL_AUTHORS)
+        .values(count=total_count)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
 
-def update_recipe(db: Session, recipe: models.Recipe, edit: schemas.RecipeEdit):
+
+async def update_recipe(
+    db: AsyncSession, recipe: models.Recipe, edit: schemas.RecipeEdit
+) -> models.Recipe:
     setattr(recipe, "name", edit.name)
-    db.commit()
+    await search.reindex_recipe(db, recipe.id)
+    await db.commit()
+    await recipe_cache.invalidate(recipe.id)
     return recipe
 
 
-def get_ingredient(db: Session, ingredient_id: int):
-    ingredient = db.query(models.RecipeIngredient).get(ingredient_id)
-    return ingredient
+class InvalidOperations(ValueError):
+    """Raised for a RecipePatch whose operations cannot all be applied. errors are the
+    (index, message) of every operation that cannot."""
+
+    def __init__(self, errors: List[Tuple[int, str]]):
+        super().__init__(
+            "; ".join(f"operation {index}: {message}" for index, message in errors)
+        )
+        self.errors = errors
+
+
+# The rows that the targets of recipe operations are stored in.
+OPERATION_TARGETS = {
+    "ingredient": models.RecipeIngredient,
+    "step": models.RecipeStep,
+}
+
+
+def plan_recipe_operations(
+    recipe: models.Recipe, operations: List[schemas.RecipeOperation]
+) -> Dict[str, List[Tuple[Optional[int], str]]]:
+    """
+    Applies the operations to copies of the recipe's ingredient and step lists, and
+    returns the (id, content) of each list's rows in their new order. Inserted rows
+    have no id yet. Raises InvalidOperations, listing every operation that refers to
+    a row or position that is not in its list.
+    """
+    lists: Dict[str, List[Tuple[Optional[int], str]]] = {
+        "ingredient": [(i.id, i.content) for i in recipe.ingredients],
+        "step": [(s.id, s.content) for s in recipe.steps],
+    }
+    errors = []
+    for index, operation in enumerate(operations):
+        rows = lists[operation.target]
+        if operation.op == "insert":
+            position = len(rows) if operation.position is None else operation.position
+            if not 0 <= position <= len(rows):
+                errors.append((index, f"position {position} is out of range"))
+            else:
+                rows.insert(position, (None, operation.content))
+            continue
+
+        ids = [row_id for row_id, _ in rows]
+        if operation.id not in ids:
+            errors.append(
+                (index, f"{operation.target} {operation.id} is not in the recipe")
+            )
+            continue
+        at = ids.index(operation.id)
+        if operation.op == "edit":
+            rows[at] = (operation.id, operation.content)
+        elif operation.op == "delete":
+            del rows[at]
+        elif not 0 <= operation.position < len(rows):
+            errors.append((index, f"position {operation.position} is out of range"))
+        else:
+            rows.insert(operation.position, rows.pop(at))
+    if errors:
+        raise InvalidOperations(errors)
+    return lists
+
+
+class RecipeChanged(Exception):
+    """Raised when concurrent writes kept taking the positions that a patch of the
+    recipe's ingredients and steps was going to use."""
+
+
+# Attempts at a patch, which is planned again when a concurrent write took a
+# position it was going to use.
+PATCH_ATTEMPTS = 3
+
+
+async def patch_recipe(
+    db: AsyncSession, recipe: models.Recipe, operations: List[schemas.RecipeOperation]
+) -> models.Recipe:
+    """
+    Applies a RecipePatch's operations to the recipe's ingredients and steps, in one
+    transaction. Each table is written with at most one bulk delete, update and
+    insert, whatever the number of operations. Only the rows that were edited,
+    inserted or moved out of order get new positions, unless a gap ran out.
+    The recipe row is locked first, where the database supports it, so that patches
+    of one recipe wait for each other, and the operations are planned from the rows
+    as they are once it is locked. An append, which does not lock the recipe, can
+    still take a position the patch uses. The patch is then rolled back to a
+    savepoint and planned again. RecipeChanged is raised when that keeps happening.
+    """
+    recipe_id = recipe.id
+    for attempt in range(1, PATCH_ATTEMPTS + 1):
+        await db.execute(
+            select(models.Recipe.id)
+            .where(models.Recipe.id == recipe_id)
+            .with_for_update()
+        )
+        result = await db.execute(
+            select_recipes()
+            .where(models.Recipe.id == recipe_id)
+            .execution_options(populate_existing=True)
+        )
+        recipe = result.scalars().first()
+        if recipe is None:
+            raise RecipeChanged(f"Recipe {recipe_id} was deleted")
+        lists = plan_recipe_operations(recipe, operations)
+        try:
+            async with db.begin_nested():
+                await write_recipe_lists(db, recipe, lists)
+        except IntegrityError:
+            if attempt == PATCH_ATTEMPTS:
+                raise RecipeChanged(
+                    f"Recipe {recipe_id} kept changing while it was patched"
+                )
+            continue
+        break
+
+    await ingredients.index_recipes(db, [recipe_id], recipe.author_id)
+    await search.reindex_recipe(db, recipe_id)
+    await db.commit()
+    await recipe_cache.invalidate(recipe_id)
+    # The loaded ingredients and steps were changed behind the session's back.
+    db.expire_all()
+    return await get_recipe(db, recipe_id, with_details=True)
+
+
+async def write_recipe_lists(
+    db: AsyncSession,
+    recipe: models.Recipe,
+    lists: Dict[str, List[Tuple[Optional[int], str]]],
+):
+    """Writes the ingredient and step lists planned by plan_recipe_operations."""
+    current = {
+        "ingredient": {i.id: i for i in recipe.ingredients},
+        "step": {s.id: s for s in recipe.steps},
+    }
+    for target, rows in lists.items():
+        table = OPERATION_TARGETS[target].__table__
+        stored = current[target]
+        kept = {row_id for row_id, _ in rows}
+        deleted = [row_id for row_id in stored if row_id not in kept]
+        keys = ordering.assign_keys(
+            [stored[row_id].position if row_id else None for row_id, _ in rows]
+        )
+        changed, inserted = [], []
+        for (row_id, content), key in zip(rows, keys):
+            if row_id is None:
+                inserted.append(
+                    dict(recipe_id=recipe.id, content=content, position=key)
+                )
+            elif (stored[row_id].content, stored[row_id].position) != (content, key):
+                changed.append(
+                    dict(row_id=row_id, new_content=content, new_position=key)
+                )
+        if deleted:
+            await db.execute(delete(table).where(table.c.id.in_(deleted)))
+        moved = [
+            row["row_id"]
+            for row in changed
+            if row["new_position"] != stored[row["row_id"]].position
+        ]
+        if moved:
+            # Positions are unique, so the moved rows are parked below every position
+            # first. Otherwise a row could take a position another has not left yet.
+            lowest = min([row.position for row in stored.values()] + keys)
+            await db.execute(
+                update(table)
+                .where(table.c.id == bindparam("row_id"))
+                .values(position=bindparam("new_position")),
+                [
+                    dict(row_id=row_id, new_position=lowest - n)
+                    for n, row_id in enumerate(moved, start=1)
+                ],
+            )
+        if changed:
+            await db.execute(
+                update(table)
+                .where(table.c.id == bindparam("row_id"))
+                .values(
+                    content=bindparam("new_content"),
+                    position=bindparam("new_position"),
+                ),
+                changed,
+            )
+        if inserted:
+            await db.execute(insert(table), inserted)
+
+
+# Attempts at an append, which is retried when a concurrent append took its position.
+APPEND_ATTEMPTS = 3
+
+
+async def insert_appended(
+    db: AsyncSession,
+    model: Union[Type[models.RecipeIngredient], Type[models.RecipeStep]],
+    recipe_id: int,
+    content: str,
+) -> int:
+    """
+    Inserts an ingredient or step one gap after the recipe's last one, and returns
+    its id. The position is computed by the INSERT statement itself. Two appends
+    that still compute the same position are caught by the unique (recipe_id,
+    position) index, and the loser rolls back to a savepoint and tries again. The
+    rest of the session's transaction is kept.
+    """
+    table = model.__table__
+    last_position = (
+        select(func.max(table.c.position))
+        .where(table.c.recipe_id == recipe_id)
+        .scalar_subquery()
+    )
+    statement = insert(table).from_select(
+        ["content", "recipe_id", "position"],
+        select(
+            literal(content),
+            literal(recipe_id),
+            func.coalesce(last_position + ordering.POSITION_GAP, 0),
+        ),
+    )
+    # SQLite has no RETURNING here, but reports the id of the inserted row.
+    returning = db.bind.dialect.implicit_returning
+    if returning:
+        statement = statement.returning(table.c.id)
+    for attempt in range(1, APPEND_ATTEMPTS + 1):
+        try:
+            async with db.begin_nested():
+                result = await db.execute(statement)
+        except IntegrityError:
+            if attempt == APPEND_ATTEMPTS:
+                raise
+            continue
+        return result.scalar_one() if returning else result.lastrowid
+
+
+async def get_ingredient(
+    db: AsyncSession, ingredient_id: int
+) -> Optional[models.RecipeIngredient]:
+    """Returns the ingredient, with its recipe loaded."""
+    result = await db.execute(
+        select(models.RecipeIngredient)
+        .options(selectinload(models.RecipeIngredient.recipe))
+        .where(models.RecipeIngredient.id == ingredient_id)
+    )
+    return result.scalars().first()
+
+
+async def get_recipe_ingredients(
+    db: AsyncSession, recipe_id: int
+) -> List[models.RecipeIngredient]:
+    result = await db.execute(
+        select(models.RecipeIngredient)
+        .where(models.RecipeIngredient.recipe_id == recipe_id)
+        .order_by(models.RecipeIngredient.position)
+    )
+    return result.scalars().all()
 
 
-def update_ingredient(
-    db: Session, ingredient: models.RecipeIngredient, edit: schemas.RecipeIngredientEdit
+async def update_ingredient(
+    db: AsyncSession,
+    ingredient: models.RecipeIngredient,
+    edit: schemas.RecipeIngredientEdit,
 ):
     setattr(ingredient, "content", edit.content)
-    db.commit()
+    await search.reindex_recipe(db, ingredient.recipe_id)
+    await ingredients.index_ingredient(db, ingredient)
+    await db.commit()
+    await recipe_cache.invalidate(ingredient.recipe_id)
 
 
-def delete_ingredient(db: Session, ingredient: models.RecipeIngredient):
-    # Delete the ingredient and shift the positions of the ingredient
-    # with a higher position down one.
-    empty_position = ingredient.position
+async def delete_ingredient(db: AsyncSession, ingredient: models.RecipeIngredient):
+    # The following ingredients keep their positions. Only their order matters.
     recipe_id = ingredient.recipe_id
-    db.delete(ingredient)    
+    await ingredients.unindex_ingredient(db, ingredient.id)
+    await db.delete(ingredient)
+    await search.reindex_recipe(db, recipe_id)
+    await db.commit()
+    await recipe_cache.invalidate(recipe_id)
+
+
+async def append_recipe_ingredient(
+    db: AsyncSession, recipe_id: int, ingredient: schemas.RecipeIngredientCreate
+) -> models.RecipeIngredient:
+    ingredient_id = await insert_appended(
+        db, models.RecipeIngredient, recipe_id, ingredient.content
+    )
+    db_ingredient = await db.get(models.RecipeIngredient, ingredient_id)
+    await search.reindex_recipe(db, recipe_id)
+    await ingredients.index_ingredient(db, db_ingredient)
+    await db.commit()
+    await recipe_cache.invalidate(recipe_id)
+    return db_ingredient
 
-    (  # Decrement the position of any procededing ingredients.
-        db.query(models.RecipeIngredient)
-        .filter(models.RecipeIngredient.recipe_id == recipe_id)
-        .filter(models.RecipeIngredient.position > empty_position)
-        .update(
-            {models.RecipeIngredient.position: models.RecipeIngredient.position - 1}
+
+async def get_recipes_to_cook_with(
+    db: AsyncSession, author_id: int, on_hand: List[str], limit: int
+) -> List[schemas.CookWithRecipe]:
+    """
+    Returns the author's recipes that use any of the ingredients on hand, ranked by
+    the share of their ingredients that are on hand. Recipes are ranked from the
+    ingredient_terms index, and only the returned recipes are loaded.
+    """
+    on_hand_terms = [
+        terms for terms in map(ingredients.ingredient_terms, on_hand) if terms
+    ]
+    if not on_hand_terms:
+        return []
+    ranked = (
+        await db.execute(
+            ingredients.rank_recipes_by_coverage(author_id, on_hand_terms, limit)
         )
+    ).all()
+    result = await db.execute(
+        select_recipes().where(models.Recipe.id.in_([row.recipe_id for row in ranked]))
     )
-    db.commit()
+    recipes = {recipe.id: recipe for recipe in result.scalars()}
+
+    matches = []
+    for row in ranked:
+        recipe = recipes[row.recipe_id]
+        missing = []
+        for ingredient in recipe.ingredients:
+            terms = ingredients.ingredient_terms(ingredient.content)
+            # Ingredients without terms, like "1 pinch", are not indexed or counted.
+            if terms and not ingredients.covers(on_hand_terms, terms):
+                missing.append(schemas.RecipeIngredientInDB.from_orm(ingredient))
+        matches.append(
+            schemas.CookWithRecipe(
+                recipe=schemas.RecipeInDB.from_orm(recipe),
+                coverage=row.covered / row.total,
+                covered_ingredient_count=row.covered,
+                ingredient_count=row.total,
+                missing_ingredients=missing,
+            )
+        )
+    return matches
 
 
-def append_recipe_ingredient(
-    db: Session, recipe_id: int, ingredient: schemas.RecipeIngredientCreate
-):
-    ingredient_count = (
-        db.query(models.RecipeIngredient)
-        .filter(models.RecipeIngredient.recipe_id == recipe_id)
-        .count()
-    )
-    db_ingredient = models.RecipeIngredient(
-        **ingredient.dict(), recipe_id=recipe_id, position=ingredient_count
+async def get_step(db: AsyncSession, step_id: int) -> Optional[models.RecipeStep]:
+    """Returns the step, with its recipe loaded."""
+    result = await db.execute(
+        select(models.RecipeStep)
+        .options(selectinload(models.RecipeStep.recipe))
+        .where(models.RecipeStep.id == step_id)
     )
-    db.add(db_ingredient)
-    db.commit()
-    return db_ingredient
+    return result.scalars().first()
 
 
-def get_step(db: Session, step_id: int):
-    return db.query(models.RecipeStep).get(step_id)
+async def get_recipe_steps(db: AsyncSession, recipe_id: int) -> List[models.RecipeStep]:
+    result = await db.execute(
+        select(models.RecipeStep)
+        .where(models.RecipeStep.recipe_id == recipe_id)
+        .order_by(models.RecipeStep.position)
+    )
+    return result.scalars().all()
 
 
-def update_step(db: Session, step: models.RecipeStep, edit: schemas.RecipeStepEdit):
+async def update_step(
+    db: AsyncSession, step: models.RecipeStep, edit: schemas.RecipeStepEdit
+) -> models.RecipeStep:
     setattr(step, "content", edit.content)
-    db.commit()
+    await search.reindex_recipe(db, step.recipe_id)
+    await db.commit()
+    await recipe_cache.invalidate(step.recipe_id)
     return step
 
 
-def delete_step(db: Session, step: models.RecipeStep):
-    empty_position = step.position
+async def delete_step(db: AsyncSession, step: models.RecipeStep):
+    # The following steps keep their positions. Only their order matters.
     recipe_id = step.recipe_id
-    
-    db.delete(step)    
-
-    (  # Decrement the position of any procededing steps.
-        db.query(models.RecipeStep)
-        .filter(models.RecipeStep.recipe_id == recipe_id)
-        .filter(models.RecipeStep.position > empty_position)
-        .update(
-            {models.RecipeStep.position: models.RecipeStep.position - 1}
-        )
-    )
-    db.commit()
-    db.delete(step)
-    db.commit()
-
-
-def append_recipe_step(db: Session, recipe_id: int, step: schemas.RecipeStepCreate):
-    step_count = (
-        db.query(models.RecipeStep)
-        .filter(models.RecipeStep.recipe_id == recipe_id)
-        .count()
-    )
-    db_step = models.RecipeStep(**step.dict(), recipe_id=recipe_id, position=step_count)
-    db.add(db_step)
-    db.commit()
+    await db.delete(step)
+    await search.reindex_recipe(db, recipe_id)
+    await db.commit()
+    await recipe_cache.invalidate(recipe_id)
+
+
+async def append_recipe_step(
+    db: AsyncSession, recipe_id: int, step: schemas.RecipeStepCreate
+) -> models.RecipeStep:
+    step_id = await insert_appended(db, models.RecipeStep, recipe_id, step.content)
+    db_step = await db.get(models.RecipeStep, step_id)
+    await search.reindex_recipe(db, recipe_id)
+    await db.commit()
+    await recipe_cache.invalidate(recipe_id)
     return db_step
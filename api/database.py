@@ -1,24 +1,267 @@
-from sqlalchemy import create_engine
+import itertools
+import math
+import time
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import Request, Response
+from jose import JWTError, jwt
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from .settings import settings
 
-if "sqlite" in settings.database_url:
-    engine = create_engine(
-        settings.database_url, connect_args={"check_same_thread": False}
+# asyncio drivers for the databases the app runs on.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(database_url: str) -> URL:
+    """Returns the database URL with the asyncio driver of its database, e.g.
+    sqlite:///db.sqlite becomes sqlite+aiosqlite:///db.sqlite."""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url
+
+
+class PoolMetrics:
+    """Connection checkouts from a pool, and how long they waited for a connection."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_checkout(self, wait_seconds: float):
+        self.checkouts += 1
+        self.wait_seconds_total += wait_seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """The async engine's queue pool, recording its checkouts in self.metrics."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        self.metrics.record_checkout(time.perf_counter() - start)
+        return connection
+
+    def _create_connection(self):
+        self.metrics.connects += 1
+        return super()._create_connection()
+
+    def recreate(self):
+        # Keep counting across engine.dispose(), which replaces the pool.
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def status_metrics(self) -> Dict[str, Any]:
+        metrics = self.metrics
+        return dict(
+            pool_size=self.size(),
+            checked_out=self.checkedout(),
+            checked_in=self.checkedin(),
+            overflow=max(self.overflow(), 0),
+            checkouts=metrics.checkouts,
+            timeouts=metrics.timeouts,
+            connects=metrics.connects,
+            wait_seconds_total=metrics.wait_seconds_total,
+            wait_seconds_max=metrics.wait_seconds_max,
+            wait_seconds_mean=(
+                metrics.wait_seconds_total / metrics.checkouts
+                if metrics.checkouts
+                else 0.0
+            ),
+        )
+
+
+def pool_options() -> Dict[str, Any]:
+    """Engine keyword arguments that size the connection pool from the settings."""
+    return dict(
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+        pool_timeout=settings.database_pool_timeout,
+        pool_recycle=settings.database_pool_recycle,
+        pool_pre_ping=settings.database_pool_pre_ping,
     )
-else:
-    engine = create_engine(settings.database_url)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tunes every new SQLite connection. WAL lets readers run alongside the writer,
+    and with synchronous=NORMAL commits no longer wait for an fsync. A connection
+    that finds the database locked retries for busy_timeout milliseconds instead of
+    failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+    cursor.close()
+
+
+def create_sync_engine(database_url: str) -> Engine:
+    url = make_url(database_url)
+    if url.get_backend_name() != "sqlite":
+        return create_engine(url, **pool_options())
+    # SQLite file databases are not pooled by default, so every session would open a
+    # connection and set up its pragmas again.
+    sync_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        **pool_options(),
+    )
+    event.listen(sync_engine, "connect", set_sqlite_pragmas)
+    return sync_engine
+
+
+def create_app_engine(database_url: str) -> AsyncEngine:
+    """Returns the app's async engine, with a metered connection pool."""
+    url = async_database_url(database_url)
+    app_engine = create_async_engine(url, poolclass=MeteredQueuePool, **pool_options())
+    if url.get_backend_name() == "sqlite":
+        event.listen(app_engine.sync_engine, "connect", set_sqlite_pragmas)
+    return app_engine
+
+
+# The sync engine is used by migrations and scripts. The app uses the async engine.
+engine = create_sync_engine(settings.database_url)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def create_async_sessionmaker(bind: AsyncEngine) -> sessionmaker:
+    # Objects are not expired on commit, because an AsyncSession cannot lazily reload
+    # them when they are serialized after the commit.
+    return sessionmaker(
+        bind=bind,
+        class_=AsyncSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+    )
+
+
+# The primary database, which every write goes to.
+async_engine = create_app_engine(settings.database_url)
+
+AsyncSessionLocal = create_async_sessionmaker(async_engine)
+
+# Read replicas of the primary. Reads are spread over them in turn.
+replica_engines = [create_app_engine(url) for url in settings.database_replica_urls]
+
+ReplicaSessionLocals = [create_async_sessionmaker(e) for e in replica_engines]
+
+_next_replica = itertools.cycle(range(len(ReplicaSessionLocals)))
+
 Base = declarative_base()
 
-# FastAPI Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+
+class RecentWriters:
+    """
+    Marks clients that committed a write in the last window seconds, with a signed
+    cookie that expires at the end of the window. Replicas lag behind the primary,
+    so these clients read from the primary until then, and always see their own
+    writes. The mark travels with the client, so every app process routes its next
+    reads the same way.
+    """
+
+    COOKIE = "recent_write"
+    ALGORITHM = "HS256"
+
+    def __init__(self, secret_key: str, window: float):
+        self.secret_key = secret_key
+        self.window = window
+
+    def mark(self, response: Response):
+        """Starts the window of the response's client, replacing any mark the
+        response already has from an earlier commit."""
+        token = jwt.encode(
+            {"exp": time.time() + self.window},
+            self.secret_key,
+            algorithm=self.ALGORITHM,
+        )
+        prefix = f"{self.COOKIE}=".encode("latin-1")
+        response.raw_headers[:] = [
+            (name, value)
+            for name, value in response.raw_headers
+            if not (name == b"set-cookie" and value.startswith(prefix))
+        ]
+        response.set_cookie(
+            self.COOKIE,
+            token,
+            max_age=math.ceil(self.window),
+            httponly=True,
+            secure=not settings.debug,
+        )
+
+    def wrote_recently(self, request: Request) -> bool:
+        token = request.cookies.get(self.COOKIE)
+        if not token:
+            return False
+        try:
+            jwt.decode(token, self.secret_key, algorithms=[self.ALGORITHM])
+        except JWTError:  # Expired, or not signed by the app.
+            return False
+        return True
+
+
+recent_writers = RecentWriters(
+    settings.secret_key, settings.database_read_your_writes_seconds
+)
+
+
+@event.listens_for(Session, "after_commit")
+def mark_recent_writer(session: Session):
+    response = session.info.get("response")
+    if response is not None:
+        recent_writers.mark(response)
+
+
+def read_sessionmaker(wrote_recently: bool) -> sessionmaker:
+    """The sessions that a client's reads use: the next replica, or the primary when
+    there are no replicas or the client wrote recently."""
+    if not ReplicaSessionLocals or wrote_recently:
+        return AsyncSessionLocal
+    return ReplicaSessionLocals[next(_next_replica)]
+
+
+# FastAPI Dependencies
+
+
+async def get_db(response: Response) -> AsyncIterator[AsyncSession]:
+    """A session on the primary, for routes that write. Its commits start the
+    client's read-your-writes window."""
+    async with AsyncSessionLocal() as db:
+        db.info["response"] = response
+        yield db
+
+
+async def get_read_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """A session for routes that only read, on a replica when there is one."""
+    async with read_sessionmaker(recent_writers.wrote_recently(request))() as db:
         yield db
-    finally:
-        db.close()
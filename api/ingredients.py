@@ -0,0 +1,193 @@
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Tuple
+
+from sqlalchemy import Float, cast, delete, func, insert, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from api import models
+
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+# Words of an ingredient line that do not name the ingredient, in singular form.
+# fmt: off
+UNITS = {
+    "bag", "bottle", "box", "bunch", "can", "clove", "container", "cup", "dash",
+    "gallon", "gram", "handful", "head", "inch", "jar", "kg", "kilogram", "lb",
+    "liter", "litre", "ml", "ounce", "oz", "package", "pinch", "pint", "piece",
+    "pkg", "pound", "quart", "slice", "sprig", "stick", "tablespoon", "tbsp",
+    "teaspoon", "tsp",
+}
+PREPARATIONS = {
+    "chopped", "crushed", "cubed", "cut", "diced", "divided", "drained", "finely",
+    "fresh", "freshly", "grated", "halved", "large", "medium", "melted", "minced",
+    "optional", "packed", "peeled", "rinsed", "roughly", "shredded", "sliced",
+    "small", "softened", "taste", "thinly",
+}
+STOP_WORDS = {
+    "a", "about", "an", "and", "at", "for", "in", "into", "more", "of", "or",
+    "plus", "the", "to", "with",
+}
+# fmt: on
+IGNORED_WORDS = UNITS | PREPARATIONS | STOP_WORDS
+
+
+def singular(word: str) -> str:
+    """A rough English singular, good enough to match tomatoes with tomato."""
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def ingredient_terms(content: str) -> FrozenSet[str]:
+    """
+    The normalized words that name an ingredient, without its quantity, unit or
+    preparation, e.g. "2 cans crushed tomatoes" -> {"tomato"} and
+    "1 cup black beans, drained" -> {"black", "bean"}.
+    """
+    words = (singular(word) for word in WORD_PATTERN.findall(content.lower()))
+    return frozenset(
+        word for word in words if len(word) > 1 and word not in IGNORED_WORDS
+    )
+
+
+def covers(on_hand: Iterable[FrozenSet[str]], terms: FrozenSet[str]) -> bool:
+    """An ingredient is covered by an ingredient on hand that it has every term of,
+    e.g. "beans" covers "black beans", but "black beans" does not cover "beans"."""
+    return bool(terms) and any(have <= terms for have in on_hand)
+
+
+def term_rows(
+    ingredient_id: int, recipe_id: int, author_id: int, content: str
+) -> List[Dict[str, Any]]:
+    """The ingredient_terms rows of an ingredient."""
+    return [
+        dict(
+            ingredient_id=ingredient_id,
+            term=term,
+            recipe_id=recipe_id,
+            author_id=author_id,
+        )
+        for term in sorted(ingredient_terms(content))
+    ]
+
+
+async def index_ingredient(db: AsyncSession, ingredient: models.RecipeIngredient):
+    """Rewrites the ingredient's rows of the ingredient_terms index from its current
+    content, in the session's transaction."""
+    await unindex_ingredient(db, ingredient.id)
+    if not ingredient_terms(ingredient.content):
+        return
+    author_id = (
+        await db.execute(
+            select(models.Recipe.author_id).where(
+                models.Recipe.id == ingredient.recipe_id
+            )
+        )
+    ).scalar_one()
+    await db.execute(
+        insert(models.IngredientTerm),
+        term_rows(ingredient.id, ingredient.recipe_id, author_id, ingredient.content),
+    )
+
+
+async def index_recipes(db: AsyncSession, recipe_ids: List[int], author_id: int):
+    """Rewrites the ingredient_terms rows of all of the ingredients of the author's
+    recipes, with one bulk delete and one bulk insert, in the session's transaction."""
+    await db.execute(
+        delete(models.IngredientTerm).where(
+            models.IngredientTerm.recipe_id.in_(recipe_ids)
+        )
+    )
+    result = await db.execute(
+        select(
+            models.RecipeIngredient.id,
+            models.RecipeIngredient.recipe_id,
+            models.RecipeIngredient.content,
+        ).where(models.RecipeIngredient.recipe_id.in_(recipe_ids))
+    )
+    await index_new_ingredients(db, result, author_id)
+
+
+async def index_new_ingredients(
+    db: AsyncSession, ingredients: Iterable[Tuple[int, int, str]], author_id: int
+):
+    """
+    Inserts the ingredient_terms rows of the author's (ingredient_id, recipe_id,
+    content) ingredients, which have none yet, with one bulk insert. Imports repeat
+    the same ingredient lines a lot, so each line is normalized only once.
+    """
+    terms: Dict[str, List[str]] = {}
+    rows = []
+    for ingredient_id, recipe_id, content in ingredients:
+        if content not in terms:
+            terms[content] = sorted(ingredient_terms(content))
+        rows.extend(
+            dict(
+                ingredient_id=ingredient_id,
+                term=term,
+                recipe_id=recipe_id,
+                author_id=author_id,
+            )
+            for term in terms[content]
+        )
+    if rows:
+        await db.execute(insert(models.IngredientTerm), rows)
+
+
+async def unindex_ingredient(db: AsyncSession, ingredient_id: int):
+    await db.execute(
+        delete(models.IngredientTerm).where(
+            models.IngredientTerm.ingredient_id == ingredient_id
+        )
+    )
+
+
+def rank_recipes_by_coverage(
+    author_id: int, on_hand: List[FrozenSet[str]], limit: int
+) -> Select:
+    """
+    Select the (recipe_id, covered, total) of the author's recipes with at least one
+    ingredient covered by the ingredients on hand, best covered first. covered and
+    total count the recipe's indexed ingredients. Only the index is read.
+    on_hand must not be empty, nor contain empty term sets.
+    """
+    terms = models.IngredientTerm
+    # Ingredients that have every term of an ingredient on hand.
+    covered_ingredients = union(
+        *[
+            select(terms.ingredient_id, terms.recipe_id)
+            .where(terms.author_id == author_id, terms.term.in_(sorted(have)))
+            .group_by(terms.ingredient_id, terms.recipe_id)
+            .having(func.count(terms.term) == len(have))
+            for have in on_hand
+        ]
+    ).subquery("covered_ingredients")
+    covered = (
+        select(
+            covered_ingredients.c.recipe_id,
+            func.count(covered_ingredients.c.ingredient_id).label("covered"),
+        )
+        .group_by(covered_ingredients.c.recipe_id)
+        .subquery("covered")
+    )
+    totals = (
+        select(
+            terms.recipe_id,
+            func.count(func.distinct(terms.ingredient_id)).label("total"),
+        )
+        .where(terms.recipe_id.in_(select(covered.c.recipe_id)))
+        .group_by(terms.recipe_id)
+        .subquery("totals")
+    )
+    coverage = cast(covered.c.covered, Float) / totals.c.total
+    return (
+        select(covered.c.recipe_id, covered.c.covered, totals.c.total)
+        .join(totals, totals.c.recipe_id == covered.c.recipe_id)
+        .order_by(coverage.desc(), covered.c.covered.desc(), covered.c.recipe_id)
+        .limit(limit)
+    )
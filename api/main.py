@@ -1,16 +1,23 @@
+import asyncio
+import os
 from logging import config as logging_config
-from typing import List
+from typing import BinaryIO, Iterator, List, Optional, Union
 
-from fastapi import FastAPI, Depends, status, Response
+from fastapi import FastAPI, BackgroundTasks, Depends, Query, Request, status
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import HTTPException
 from fastapi.routing import _prepare_response_content
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api import schemas, crud, auth
-from api.database import get_db
-from api.cookbooks import generator as cookbook_generator
+from api import schemas, crud, auth, models, recipe_import
+from api.database import MeteredQueuePool, get_db, get_read_db
+from api.maintenance import reconcile_recipe_counts_periodically
+from api.recipe_cache import recipe_cache
+from api.settings import settings
+from api.cookbooks.engine import render_engine, RenderQueueFull, RenderTimeout
+from api.cookbooks import jobs
 
 # setup loggers
 logging_config.fileConfig("api/logging.conf", disable_existing_loggers=False)
@@ -34,6 +41,91 @@ app.add_middleware(
 )
 
 
+@app.on_event("shutdown")
+def shutdown_render_engine():
+    render_engine.shutdown()
+
+
+maintenance_tasks: List[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def start_maintenance_tasks():
+    if settings.recipe_count_reconcile_interval > 0:
+        maintenance_tasks.append(
+            asyncio.create_task(
+                reconcile_recipe_counts_periodically(
+                    settings.recipe_count_reconcile_interval
+                )
+            )
+        )
+
+
+@app.on_event("shutdown")
+def stop_maintenance_tasks():
+    while maintenance_tasks:
+        maintenance_tasks.pop().cancel()
+
+
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+async def render_pdf(
+    author: Union[models.User, schemas.User], recipes: List[schemas.RecipeInDB]
+) -> BinaryIO:
+    """Render the recipes in the render engine, mapping engine errors to HTTP errors.
+    Returns the PDF opened for reading."""
+    try:
+        return await render_engine.render(author, recipes)
+    except RenderQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many PDFs are being generated. Please try again shortly.",
+        )
+    except RenderTimeout:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="PDF generation took too long.",
+        )
+
+
+def pdf_response(pdf_file: BinaryIO, filename: str) -> StreamingResponse:
+    """Streams the PDF file in chunks, so the PDF is never held in memory at once.
+    The response closes the file when it is done."""
+    fd = pdf_file.fileno()
+    size = os.fstat(fd).st_size
+
+    def chunks() -> Iterator[bytes]:
+        try:
+            offset = 0
+            while offset < size:
+                chunk = os.pread(fd, PDF_CHUNK_SIZE, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+        finally:
+            pdf_file.close()
+
+    return StreamingResponse(
+        chunks(),
+        media_type="application/pdf",
+        headers={
+            "Content-Length": str(size),
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        },
+    )
+
+
+async def get_recipe_page(
+    db: AsyncSession, params: schemas.RecipeSearch, author_id: Optional[int] = None
+) -> schemas.PaginatedRecipes:
+    try:
+        return await crud.get_recipes(db=db, recipe_params=params, author_id=author_id)
+    except crud.InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -45,8 +137,8 @@ async def get_my_user(user: schemas.AuthenticatedUser = Depends(auth.get_current
 
 
 @app.get("/users/{user_id}/", response_model=schemas.User)
-async def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id)
+async def get_user_by_id(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    db_user = await crud.get_user(db, user_id)
     if not db_user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
@@ -58,9 +150,9 @@ async def get_user_by_id(user_id: int, db: Session = Depends(get_db)):
 async def get_recipes(
     params: schemas.RecipeSearch = Depends(),
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return crud.get_recipes(db=db, recipe_params=params)
+    return await get_recipe_page(db, params)
 
 
 @app.post(
@@ -70,10 +162,24 @@ async def get_recipes(
 async def create_user_recipe(
     recipe: schemas.RecipeCreate,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
 
-    return crud.create_recipe(db, author_id=user.id, recipe=recipe)
+    return await crud.create_recipe(db, author_id=user.id, recipe=recipe)
+
+
+@app.post("/recipes/import/", response_model=schemas.RecipeImportReport)
+async def import_recipes(
+    request: Request,
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Imports recipes from an upload of RecipeCreate rows, either NDJSON with one
+    recipe per line or a JSON array. The upload is parsed and imported while it
+    streams in. Rows that fail are skipped and reported by their index.
+    """
+    return await recipe_import.import_recipes(db, user.id, request.stream())
 
 
 @app.post("/recipes/{recipe_id}/", response_model=schemas.RecipeInDB)
@@ -81,9 +187,34 @@ async def update_recipe(
     recipe_id: int,
     edit: schemas.RecipeEdit,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+):
+    recipe = await crud.get_recipe(db, recipe_id, with_details=True)
+    if not recipe:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Could not find recipe with id {recipe_id}",
+        )
+    if recipe.author_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have access to this recipe.",
+        )
+
+    recipe = await crud.update_recipe(db, recipe, edit)
+    return schemas.RecipeInDB.from_orm(recipe)
+
+
+@app.patch("/recipes/{recipe_id}/", response_model=schemas.RecipeInDB)
+async def patch_recipe(
+    recipe_id: int,
+    patch: schemas.RecipePatch,
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    recipe = crud.get_recipe(db, recipe_id)
+    """Applies a batch of insert, edit, move and delete operations to the recipe's
+    ingredients and steps, all or none of them."""
+    recipe = await crud.get_recipe(db, recipe_id, with_details=True)
     if not recipe:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -95,7 +226,19 @@ async def update_recipe(
             detail="You do not have access to this recipe.",
         )
 
-    recipe = crud.update_recipe(db, recipe, edit)
+    try:
+        recipe = await crud.patch_recipe(db, recipe, patch.operations)
+    except crud.RecipeChanged as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except crud.InvalidOperations as e:
+        # Reported like FastAPI's own validation errors.
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=[
+                dict(loc=["body", "operations", index], msg=message, type="value_error")
+                for index, message in e.errors
+            ],
+        )
     return schemas.RecipeInDB.from_orm(recipe)
 
 
@@ -103,9 +246,9 @@ async def update_recipe(
 async def generate_recipe_pdf(
     recipe_id: int,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    recipe = crud.get_recipe(db, recipe_id)
+    recipe = await crud.get_recipe_details(db, recipe_id)
     if not recipe:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -116,13 +259,8 @@ async def generate_recipe_pdf(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have access to this recipe.",
         )
-    recipe_list = [schemas.RecipeInDB.from_orm(recipe)]
-    pdf_bytes = cookbook_generator.generate_pdf_from_recipes(recipe.author, recipe_list)
-    response = Response(content=pdf_bytes, media_type="application/pdf")
-    response.headers.update(
-        {"Content-Disposition": "attachment", "filename": "my-recipe.pdf"}
-    )
-    return response
+    pdf_file = await render_pdf(recipe.author, [recipe])
+    return pdf_response(pdf_file, "my-recipe.pdf")
 
 
 @app.get("/users/{author_id}/recipes/", response_model=schemas.PaginatedRecipes)
@@ -130,46 +268,159 @@ async def get_user_recipes(
     author_id: int,
     params: schemas.RecipeSearch = Depends(),
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     # get author or 404
-    if not crud.get_user(db, author_id):
+    if not await crud.get_user(db, author_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User does not exist"
         )
-    return crud.get_recipes(db=db, recipe_params=params, author_id=author_id)
+    return await get_recipe_page(db, params, author_id=author_id)
+
+
+@app.get(
+    "/users/{author_id}/recipes/cook-with/",
+    response_model=List[schemas.CookWithRecipe],
+)
+async def get_recipes_to_cook_with(
+    author_id: int,
+    ingredients: List[str] = Query(..., description="Ingredients on hand."),
+    limit: int = Query(10, ge=1, le=100),
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """The author's recipes, ranked by how much of their ingredient lists the
+    ingredients on hand cover."""
+    if user.id != author_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="cannot access user data"
+        )
+    return await crud.get_recipes_to_cook_with(db, author_id, ingredients, limit)
 
 
 @app.get("/users/{author_id}/recipes/generate-pdf/")
 async def generate_user_recipes_pdf(
     author_id: int,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     if user.id != author_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="cannot access user data"
         )
-    author = crud.get_user(db, user.id)
+    author = await crud.get_user(db, user.id)
     if not author:
         raise Exception("Could not retrieve user with known ID. Weird.")
-    recipe_list = [schemas.RecipeInDB.from_orm(recipe) for recipe in author.recipes]
-    pdf_bytes = cookbook_generator.generate_pdf_from_recipes(author, recipe_list)
-    response = Response(content=pdf_bytes, media_type="application/pdf")
-    response.headers.update(
-        {"Content-Disposition": "attachment", "filename": "my-recipes.pdf"}
+    recipe_list = [
+        schemas.RecipeInDB.from_orm(recipe)
+        for recipe in await crud.get_author_recipes(db, author.id)
+    ]
+    pdf_file = await render_pdf(author, recipe_list)
+    return pdf_response(pdf_file, "my-recipes.pdf")
+
+
+@app.post(
+    "/users/{author_id}/recipes/generate-pdf/jobs/",
+    response_model=schemas.CookbookJobStatus,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def start_user_recipes_pdf_job(
+    author_id: int,
+    background_tasks: BackgroundTasks,
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    if user.id != author_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="cannot access user data"
+        )
+    try:
+        job = await jobs.create_job(db, author_id)
+    except jobs.TooManyJobs as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e)
+        )
+    background_tasks.add_task(jobs.run_cookbook_job, job.id)
+    return jobs.job_status(job)
+
+
+async def get_user_job(
+    db: AsyncSession, job_id: str, user: schemas.AuthenticatedUser
+) -> models.CookbookJob:
+    job = await jobs.get_job(db, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="job does not exist"
+        )
+    if job.author_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="job does not belong to user",
+        )
+    return job
+
+
+# Jobs are read from the primary database, which their progress is written to.
+
+
+@app.get("/cookbook-jobs/{job_id}/", response_model=schemas.CookbookJobStatus)
+async def get_cookbook_job(
+    job_id: str,
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    return jobs.job_status(await get_user_job(db, job_id, user))
+
+
+@app.get("/cookbook-jobs/{job_id}/events/")
+async def stream_cookbook_job_events(
+    job_id: str,
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Server-Sent Events stream of the job's stages, ending when the job finishes."""
+    job = await get_user_job(db, job_id, user)
+
+    async def events():
+        async for job_status in jobs.job_statuses(job.id):
+            yield f"event: {job_status.stage}\ndata: {job_status.json()}\n\n"
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
     )
-    return response
+
+
+@app.get("/cookbook-jobs/{job_id}/pdf/")
+async def download_cookbook_job_pdf(
+    job_id: str,
+    user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    job = await get_user_job(db, job_id, user)
+    if not job.pdf_path:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"cookbook is not ready. The job is {job.stage}.",
+        )
+    # Every download opens the PDF itself, so it can finish even if the job
+    # expires and removes the file in the meantime.
+    try:
+        pdf_file = open(job.pdf_path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="job does not exist"
+        )
+    return pdf_response(pdf_file, "my-recipes.pdf")
 
 
 @app.get("/recipes/{recipe_id}/", response_model=schemas.RecipeInDB)
 async def get_single_recipe(
     recipe_id: int,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     # get recipe
-    recipe = crud.get_recipe(db, recipe_id)
+    recipe = await crud.get_recipe_details(db, recipe_id)
     if not recipe:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="recipe does not exist"
@@ -182,7 +433,7 @@ async def get_single_recipe(
             detail="recipe does not belong to user",
         )
 
-    return schemas.RecipeInDB.from_orm(recipe)
+    return recipe
 
 
 @app.post(
@@ -193,10 +444,10 @@ async def update_ingredient(
     ingredient_id: int,
     ingredient_edit: schemas.RecipeIngredientEdit,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # get ingredient or 404
-    ingredient = crud.get_ingredient(db, ingredient_id)
+    ingredient = await crud.get_ingredient(db, ingredient_id)
     if not ingredient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="ingredient does not exist"
@@ -209,12 +460,16 @@ async def update_ingredient(
         )
 
     # Edit the ingredient
-    crud.update_ingredient(db, ingredient, ingredient_edit)
+    await crud.update_ingredient(db, ingredient, ingredient_edit)
     # Return all of the recipe's ingredients
-    return [
-        schemas.RecipeIngredientInDB.from_orm(ingredient)
-        for ingredient in ingredient.recipe.ingredients
-    ]
+    return schemas.dense_positions(
+        [
+            schemas.RecipeIngredientInDB.from_orm(ingredient)
+            for ingredient in await crud.get_recipe_ingredients(
+                db, ingredient.recipe_id
+            )
+        ]
+    )
 
 
 @app.delete(
@@ -224,10 +479,10 @@ async def update_ingredient(
 async def delete_ingredient(
     ingredient_id: int,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # get ingredient or 404
-    ingredient = crud.get_ingredient(db, ingredient_id)
+    ingredient = await crud.get_ingredient(db, ingredient_id)
     if not ingredient:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="ingredient does not exist"
@@ -240,12 +495,16 @@ async def delete_ingredient(
         )
 
     # Delete the ingredient
-    crud.delete_ingredient(db, ingredient)
+    await crud.delete_ingredient(db, ingredient)
     # Return all of the recipe's ingredients
-    return [
-        schemas.RecipeIngredientInDB.from_orm(ingredient)
-        for ingredient in ingredient.recipe.ingredients
-    ]
+    return schemas.dense_positions(
+        [
+            schemas.RecipeIngredientInDB.from_orm(ingredient)
+            for ingredient in await crud.get_recipe_ingredients(
+                db, ingredient.recipe_id
+            )
+        ]
+    )
 
 
 @app.post(
@@ -256,10 +515,10 @@ async def add_ingredient(
     recipe_id: int,
     new_ingredient: schemas.RecipeIngredientCreate,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # get recipe
-    recipe = crud.get_recipe(db, recipe_id)
+    recipe = await crud.get_recipe(db, recipe_id)
     if not recipe:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="recipe does not exist"
@@ -273,16 +532,18 @@ async def add_ingredient(
         )
 
     # Append the ingredient.
-    db_ingredient = crud.append_recipe_ingredient(db, recipe_id, new_ingredient)
+    db_ingredient = await crud.append_recipe_ingredient(db, recipe_id, new_ingredient)
     if not db_ingredient:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Unknown server error",
         )
-    return [
-        schemas.RecipeIngredientInDB.from_orm(ingredient)
-        for ingredient in recipe.ingredients
-    ]
+    return schemas.dense_positions(
+        [
+            schemas.RecipeIngredientInDB.from_orm(ingredient)
+            for ingredient in await crud.get_recipe_ingredients(db, recipe_id)
+        ]
+    )
 
 
 @app.post("/recipes/steps/{step_id}/", response_model=List[schemas.RecipeStepInDB])
@@ -290,10 +551,10 @@ async def update_step(
     step_id: int,
     edit_step: schemas.RecipeStepEdit,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # get step or 404
-    step = crud.get_step(db, step_id)
+    step = await crud.get_step(db, step_id)
     if not step:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="step does not exist"
@@ -306,18 +567,23 @@ async def update_step(
         )
 
     # Edit the step
-    crud.update_step(db, step, edit_step)
-    return [schemas.RecipeStepInDB.from_orm(step) for step in step.recipe.steps]
+    await crud.update_step(db, step, edit_step)
+    return schemas.dense_positions(
+        [
+            schemas.RecipeStepInDB.from_orm(step)
+            for step in await crud.get_recipe_steps(db, step.recipe_id)
+        ]
+    )
 
 
 @app.delete("/recipes/steps/{step_id}/", response_model=List[schemas.RecipeStepInDB])
 async def delete_step(
     step_id: int,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # get step or 404
-    step = crud.get_step(db, step_id)
+    step = await crud.get_step(db, step_id)
     if not step:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="step does not exist"
@@ -330,8 +596,13 @@ async def delete_step(
         )
 
     # Delete the step
-    crud.delete_step(db, step)
-    return [schemas.RecipeStepInDB.from_orm(step) for step in step.recipe.steps]
+    await crud.delete_step(db, step)
+    return schemas.dense_positions(
+        [
+            schemas.RecipeStepInDB.from_orm(step)
+            for step in await crud.get_recipe_steps(db, step.recipe_id)
+        ]
+    )
 
 
 @app.post(
@@ -342,10 +613,10 @@ async def add_step(
     recipe_id: int,
     new_step: schemas.RecipeStepCreate,
     user: schemas.AuthenticatedUser = Depends(auth.get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     # get recipe
-    recipe = crud.get_recipe(db, recipe_id)
+    recipe = await crud.get_recipe(db, recipe_id)
     if not recipe:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="recipe does not exist"
@@ -359,13 +630,41 @@ async def add_step(
         )
 
     # Append the step.
-    db_step = crud.append_recipe_step(db, recipe_id, new_step)
+    db_step = await crud.append_recipe_step(db, recipe_id, new_step)
     if not db_step:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Unknown server error",
         )
-    return [schemas.RecipeStepInDB.from_orm(step) for step in recipe.steps]
+    return schemas.dense_positions(
+        [
+            schemas.RecipeStepInDB.from_orm(step)
+            for step in await crud.get_recipe_steps(db, recipe_id)
+        ]
+    )
+
+
+@app.get("/admin/metrics/database/", response_model=schemas.DatabasePoolMetrics)
+async def get_database_metrics(
+    admin: schemas.AuthenticatedUser = Depends(auth.get_current_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """Usage of the database connection pool since the app started."""
+    pool = db.bind.sync_engine.pool
+    if not isinstance(pool, MeteredQueuePool):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The database pool does not record metrics.",
+        )
+    return pool.status_metrics()
+
+
+@app.get("/admin/metrics/recipe-cache/", response_model=schemas.RecipeCacheMetrics)
+async def get_recipe_cache_metrics(
+    admin: schemas.AuthenticatedUser = Depends(auth.get_current_admin),
+):
+    """Hits, misses and evictions of this process's recipe cache since it started."""
+    return recipe_cache.stats()
 
 
 app.include_router(auth.router)
@@ -0,0 +1,23 @@
+import asyncio
+import logging
+
+from api import crud
+from api.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+async def reconcile_recipe_counts():
+    """Recounts the recipes of every recipe counter in a session of its own."""
+    async with AsyncSessionLocal() as db:
+        await crud.reconcile_recipe_counts(db)
+
+
+async def reconcile_recipe_counts_periodically(interval: float):
+    """Reconciles the recipe counters every interval seconds, until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reconcile_recipe_counts()
+        except Exception:
+            logger.exception("Could not reconcile recipe counts")
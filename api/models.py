@@ -1,7 +1,18 @@
 from typing import Optional
 import enum
 
-from sqlalchemy import String, Column, Integer, TIMESTAMP, ForeignKey, Enum
+from sqlalchemy import (
+    DDL,
+    String,
+    Column,
+    Float,
+    Integer,
+    TIMESTAMP,
+    ForeignKey,
+    Enum,
+    Index,
+)
+from sqlalchemy import event
 from sqlalchemy.orm import relationship
 
 from api.database import Base
@@ -34,6 +45,51 @@ class Recipe(Base):
         order_by="RecipeIngredient.position",
     )
 
+    # Recipe listings are ordered and paginated on (created_at, id).
+    __table_args__ = (
+        Index("ix_recipes_created_at_id", "created_at", "id"),
+        Index("ix_recipes_author_id_created_at_id", "author_id", "created_at", "id"),
+    )
+
+
+class RecipeCount(Base):
+    """
+    Number of recipes per author, kept up to date in the same transaction as every
+    recipe insert or delete, so listings do not have to count their rows.
+    The row with author_id ALL_AUTHORS counts every recipe.
+    """
+
+    __tablename__ = "recipe_counts"
+
+    ALL_AUTHORS = 0
+
+    author_id = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False)
+
+
+# Full-text search index over recipe names, ingredients and steps, one row per
+# recipe. SQLite and Postgres index text differently, so the table is created with
+# the dialect's own DDL instead of being mapped. Its rows are written by
+# api.search.reindex_recipe.
+RECIPE_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE recipe_search USING fts5("
+        "name, ingredients, steps, tokenize='porter unicode61')"
+    ],
+    "postgresql": [
+        "CREATE TABLE recipe_search ("
+        "recipe_id INTEGER PRIMARY KEY REFERENCES recipes (id) ON DELETE CASCADE, "
+        "document TSVECTOR NOT NULL)",
+        "CREATE INDEX ix_recipe_search_document ON recipe_search USING GIN (document)",
+    ],
+}
+for dialect, statements in RECIPE_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(
+            Base.metadata, "after_create", DDL(statement).execute_if(dialect=dialect)
+        )
+event.listen(Base.metadata, "before_drop", DDL("DROP TABLE IF EXISTS recipe_search"))
+
 
 class RecipeStep(Base):
     __tablename__ = "recipe_steps"
@@ -41,7 +97,7 @@ class RecipeStep(Base):
     id = Column(Integer, primary_key=True, index=True)
     position = Column(
         Integer, nullable=False
-    )  # The position of the step in the recipe, starting at 0.
+    )  # Sort key of the step in the recipe. Keys have gaps, see api.ordering.
     content = Column(String, nullable=False)
     recipe_id = Column(
         Integer, ForeignKey("recipes.id"), index=True, unique=False, nullable=False
@@ -51,6 +107,13 @@ class RecipeStep(Base):
         "Recipe", back_populates="steps", uselist=False
     )  # One recipe to one step.
 
+    # No two steps of a recipe share a position, even when appended concurrently.
+    __table_args__ = (
+        Index(
+            "ix_recipe_steps_recipe_id_position", "recipe_id", "position", unique=True
+        ),
+    )
+
 
 class RecipeIngredient(Base):
     __tablename__ = "ingredients"
@@ -60,10 +123,46 @@ class RecipeIngredient(Base):
     recipe_id = Column(Integer, ForeignKey("recipes.id"), index=True, nullable=False)
     position = Column(
         Integer, nullable=False
-    )  # The position of this ingredient in the recipe's ingredient list, starting at 0.
+    )  # Sort key of this ingredient in the recipe's ingredient list, see api.ordering.
 
     recipe = relationship("Recipe", back_populates="ingredients", uselist=False)
 
+    # No two ingredients of a recipe share a position, even when appended concurrently.
+    __table_args__ = (
+        Index(
+            "ix_ingredients_recipe_id_position", "recipe_id", "position", unique=True
+        ),
+    )
+
+
+class IngredientTerm(Base):
+    """
+    Inverted index of ingredients by the normalized words of their content, e.g.
+    "2 cans crushed tomatoes" is indexed under "tomato". Rows are written by
+    api.ingredients.index_ingredient. author_id is the recipe's author, so one
+    author's recipes are found without reading anyone else's terms.
+    """
+
+    __tablename__ = "ingredient_terms"
+
+    ingredient_id = Column(
+        Integer, ForeignKey("ingredients.id", ondelete="CASCADE"), primary_key=True
+    )
+    term = Column(String, primary_key=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id"), nullable=False)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_ingredient_terms_author_id_term",
+            "author_id",
+            "term",
+            "ingredient_id",
+            "recipe_id",
+        ),
+        Index("ix_ingredient_terms_recipe_id", "recipe_id"),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
@@ -108,3 +207,21 @@ class OAuth2Token(Base):
     )  # unique=True enforces 1 token per user.
 
     user = relationship("User", back_populates="token")
+
+
+class CookbookJob(Base):
+    """
+    A cookbook build that runs after the request that started it has returned. Jobs
+    are kept here rather than in the process that runs them, so that every app
+    process can report their progress and serve their PDF. See api.cookbooks.jobs.
+    """
+
+    __tablename__ = "cookbook_jobs"
+
+    id = Column(String(length=32), primary_key=True)
+    author_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    stage = Column(String(length=20), nullable=False)
+    progress = Column(Float, nullable=False)  # From 0 to 1.
+    detail = Column(String, nullable=True)
+    pdf_path = Column(String, nullable=True)  # Set once the PDF is rendered.
+    updated_at = Column(TIMESTAMP, nullable=False, index=True)
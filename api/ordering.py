@@ -0,0 +1,82 @@
+from bisect import bisect_left
+from typing import List, Optional, Set
+
+# Steps and ingredients are sorted by integer keys spaced POSITION_GAP apart, so that
+# a row can be inserted or moved between two others by giving it a key in the gap,
+# without changing any other row. The API numbers rows 0, 1, 2... instead.
+POSITION_GAP = 1024
+
+
+def initial_keys(count: int) -> List[int]:
+    return [n * POSITION_GAP for n in range(count)]
+
+
+def keys_between(
+    before: Optional[int], after: Optional[int], count: int
+) -> Optional[List[int]]:
+    """count increasing keys between before and after, either of which may be None
+    for the start or end of the list. None if there is no room for them."""
+    if before is None and after is None:
+        return initial_keys(count)
+    if after is None:
+        return [before + n * POSITION_GAP for n in range(1, count + 1)]
+    if before is None:
+        return [after - n * POSITION_GAP for n in range(count, 0, -1)]
+    step = (after - before) // (count + 1)
+    if step < 1:
+        return None
+    return [before + n * step for n in range(1, count + 1)]
+
+
+def ordered_indexes(keys: List[Optional[int]]) -> Set[int]:
+    """The indexes of a longest strictly increasing subsequence of the keys. None
+    keys are never part of it."""
+    tails: List[int] = []  # Smallest last key of an increasing run of each length.
+    tail_indexes: List[int] = []
+    previous: List[Optional[int]] = [None] * len(keys)
+    for index, key in enumerate(keys):
+        if key is None:
+            continue
+        length = bisect_left(tails, key)
+        if length == len(tails):
+            tails.append(key)
+            tail_indexes.append(index)
+        else:
+            tails[length] = key
+            tail_indexes[length] = index
+        previous[index] = tail_indexes[length - 1] if length else None
+
+    indexes = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        indexes.add(index)
+        index = previous[index]
+    return indexes
+
+
+def assign_keys(keys: List[Optional[int]]) -> List[int]:
+    """
+    Returns sort keys for rows in the order given. keys are the rows' current keys,
+    or None for new rows. The longest in-order run of current keys is kept, and the
+    other rows get keys in the gaps around them, so a move or insert only changes the
+    rows that were moved or inserted. When a gap is too small, every row is
+    renumbered.
+    """
+    kept = ordered_indexes(keys)
+    assigned = list(keys)
+    start = 0
+    while start < len(keys):
+        if start in kept:
+            start += 1
+            continue
+        end = start
+        while end < len(keys) and end not in kept:
+            end += 1
+        before = assigned[start - 1] if start else None
+        after = keys[end] if end < len(keys) else None
+        between = keys_between(before, after, end - start)
+        if between is None:
+            return initial_keys(len(keys))
+        assigned[start:end] = between
+        start = end
+    return assigned
@@ -0,0 +1,147 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from api import schemas
+from api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """A process-local store of the max_entries most recently used values, each of
+    which expires ttl seconds after it was stored. Deletes only reach this process,
+    so the values of other processes stay stale until they expire."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    """A store shared by every process of the app, in Redis. Redis expires and evicts
+    the values itself, so they are not counted here."""
+
+    name = "redis"
+    evictions = 0
+    expirations = 0
+
+    def __init__(self, url: str, ttl: float, prefix: str = "recipe:"):
+        try:
+            from redis import asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError(
+                "A shared recipe cache needs the redis package: pip install redis"
+            ) from e
+        self.client = redis_asyncio.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def __len__(self) -> int:
+        return 0  # Unknown without a round trip.
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(self.prefix + key)
+        return value.decode() if value is not None else None
+
+    async def set(self, key: str, value: str):
+        await self.client.set(self.prefix + key, value, px=int(self.ttl * 1000))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(key)
+
+
+class RecipeCache:
+    """
+    Read-through cache of serialized recipes, keyed by recipe id. Recipes are
+    stored as RecipeInDB JSON, so any backend can hold them. The crud functions
+    that write a recipe, or its ingredients or steps, invalidate it after they
+    commit. A read that raced with a write can store the old recipe, which then
+    lives until its TTL at most. Invalidations reach every process only with a
+    shared backend. Otherwise other processes keep the old recipe until its TTL,
+    which is kept short for that reason.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, recipe_id: int) -> Optional[schemas.RecipeInDB]:
+        value = await self.backend.get(str(recipe_id))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return schemas.RecipeInDB.parse_raw(value)
+
+    async def put(self, recipe: schemas.RecipeInDB):
+        await self.backend.set(str(recipe.id), recipe.json())
+
+    async def invalidate(self, recipe_id: int):
+        await self.backend.delete(str(recipe_id))
+
+    async def clear(self):
+        await self.backend.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.backend.evictions,
+            expirations=self.backend.expirations,
+            entries=len(self.backend),
+        )
+
+
+def create_recipe_cache() -> RecipeCache:
+    if settings.recipe_cache_url:
+        logger.info("Caching recipes in a shared Redis cache.")
+        return RecipeCache(
+            RedisBackend(settings.recipe_cache_url, settings.recipe_cache_ttl)
+        )
+    return RecipeCache(
+        MemoryBackend(settings.recipe_cache_size, settings.recipe_cache_local_ttl)
+    )
+
+
+recipe_cache = create_recipe_cache()
@@ -0,0 +1,183 @@
+import codecs
+import json
+from typing import Any, AsyncIterator, List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api import crud, schemas
+
+# Recipes inserted per transaction.
+IMPORT_CHUNK_SIZE = 500
+# Rows longer than this are rejected instead of buffered until they end.
+MAX_ROW_CHARS = 1024 * 1024
+# Failed rows past this many are counted, but not reported.
+MAX_REPORTED_ERRORS = 1000
+
+
+class InvalidRow:
+    """A row of an upload that is not valid JSON."""
+
+    def __init__(self, message: str):
+        self.message = message
+
+
+async def decoded(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """The text of UTF-8 chunks. Characters split across chunks are reassembled."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+async def next_text(texts: AsyncIterator[str]) -> Optional[str]:
+    """The next text, or None at the end."""
+    try:
+        return await texts.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def parse_row(line: str) -> Any:
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return InvalidRow(f"Invalid JSON: {e.msg}")
+
+
+def skip_whitespace(text: str, position: int) -> int:
+    while position < len(text) and text[position].isspace():
+        position += 1
+    return position
+
+
+async def ndjson_rows(buffer: str, texts: AsyncIterator[str]) -> AsyncIterator[Any]:
+    """The rows of NDJSON text, one JSON value per line. Blank lines are skipped."""
+    skipping = False  # Through the rest of a line that is too long.
+    while True:
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+            elif line.strip():
+                yield parse_row(line)
+        if not skipping and len(buffer) > MAX_ROW_CHARS:
+            yield InvalidRow(f"Row is longer than {MAX_ROW_CHARS} characters")
+            skipping = True
+        if skipping:
+            buffer = ""
+        text = await next_text(texts)
+        if text is None:
+            break
+        buffer += text
+    if buffer.strip() and not skipping:
+        yield parse_row(buffer)
+
+
+async def json_array_rows(buffer: str, texts: AsyncIterator[str]) -> AsyncIterator[Any]:
+    """
+    The rows of a JSON array, decoded one at a time with raw_decode as the text
+    arrives. Only the current row is buffered. A row that is not valid JSON ends the
+    array, because the start of the next row cannot be found reliably after it.
+    """
+    decoder = json.JSONDecoder()
+    buffer = buffer[buffer.index("[") + 1 :]
+    expect_comma = False
+    final = False
+    while True:
+        position = 0
+        while True:
+            position = skip_whitespace(buffer, position)
+            if position == len(buffer):
+                break
+            if buffer[position] == "]":
+                return
+            if expect_comma:
+                if buffer[position] != ",":
+                    yield InvalidRow("Expected ',' or ']' after a row")
+                    return
+                expect_comma = False
+                position += 1
+                continue
+            try:
+                row, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                if final or len(buffer) - position > MAX_ROW_CHARS:
+                    yield InvalidRow(f"Invalid JSON: {e.msg}")
+                    return
+                break  # The row continues in the next text.
+            if end == len(buffer) and not final and not isinstance(row, (dict, list)):
+                break  # A number or literal can continue in the next text.
+            yield row
+            position = end
+            expect_comma = True
+        if final:
+            yield InvalidRow("The JSON array is not closed")
+            return
+        buffer = buffer[position:]
+        text = await next_text(texts)
+        if text is None:
+            final = True
+        else:
+            buffer += text
+
+
+async def upload_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    The rows of an upload, parsed while it streams in. An upload that starts with
+    "[" is a JSON array of rows, anything else is NDJSON. Rows that are not valid
+    JSON are InvalidRows.
+    """
+    texts = decoded(chunks)
+    first = ""
+    while not first.strip():
+        text = await next_text(texts)
+        if text is None:
+            return
+        first += text
+    rows = json_array_rows if first.lstrip().startswith("[") else ndjson_rows
+    async for row in rows(first, texts):
+        yield row
+
+
+async def import_recipes(
+    db: AsyncSession, author_id: int, chunks: AsyncIterator[bytes]
+) -> schemas.RecipeImportReport:
+    """
+    Imports an upload of RecipeCreate rows for the author. Valid rows are created
+    IMPORT_CHUNK_SIZE at a time, each chunk in a transaction of its own, so memory
+    does not grow with the size of the upload. Returns the number of imported rows,
+    and the errors of the rows that were not.
+    """
+    report = schemas.RecipeImportReport(imported=0, failed=0, errors=[])
+    chunk: List[schemas.RecipeCreate] = []
+
+    def fail(row_number: int, errors: List[dict]):
+        report.failed += 1
+        if len(report.errors) < MAX_REPORTED_ERRORS:
+            report.errors.append(
+                schemas.RecipeImportError(row=row_number, errors=errors)
+            )
+
+    row_number = 0
+    async for row in upload_rows(chunks):
+        if isinstance(row, InvalidRow):
+            fail(row_number, [dict(loc=[], msg=row.message, type="value_error.json")])
+        else:
+            try:
+                chunk.append(schemas.RecipeCreate.parse_obj(row))
+            except ValidationError as e:
+                fail(row_number, e.errors())
+        row_number += 1
+        if len(chunk) == IMPORT_CHUNK_SIZE:
+            await crud.create_recipes(db, author_id, chunk)
+            report.imported += len(chunk)
+            chunk = []
+    if chunk:
+        await crud.create_recipes(db, author_id, chunk)
+        report.imported += len(chunk)
+    return report
@@ -1,7 +1,7 @@
 import datetime
-from typing import Optional, Literal
+from typing import Any, ClassVar, Dict, List, Optional, Literal, TypeVar, Union
 
-from pydantic import BaseModel, EmailStr, SecretStr
+from pydantic import BaseModel, EmailStr, SecretStr, root_validator, validator
 
 
 class PasswordStr(SecretStr):
@@ -114,6 +114,15 @@ class AuthenticationResponse(BaseModel):
 # RECIPES
 
 
+PositionedT = TypeVar("PositionedT", "RecipeIngredientInDB", "RecipeStepInDB")
+
+
+def dense_positions(rows: List[PositionedT]) -> List[PositionedT]:
+    """Numbers ingredients or steps sorted by their stored positions 0, 1, 2... The
+    stored positions are sort keys with gaps, which are not exposed."""
+    return [row.copy(update={"position": n}) for n, row in enumerate(rows)]
+
+
 class RecipeIngredientBase(BaseModel):
     content: str
 
@@ -161,13 +170,47 @@ class RecipeBase(BaseModel):
 
 
 class RecipeCreate(RecipeBase):
-    pass
+    # A recipe can be created with all of its ingredients and steps, in order.
+    ingredients: list[RecipeIngredientCreate] = []
+    steps: list[RecipeStepCreate] = []
 
 
 class RecipeEdit(RecipeBase):
     pass
 
 
+class RecipeOperation(BaseModel):
+    """
+    One change to a recipe's ingredients or steps, in a RecipePatch. Positions count
+    from 0, in the list as the earlier operations of the patch left it.
+    """
+
+    op: Literal["insert", "edit", "move", "delete"]
+    target: Literal["ingredient", "step"]
+    id: Optional[int] = None  # The ingredient or step to edit, move or delete.
+    content: Optional[str] = None  # For insert and edit.
+    position: Optional[int] = None  # For move and insert. Inserts default to the end.
+
+    REQUIRED_FIELDS: ClassVar[Dict[str, List[str]]] = {
+        "insert": ["content"],
+        "edit": ["id", "content"],
+        "move": ["id", "position"],
+        "delete": ["id"],
+    }
+
+    @root_validator(skip_on_failure=True)
+    def has_required_fields(cls, values):
+        missing = [f for f in cls.REQUIRED_FIELDS[values["op"]] if values[f] is None]
+        if missing:
+            raise ValueError(f"{values['op']} requires {', '.join(missing)}")
+        return values
+
+
+class RecipePatch(BaseModel):
+    # Applied in order, in one transaction. Either every operation applies or none.
+    operations: list[RecipeOperation]
+
+
 class RecipeInDB(RecipeBase):
     id: int
     created_at: datetime.datetime
@@ -176,6 +219,34 @@ class RecipeInDB(RecipeBase):
     steps: list[RecipeStepInDB]
     ingredients: list[RecipeIngredientInDB]
 
+    _dense_positions = validator("steps", "ingredients", allow_reuse=True)(
+        dense_positions
+    )
+
+    class Config:
+        orm_mode = True
+
+
+class RecipeImportError(BaseModel):
+    row: int  # The index of the row in the upload, from 0.
+    errors: list[Dict[str, Any]]  # In FastAPI's validation error format.
+
+
+class RecipeImportReport(BaseModel):
+    imported: int
+    failed: int
+    # The errors of the first failed rows. Past api.recipe_import.MAX_REPORTED_ERRORS
+    # failed rows are only counted.
+    errors: list[RecipeImportError]
+
+
+class RecipeSummary(RecipeBase):
+    """A recipe without its author, steps or ingredients, for recipe lists."""
+
+    id: int
+    created_at: datetime.datetime
+    author_id: int
+
     class Config:
         orm_mode = True
 
@@ -183,11 +254,66 @@ class RecipeInDB(RecipeBase):
 class RecipeSearch(BaseModel):
     page: int = 1
     per_page: int = 10
+    # An opaque next_cursor or prev_cursor of a previous page. Takes precedence
+    # over page.
+    cursor: Optional[str] = None
+    # Full-text search. Only recipes with every word of q in their name, ingredients
+    # or steps are returned, best matches first.
+    q: Optional[str] = None
+    # "summary" lists RecipeSummary objects instead of full recipes.
+    view: Literal["full", "summary"] = "full"
 
 
 class PaginatedRecipes(BaseModel):
-    page: int
+    page: Optional[int]  # None for pages requested by cursor.
     per_page: int
     max_page: int
     result_count: int
-    data: list[RecipeInDB]
+    data: list[Union[RecipeInDB, RecipeSummary]]  # Depends on the requested view.
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+
+class CookWithRecipe(BaseModel):
+    recipe: RecipeInDB
+    coverage: float  # Share of the recipe's ingredients that are on hand, 0 to 1.
+    covered_ingredient_count: int
+    # Ingredients like "1 pinch" that do not name an ingredient are not counted.
+    ingredient_count: int
+    missing_ingredients: list[RecipeIngredientInDB]
+
+
+# COOKBOOK JOBS
+
+
+class CookbookJobStatus(BaseModel):
+    id: str
+    author_id: int
+    stage: Literal["queued", "loading", "rendering", "done", "failed"]
+    progress: float  # From 0 to 1.
+    detail: Optional[str] = None
+    download_url: Optional[str] = None
+
+
+# ADMIN
+
+
+class DatabasePoolMetrics(BaseModel):
+    pool_size: int
+    checked_out: int  # Connections in use right now.
+    checked_in: int  # Idle connections in the pool.
+    overflow: int  # Connections opened beyond the pool size.
+    checkouts: int
+    timeouts: int  # Checkouts that gave up waiting for a connection.
+    connects: int  # New database connections opened.
+    wait_seconds_total: float
+    wait_seconds_max: float
+    wait_seconds_mean: float
+
+
+class RecipeCacheMetrics(BaseModel):
+    hits: int
+    misses: int
+    evictions: int  # Least recently used recipes dropped to make room.
+    expirations: int  # Recipes dropped because they outlived the TTL.
+    entries: int
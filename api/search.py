@@ -0,0 +1,145 @@
+import re
+from typing import Any, Dict, List
+
+from sqlalchemy import Float, Integer, bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Subquery
+
+# Search terms are runs of letters and digits. Everything else in a query, such as
+# quotes or FTS5 operators, is ignored.
+TERM_PATTERN = re.compile(r"\w+")
+
+# Postgres text search configuration, which stems English words like FTS5's porter.
+POSTGRES_CONFIG = "english"
+
+# Statements that rewrite the recipe_search rows of the recipes in :recipe_ids. The
+# table is created in api.models.
+REINDEX_STATEMENTS: Dict[str, List[str]] = {
+    "sqlite": [
+        "DELETE FROM recipe_search WHERE rowid IN :recipe_ids",
+        """
+        INSERT INTO recipe_search (rowid, name, ingredients, steps)
+        SELECT
+            recipes.id,
+            recipes.name,
+            (SELECT group_concat(content, ' ') FROM ingredients
+             WHERE ingredients.recipe_id = recipes.id),
+            (SELECT group_concat(content, ' ') FROM recipe_steps
+             WHERE recipe_steps.recipe_id = recipes.id)
+        FROM recipes WHERE recipes.id IN :recipe_ids
+        """,
+    ],
+    "postgresql": [
+        f"""
+        INSERT INTO recipe_search (recipe_id, document)
+        SELECT
+            recipes.id,
+            setweight(to_tsvector('{POSTGRES_CONFIG}', recipes.name), 'A')
+            || setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(
+                (SELECT string_agg(content, ' ') FROM ingredients
+                 WHERE ingredients.recipe_id = recipes.id), '')), 'B')
+            || setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(
+                (SELECT string_agg(content, ' ') FROM recipe_steps
+                 WHERE recipe_steps.recipe_id = recipes.id), '')), 'C')
+        FROM recipes WHERE recipes.id IN :recipe_ids
+        ON CONFLICT (recipe_id) DO UPDATE SET document = excluded.document
+        """,
+    ],
+}
+
+# Statements that insert the recipe_search row of a new recipe, from its :recipe_id,
+# :name, and its :ingredients and :steps joined by spaces, without reading them back.
+INSERT_STATEMENTS: Dict[str, str] = {
+    "sqlite": """
+        INSERT INTO recipe_search (rowid, name, ingredients, steps)
+        VALUES (:recipe_id, :name, :ingredients, :steps)
+    """,
+    "postgresql": f"""
+        INSERT INTO recipe_search (recipe_id, document)
+        VALUES (
+            :recipe_id,
+            setweight(to_tsvector('{POSTGRES_CONFIG}', CAST(:name AS text)), 'A')
+            || setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(
+                CAST(:ingredients AS text), '')), 'B')
+            || setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(
+                CAST(:steps AS text), '')), 'C')
+        )
+    """,
+}
+
+# Select the recipe_id and score of every recipe that contains all of the query's
+# terms. Higher scores are better matches. Names weigh more than ingredients, and
+# ingredients more than steps.
+MATCH_QUERIES: Dict[str, str] = {
+    "sqlite": """
+        SELECT rowid AS recipe_id, -bm25(recipe_search, 4.0, 2.0, 1.0) AS score
+        FROM recipe_search WHERE recipe_search MATCH :query
+    """,
+    "postgresql": f"""
+        SELECT recipe_id, ts_rank(document, query) AS score
+        FROM recipe_search, plainto_tsquery('{POSTGRES_CONFIG}', :query) AS query
+        WHERE document @@ query
+    """,
+}
+
+
+def search_terms(query: str) -> List[str]:
+    return TERM_PATTERN.findall(query.lower())
+
+
+async def reindex_recipe(db: AsyncSession, recipe_id: int):
+    """
+    Rewrites the recipe's search index row from its current name, ingredients and
+    steps, in the session's transaction. Every crud function that changes any of
+    them must call this before it commits.
+    """
+    await reindex_recipes(db, [recipe_id])
+
+
+async def reindex_recipes(db: AsyncSession, recipe_ids: List[int]):
+    """reindex_recipe for many recipes at once, with the same few statements."""
+    await db.flush()  # The index is built from the recipes' rows in the database.
+    for statement in REINDEX_STATEMENTS[db.bind.dialect.name]:
+        await db.execute(
+            text(statement).bindparams(bindparam("recipe_ids", expanding=True)),
+            {"recipe_ids": recipe_ids},
+        )
+
+
+async def index_new_recipes(db: AsyncSession, rows: List[Dict[str, Any]]):
+    """
+    Inserts the search index rows of recipes that were just created, with one
+    executemany, from INSERT_STATEMENTS rows that the caller builds from the recipes
+    it inserted. Unlike reindex_recipes, nothing is read back from the database.
+    """
+    if rows:
+        await db.execute(text(INSERT_STATEMENTS[db.bind.dialect.name]), rows)
+
+
+def search_row(
+    recipe_id: int, name: str, ingredients: List[str], steps: List[str]
+) -> Dict[str, Any]:
+    """The INSERT_STATEMENTS parameters of a new recipe. Like group_concat, a recipe
+    without ingredients or steps gets NULL."""
+    return dict(
+        recipe_id=recipe_id,
+        name=name,
+        ingredients=" ".join(ingredients) if ingredients else None,
+        steps=" ".join(steps) if steps else None,
+    )
+
+
+def ranked_matches(dialect_name: str, terms: List[str]) -> Subquery:
+    """Returns a subquery of the (recipe_id, score) of the recipes that contain every
+    term. terms must not be empty."""
+    if dialect_name == "sqlite":
+        # Quoted terms are matched as plain strings, never as FTS5 syntax.
+        query = " ".join(f'"{term}"' for term in terms)
+    else:
+        query = " ".join(terms)
+    return (
+        text(MATCH_QUERIES[dialect_name])
+        .bindparams(query=query)
+        .columns(recipe_id=Integer, score=Float)
+        .subquery("matches")
+    )
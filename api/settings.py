@@ -1,5 +1,5 @@
 from os import path
-from typing import Any, Optional, Dict
+from typing import Any, List, Optional, Dict
 import sys
 
 from pydantic.env_settings import BaseSettings
@@ -38,6 +38,53 @@ class Settings(BaseSettings):
     google_client_id: Optional[str]
     google_client_secret: Optional[str]
 
+    # Database connection pool, per engine. See /admin/metrics/database/ for usage.
+    database_pool_size: int = 5
+    database_max_overflow: int = 10  # connections opened beyond the pool when busy
+    database_pool_timeout: float = 30.0  # seconds to wait for a free connection
+    database_pool_recycle: int = 30 * 60  # seconds before a connection is replaced
+    database_pool_pre_ping: bool = True  # test connections before they are used
+
+    # Read replicas of the database. GET routes read from them in turn, except that
+    # a client that just wrote reads from the primary, until the replicas caught up.
+    database_replica_urls: List[str] = []  # e.g. ["postgresql://replica-1/recipes"]
+    database_read_your_writes_seconds: float = 5.0
+
+    # SQLite tuning, applied to every new connection.
+    sqlite_busy_timeout: int = 5000  # milliseconds to wait for a locked database
+    sqlite_mmap_size: int = 256 * 1024 * 1024  # bytes of the file memory mapped
+    sqlite_cache_size: int = -64 * 1024  # page cache size. Negative sizes are KiB.
+
+    # Cache of serialized recipes for recipe reads. It is kept in each process,
+    # unless recipe_cache_url points every process at a shared Redis. A process only
+    # invalidates its own cache, so with several processes and no Redis, a process
+    # serves a recipe that another one changed until recipe_cache_local_ttl passes.
+    recipe_cache_size: int = 4096  # recipes kept in each process
+    recipe_cache_ttl: float = 5 * 60  # seconds, in the shared Redis
+    recipe_cache_local_ttl: float = 5.0  # seconds, in each process
+    recipe_cache_url: Optional[str] = None  # e.g. redis://localhost:6379/0
+
+    # Seconds between recounts of the recipe counters. 0 disables them.
+    recipe_count_reconcile_interval: float = 60 * 60
+
+    # Cookbook PDF rendering. Renders run in a pool of worker processes.
+    pdf_render_workers: int = 2
+    pdf_render_timeout: float = 120.0  # seconds
+    pdf_render_queue_depth: int = 16  # jobs allowed to wait for a free worker
+    # Workers that each large cookbook is split across, at most pdf_render_workers.
+    # A sharded render takes a slot of the queue for each of its workers.
+    pdf_render_shards: int = 1
+    pdf_render_shard_min_recipes: int = 100  # smaller cookbooks are never split
+    pdf_cache_dir: str = ".cache/pdfs"
+    pdf_cache_max_bytes: int = 512 * 1024 * 1024
+    pdf_fragment_cache_size: int = 2048  # recipe PDFs kept in each render worker
+    pdf_template_cache_dir: str = ".cache/templates"  # compiled template bytecode
+    pdf_image_dpi: int = 300  # cookbook images are resized to this print resolution
+    pdf_job_ttl: float = 60 * 60  # seconds a cookbook job is kept after its last update
+    # PDFs of finished cookbook jobs. Like pdf_cache_dir, shared by the app processes.
+    pdf_job_dir: str = ".cache/cookbook-jobs"
+    pdf_jobs_per_author: int = 3  # cookbook jobs kept for each author
+
     class Config:
         env_file = _dot_env_path()
         env_file_encoding = "utf-8"
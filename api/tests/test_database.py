@@ -0,0 +1,154 @@
+import time
+from http.cookies import SimpleCookie
+from typing import Dict, Mapping
+from unittest import TestCase, mock
+
+from fastapi import Request, Response, status
+
+from api import database, models
+from api.database import (
+    AsyncSessionLocal,
+    RecentWriters,
+    async_database_url,
+    read_sessionmaker,
+    recent_writers,
+)
+from api.testutils.testcase import DBTestCase
+
+
+class AsyncDatabaseURLTest(TestCase):
+    def test_sqlite_uses_aiosqlite(self):
+        url = async_database_url("sqlite:///./db.sqlite")
+        assert url.drivername == "sqlite+aiosqlite"
+        assert url.database == "./db.sqlite"
+
+    def test_postgres_uses_asyncpg(self):
+        for database_url in [
+            "postgresql://user:secret@db:5432/recipes",
+            "postgresql+psycopg2://user:secret@db:5432/recipes",
+        ]:
+            url = async_database_url(database_url)
+            assert url.drivername == "postgresql+asyncpg"
+            assert (url.username, url.password, url.host) == ("user", "secret", "db")
+            assert (url.port, url.database) == (5432, "recipes")
+
+
+def response_cookies(response: Response) -> Dict[str, str]:
+    cookies = SimpleCookie(response.headers["set-cookie"])
+    return {name: morsel.value for name, morsel in cookies.items()}
+
+
+def request_with_cookies(cookies: Mapping[str, str]) -> Request:
+    cookie = "; ".join(f"{name}={value}" for name, value in cookies.items())
+    return Request({"type": "http", "headers": [(b"cookie", cookie.encode())]})
+
+
+class RecentWritersTest(TestCase):
+    def test_writers_are_recent_for_the_window(self):
+        writers = RecentWriters("secret", window=5)
+        response = Response()
+        with mock.patch("time.time", return_value=time.time() - 10):
+            writers.mark(response)
+        request = request_with_cookies(response_cookies(response))
+
+        assert not writers.wrote_recently(request)
+        writers.mark(response)
+        request = request_with_cookies(response_cookies(response))
+        assert writers.wrote_recently(request)
+        assert not writers.wrote_recently(request_with_cookies({}))
+        # A response is marked once, however many commits its request made.
+        assert len(response.headers.getlist("set-cookie")) == 1
+
+    def test_marks_are_honored_by_every_process(self):
+        # Each app process has its own RecentWriters.
+        process_a = RecentWriters("secret", window=5)
+        process_b = RecentWriters("secret", window=5)
+        response = Response()
+
+        process_a.mark(response)
+        cookies = response_cookies(response)
+
+        assert process_b.wrote_recently(request_with_cookies(cookies))
+        forged = {RecentWriters.COOKIE: "eyJhbGciOiJub25lIn0.e30."}
+        assert not process_b.wrote_recently(request_with_cookies(forged))
+        other_app = RecentWriters("another secret", window=5)
+        assert not other_app.wrote_recently(request_with_cookies(cookies))
+
+
+class ReadRoutingTest(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.replicas = [mock.sentinel.replica_1, mock.sentinel.replica_2]
+        patcher = mock.patch.multiple(
+            database,
+            ReplicaSessionLocals=self.replicas,
+            _next_replica=iter([0, 1, 0, 1]),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_the_replicas_in_turn(self):
+        assert read_sessionmaker(False) is mock.sentinel.replica_1
+        assert read_sessionmaker(False) is mock.sentinel.replica_2
+        assert read_sessionmaker(True) is AsyncSessionLocal
+
+    def test_reads_go_to_the_primary_after_the_client_commits(self):
+        self.create_and_login_user()
+        self.client.cookies.pop(RecentWriters.COOKIE)
+
+        response = self.client.post("/recipes/", json={"name": "Chili"})
+
+        assert RecentWriters.COOKIE in response.cookies
+        request = request_with_cookies(self.client.cookies)
+        assert read_sessionmaker(recent_writers.wrote_recently(request)) is (
+            AsyncSessionLocal
+        )
+        assert read_sessionmaker(False) is mock.sentinel.replica_1
+
+    def test_reads_stay_on_the_replicas_without_commits(self):
+        self.create_and_login_user()
+        self.client.cookies.pop(RecentWriters.COOKIE)
+
+        response = self.client.get("/recipes/")
+
+        assert RecentWriters.COOKIE not in response.cookies
+
+    def test_login_starts_the_clients_window(self):
+        self.create_and_login_user()
+
+        request = request_with_cookies(self.client.cookies)
+        assert recent_writers.wrote_recently(request)
+
+
+class DatabaseEngineTest(DBTestCase):
+    def test_sqlite_connections_are_tuned(self):
+        assert self.db.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert self.db.execute("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert self.db.execute("PRAGMA busy_timeout").scalar() == 5000
+
+    def test_pool_metrics_require_an_admin(self):
+        self.create_and_login_user()
+
+        response = self.client.get("/admin/metrics/database/")
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_pool_metrics(self):
+        user = self.create_user()
+        self.db.query(models.User).filter(models.User.id == user.id).update(
+            {models.User.role: models.Role.ADMIN}
+        )
+        self.db.commit()
+        self.login(user.email, "aBadPa$$w0rd!!")
+
+        self.client.get("/users/me/")
+        response = self.client.get("/admin/metrics/database/")
+
+        assert response.status_code == status.HTTP_200_OK
+        metrics = response.json()
+        assert metrics["pool_size"] == 5
+        assert metrics["checkouts"] >= 3
+        assert 1 <= metrics["connects"] <= metrics["checkouts"]
+        assert metrics["checked_out"] == 1  # The metrics request's own session.
+        assert metrics["timeouts"] == 0
+        assert metrics["wait_seconds_max"] >= metrics["wait_seconds_mean"] >= 0
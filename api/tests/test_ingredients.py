@@ -0,0 +1,19 @@
+from unittest import TestCase
+
+from api.ingredients import covers, ingredient_terms
+
+
+class IngredientTermsTest(TestCase):
+    def test_quantities_units_and_preparations_are_ignored(self):
+        assert ingredient_terms("2 cans crushed tomatoes") == {"tomato"}
+        assert ingredient_terms("1 cup black beans, drained") == {"black", "bean"}
+        assert ingredient_terms("3 cloves garlic, minced") == {"garlic"}
+        assert ingredient_terms("1 cup fresh blueberries") == {"blueberry"}
+        assert ingredient_terms("1 1/2 tbsp") == set()
+
+    def test_covers(self):
+        black_beans = ingredient_terms("black beans")
+        assert covers([ingredient_terms("beans")], black_beans)
+        assert not covers([ingredient_terms("kidney beans")], black_beans)
+        assert not covers([black_beans], ingredient_terms("beans"))
+        assert not covers([ingredient_terms("beans")], frozenset())
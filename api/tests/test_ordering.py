@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from api.ordering import POSITION_GAP, assign_keys, keys_between, ordered_indexes
+
+
+class OrderingTest(TestCase):
+    def test_keys_between(self):
+        assert keys_between(None, None, 2) == [0, POSITION_GAP]
+        assert keys_between(0, None, 1) == [POSITION_GAP]
+        assert keys_between(None, 0, 2) == [-2 * POSITION_GAP, -POSITION_GAP]
+        assert keys_between(0, 9, 2) == [3, 6]
+        assert keys_between(0, 2, 2) is None
+
+    def test_ordered_indexes(self):
+        assert ordered_indexes([]) == set()
+        assert ordered_indexes([None, 3, 1, 2, None, 4]) == {2, 3, 5}
+        assert len(ordered_indexes([5, 5, 5])) == 1
+
+    def test_only_moved_and_new_rows_get_new_keys(self):
+        assert assign_keys([0, 1024, 2048]) == [0, 1024, 2048]
+        # The last row moved to the front.
+        assert assign_keys([2048, 0, 1024]) == [-1024, 0, 1024]
+        # A row inserted in the middle, and two at the end.
+        assert assign_keys([0, None, 1024, None, None]) == [0, 512, 1024, 2048, 3072]
+
+    def test_rows_are_renumbered_when_a_gap_runs_out(self):
+        assert assign_keys([0, None, 1]) == [0, POSITION_GAP, 2 * POSITION_GAP]
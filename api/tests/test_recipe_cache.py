@@ -0,0 +1,48 @@
+import asyncio
+from unittest import TestCase, mock
+
+from api.cookbooks.benchmark import synthetic_cookbook
+from api.recipe_cache import MemoryBackend, RecipeCache, create_recipe_cache
+from api.settings import settings
+
+RECIPES = {recipe.id: recipe for recipe in synthetic_cookbook(3)}
+
+
+class RecipeCacheTest(TestCase):
+    def setUp(self):
+        self.cache = RecipeCache(MemoryBackend(max_entries=2, ttl=60))
+
+    def run_async(self, coroutine):
+        return asyncio.new_event_loop().run_until_complete(coroutine)
+
+    def test_least_recently_used_recipes_are_evicted(self):
+        for recipe_id in [1, 2]:
+            self.run_async(self.cache.put(RECIPES[recipe_id]))
+        assert self.run_async(self.cache.get(1)) == RECIPES[1]
+
+        self.run_async(self.cache.put(RECIPES[3]))
+
+        assert self.run_async(self.cache.get(2)) is None
+        assert self.run_async(self.cache.get(3)) == RECIPES[3]
+        assert self.cache.stats() == dict(
+            hits=2, misses=1, evictions=1, expirations=0, entries=2
+        )
+
+    def test_recipes_expire(self):
+        self.run_async(self.cache.put(RECIPES[1]))
+
+        with mock.patch("time.monotonic", return_value=10**9):
+            assert self.run_async(self.cache.get(1)) is None
+
+        assert self.cache.stats()["expirations"] == 1
+        assert self.cache.stats()["entries"] == 0
+
+    def test_process_local_cache_expires_quickly(self):
+        # Other processes do not see this process's invalidations, so their copies
+        # must not outlive the short local TTL.
+        with mock.patch.object(settings, "recipe_cache_url", None):
+            cache = create_recipe_cache()
+
+        assert isinstance(cache.backend, MemoryBackend)
+        assert cache.backend.ttl == settings.recipe_cache_local_ttl
+        assert cache.backend.ttl < settings.recipe_cache_ttl
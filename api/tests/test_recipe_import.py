@@ -0,0 +1,111 @@
+import asyncio
+import json
+from unittest import TestCase, mock
+
+from fastapi import status
+
+from api import crud, recipe_import
+from api.recipe_import import InvalidRow, upload_rows
+from api.testutils.testcase import DBTestCase
+
+RECIPES = [
+    {"name": "Crème brûlée", "ingredients": [{"content": "4 egg yolks"}]},
+    {"name": "Chili", "steps": [{"content": "Simmer"}, {"content": "Serve"}]},
+    {"name": "Toast"},
+]
+
+
+def parse(upload: bytes, chunk_size: int):
+    async def chunks():
+        for start in range(0, len(upload), chunk_size):
+            yield upload[start : start + chunk_size]
+
+    async def rows():
+        return [row async for row in upload_rows(chunks())]
+
+    return asyncio.new_event_loop().run_until_complete(rows())
+
+
+class UploadRowsTest(TestCase):
+    def test_rows_split_across_chunks(self):
+        ndjson = "\n".join(json.dumps(r, ensure_ascii=False) for r in RECIPES)
+        array = json.dumps(RECIPES, ensure_ascii=False, indent=2)
+        for upload in [ndjson, "\n\n" + ndjson + "\n", array, f" {array} "]:
+            for chunk_size in [1, 7, 1024]:
+                rows = parse(upload.encode(), chunk_size)
+                assert rows == RECIPES, (upload, chunk_size)
+
+    def test_invalid_ndjson_rows_are_skipped(self):
+        rows = parse(b'{"name": "Chili"}\n{"name": \n[1, 2]\n', 4)
+
+        assert rows[0] == {"name": "Chili"}
+        assert isinstance(rows[1], InvalidRow)
+        assert rows[2] == [1, 2]
+
+    def test_invalid_json_arrays_end(self):
+        for upload in [b'[{"name": "Chili"} {"name": "Toast"}]', b'[{"name": "Chili"}']:
+            rows = parse(upload, 5)
+
+            assert rows[0] == {"name": "Chili"}
+            assert isinstance(rows[1], InvalidRow)
+            assert len(rows) == 2
+
+    def test_overlong_rows_are_not_buffered(self):
+        with mock.patch.object(recipe_import, "MAX_ROW_CHARS", 20):
+            rows = parse(b'{"name": "' + b"x" * 100 + b'"}\n{"name": "Toast"}', 8)
+
+        assert isinstance(rows[0], InvalidRow)
+        assert rows[1:] == [{"name": "Toast"}]
+
+    def test_empty_uploads_have_no_rows(self):
+        assert parse(b"", 8) == []
+        assert parse(b" \n ", 1) == []
+
+
+class ImportRecipesTest(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_and_login_user()
+
+    def import_recipes(self, upload: str):
+        response = self.client.post("/recipes/import/", data=upload.encode())
+        assert response.status_code == status.HTTP_200_OK, response.json()
+        return response.json()
+
+    @mock.patch.object(recipe_import, "IMPORT_CHUNK_SIZE", 2)
+    def test_import_recipes(self):
+        rows = [json.dumps(recipe) for recipe in RECIPES]
+        rows[1:1] = ['{"name": "Broken"', '{"ingredients": []}']
+
+        report = self.import_recipes("\n".join(rows))
+
+        assert report["imported"] == 3
+        assert report["failed"] == 2
+        assert [error["row"] for error in report["errors"]] == [1, 2]
+        assert report["errors"][1]["errors"][0]["loc"] == ["name"]
+
+        recipes = self.run_crud(crud.get_author_recipes, self.user.id)
+        assert [recipe.name for recipe in recipes] == [r["name"] for r in RECIPES]
+        assert [step.content for step in recipes[1].steps] == ["Simmer", "Serve"]
+        assert self.run_crud(crud.get_recipe_count, self.user.id) == 3
+        # Imported recipes are indexed like created ones.
+        search = self.client.get("/recipes/", params={"q": "yolks"}).json()
+        assert [recipe["name"] for recipe in search["data"]] == ["Crème brûlée"]
+        search = self.client.get("/recipes/", params={"q": "serve"}).json()
+        assert [recipe["name"] for recipe in search["data"]] == ["Chili"]
+        cook_with = self.client.get(
+            f"/users/{self.user.id}/recipes/cook-with/", params={"ingredients": "egg"}
+        ).json()
+        assert [match["recipe"]["name"] for match in cook_with] == ["Crème brûlée"]
+
+    def test_import_json_array(self):
+        report = self.import_recipes(json.dumps(RECIPES))
+
+        assert report == {"imported": 3, "failed": 0, "errors": []}
+
+    def test_import_requires_a_user(self):
+        self.client.cookies.clear()
+
+        response = self.client.post("/recipes/import/", data=json.dumps(RECIPES))
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
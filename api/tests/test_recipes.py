@@ -1,9 +1,16 @@
+import asyncio
 import datetime
+import json
+from unittest import mock
 
 from fastapi import status
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.dml import Insert
 
 from api.testutils.testcase import DBTestCase
 from api import models
+from api import crud, schemas
 from api.crud import create_user
 from api.schemas import UserCreate
 
@@ -114,6 +121,46 @@ class GetRecipesTest(DBTestCase):
         assert response.json()["max_page"] == 1
         assert response.json()["result_count"] == 100
 
+    def test_cursor_pagination(self):
+        created_user = self.create_and_login_user()
+        self.create_test_recipes(author_id=created_user.id, count=25)
+
+        response = self.client.get("/recipes/?per_page=10")
+        assert response.status_code == status.HTTP_200_OK, response.json()
+        assert response.json()["prev_cursor"] is None
+        next_cursor = response.json()["next_cursor"]
+
+        # Recipes added after the first page was loaded do not shift later pages.
+        self.create_test_recipes(author_id=created_user.id, count=1)
+
+        response = self.client.get(f"/recipes/?per_page=10&cursor={next_cursor}")
+        assert response.status_code == status.HTTP_200_OK, response.json()
+        assert response.json()["page"] is None
+        names = [recipe["name"] for recipe in response.json()["data"]]
+        assert names == [f"Recipe #{idx}" for idx in range(10, 20)]
+
+        last_page = self.client.get(
+            f"/recipes/?per_page=10&cursor={response.json()['next_cursor']}"
+        ).json()
+        assert [recipe["name"] for recipe in last_page["data"]] == [
+            f"Recipe #{idx}" for idx in range(20, 25)
+        ] + ["Recipe #0"]
+        assert last_page["next_cursor"] is None
+
+        # Walk back to the first page.
+        response = self.client.get(
+            f"/recipes/?per_page=10&cursor={response.json()['prev_cursor']}"
+        )
+        names = [recipe["name"] for recipe in response.json()["data"]]
+        assert names == [f"Recipe #{idx}" for idx in range(0, 10)]
+        assert response.json()["prev_cursor"] is None
+
+    def test_invalid_cursor(self):
+        self.create_and_login_user()
+
+        response = self.client.get("/recipes/?cursor=not-a-cursor")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, response.json()
+
     def test_get_my_recipes(self):
         created_user = self.create_and_login_user()
 
@@ -139,12 +186,294 @@ class GetRecipesTest(DBTestCase):
         assert len(response.json()["data"]) == 15
         assert response.json()["data"][0]["author"]["email"] == "test@example.com"
 
+    def test_recipe_list_query_count_does_not_grow_with_page_size(self):
+        created_user = self.create_and_login_user()
+        self.create_test_recipes(created_user.id, 30)
+
+        with self.record_queries() as small_page_queries:
+            response = self.client.get("/recipes/?per_page=5")
+            assert response.status_code == status.HTTP_200_OK, response.json()
+        with self.record_queries() as large_page_queries:
+            response = self.client.get("/recipes/?per_page=30")
+            assert response.status_code == status.HTTP_200_OK, response.json()
+            assert len(response.json()["data"]) == 30
+
+        # User and token lookups, recipe counter and the count it lacks, page, then
+        # one query each for authors, steps and ingredients.
+        assert len(large_page_queries) == len(small_page_queries)
+        assert len(large_page_queries) <= 8, large_page_queries
+
+    def test_summary_view_skips_recipe_details(self):
+        created_user = self.create_and_login_user()
+        self.create_test_recipes(created_user.id, 3)
+
+        with self.record_queries() as queries:
+            response = self.client.get("/recipes/?view=summary&per_page=2")
+
+        assert response.status_code == status.HTTP_200_OK, response.json()
+        recipe = self.db.query(models.Recipe).order_by(models.Recipe.id).first()
+        assert response.json()["data"][0] == {
+            "id": recipe.id,
+            "name": recipe.name,
+            "created_at": recipe.created_at.isoformat(),
+            "author_id": created_user.id,
+        }
+        assert response.json()["result_count"] == 3
+        assert not [
+            query
+            for query in queries
+            if "recipe_steps" in query or "ingredients" in query
+        ]
+
+        # Cursors and searches work the same way in the summary view.
+        next_page = self.client.get(
+            "/recipes/",
+            params={"view": "summary", "cursor": response.json()["next_cursor"]},
+        ).json()
+        assert [recipe["name"] for recipe in next_page["data"]] == ["Recipe #2"]
+        path = f"/users/{created_user.id}/recipes/"
+        results = self.client.get(path, params={"view": "summary", "q": "flax"}).json()
+        assert results["result_count"] == 0  # Not indexed, as they bypassed crud.
+        self.create_recipe_with_details("Flax Crackers")
+        results = self.client.get(path, params={"view": "summary", "q": "flax"}).json()
+        assert [recipe["name"] for recipe in results["data"]] == ["Flax Crackers"]
+        assert "steps" not in results["data"][0]
+
+    def test_result_count_comes_from_maintained_counters(self):
+        created_user = self.create_and_login_user()
+        self.create_test_recipes(author_id=created_user.id, count=3)
+
+        # The counters are seeded by the first write after the recipes were created
+        # behind crud's back. Until then, listings count the recipes.
+        response = self.client.get(f"/users/{created_user.id}/recipes/?per_page=2")
+        assert response.json()["result_count"] == 3
+        assert response.json()["max_page"] == 2
+
+        response = self.client.post("/recipes/", json={"name": "Chili"})
+        assert response.status_code == status.HTTP_200_OK, response.json()
+
+        with self.record_queries() as queries:
+            response = self.client.get(f"/users/{created_user.id}/recipes/?per_page=2")
+        assert response.json()["result_count"] == 4
+        assert response.json()["max_page"] == 2
+        assert not [query for query in queries if "count(" in query.lower()]
+        assert self.client.get("/recipes/").json()["result_count"] == 4
+
+    def test_reconcile_recipe_counts(self):
+        created_user = self.create_and_login_user()
+        self.client.post("/recipes/", json={"name": "Chili"})  # Seeds the counters.
+
+        # Recipes written behind crud's back are counted by the reconciliation.
+        self.create_test_recipes(author_id=created_user.id, count=2)
+        assert self.client.get("/recipes/").json()["result_count"] == 1
+
+        self.run_crud(crud.reconcile_recipe_counts)
+
+        assert self.client.get("/recipes/").json()["result_count"] == 3
+        response = self.client.get(f"/users/{created_user.id}/recipes/")
+        assert response.json()["result_count"] == 3
+
+    def test_listings_do_not_write_counters(self):
+        created_user = self.create_and_login_user()
+        self.create_test_recipes(author_id=created_user.id, count=2)
+
+        # Listings can run on a read-only replica, so a missing counter is not
+        # seeded by them.
+        with self.record_queries() as queries:
+            assert self.client.get("/recipes/").json()["result_count"] == 2
+            response = self.client.get(f"/users/{created_user.id}/recipes/")
+            assert response.json()["result_count"] == 2
+
+        assert not [query for query in queries if not query.startswith("SELECT")]
+        assert self.db.query(models.RecipeCount).count() == 0
+
     def test_get_missing_author_returns_404(self):
         _session_user = self.create_and_login_user()
 
         response = self.client.get("/users/999/recipes/")
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
+    def create_recipe_with_details(self, name, ingredients=(), steps=()) -> int:
+        recipe_id = self.client.post("/recipes/", json={"name": name}).json()["id"]
+        for ingredient in ingredients:
+            self.client.post(
+                f"/recipes/{recipe_id}/ingredients/", json={"content": ingredient}
+            )
+        for step in steps:
+            self.client.post(f"/recipes/{recipe_id}/steps/", json={"content": step})
+        return recipe_id
+
+    def search(self, query: str, path="/recipes/"):
+        response = self.client.get(path, params={"q": query})
+        assert response.status_code == status.HTTP_200_OK, response.json()
+        return response.json()
+
+    def test_search_recipes(self):
+        created_user = self.create_and_login_user()
+        soup_id = self.create_recipe_with_details(
+            "Tomato Soup", ["2 cans crushed tomatoes", "1 onion"], ["Simmer"]
+        )
+        salad_id = self.create_recipe_with_details(
+            "Summer Salad", ["1 cucumber"], ["Slice the tomatoes and the cucumber"]
+        )
+        self.create_recipe_with_details("Cornbread", ["2 cups cornmeal"], ["Bake"])
+
+        # Stemmed, and ranked by where the terms were found.
+        results = self.search("Tomato")
+        assert results["result_count"] == 2
+        assert [recipe["id"] for recipe in results["data"]] == [soup_id, salad_id]
+        assert results["data"][0]["ingredients"][0]["content"].endswith("tomatoes")
+
+        # Every term must match. Punctuation is not query syntax.
+        assert self.search('tomato, "cucumber"!')["result_count"] == 1
+        assert self.search("tomato pineapple")["result_count"] == 0
+        assert self.search("***")["result_count"] == 0
+
+        path = f"/users/{created_user.id}/recipes/"
+        assert self.search("cornmeal", path)["result_count"] == 1
+        other_user = self.create_user(email="other@example.com")
+        assert self.search("cornmeal", f"/users/{other_user.id}/recipes/") == {
+            "page": 1,
+            "per_page": 10,
+            "max_page": 1,
+            "result_count": 0,
+            "data": [],
+            "next_cursor": None,
+            "prev_cursor": None,
+        }
+
+    def test_search_follows_recipe_edits(self):
+        self.create_and_login_user()
+        recipe_id = self.create_recipe_with_details("Chili", ["1 can beans"], ["Stir"])
+        recipe = self.client.get(f"/recipes/{recipe_id}/").json()
+
+        self.client.post(f"/recipes/{recipe_id}/", json={"name": "Veggie Chili"})
+        ingredient_id = recipe["ingredients"][0]["id"]
+        self.client.post(
+            f"/recipes/ingredients/{ingredient_id}/", json={"content": "1 can lentils"}
+        )
+        self.client.delete(f"/recipes/steps/{recipe['steps'][0]['id']}/")
+
+        assert self.search("veggie")["result_count"] == 1
+        assert self.search("lentils")["result_count"] == 1
+        assert self.search("beans")["result_count"] == 0
+        assert self.search("stir")["result_count"] == 0
+
+    def test_search_cannot_use_cursors(self):
+        self.create_and_login_user()
+        self.create_recipe_with_details("Tomato Soup")
+        cursor = self.client.get("/recipes/").json()["prev_cursor"] or "cursor"
+
+        response = self.client.get("/recipes/", params={"q": "soup", "cursor": cursor})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST, response.json()
+
+    def cook_with(self, author_id: int, *ingredients: str):
+        response = self.client.get(
+            f"/users/{author_id}/recipes/cook-with/",
+            params={"ingredients": list(ingredients)},
+        )
+        assert response.status_code == status.HTTP_200_OK, response.json()
+        return response.json()
+
+    def test_cook_with_ranks_recipes_by_ingredient_coverage(self):
+        created_user = self.create_and_login_user()
+        chili_id = self.create_recipe_with_details(
+            "Chili",
+            [
+                "2 cans black beans",
+                "1 onion, diced",
+                "3 cloves garlic",
+                "1 cup rice",
+                "1 pinch",
+            ],
+        )
+        salsa_id = self.create_recipe_with_details(
+            "Salsa", ["4 tomatoes", "1/2 onion", "1 lime"]
+        )
+        self.create_recipe_with_details("Pancakes", ["2 eggs", "1 cup milk"])
+
+        matches = self.cook_with(created_user.id, "Onions", "beans", "tomato")
+
+        assert [match["recipe"]["id"] for match in matches] == [salsa_id, chili_id]
+        assert matches[0]["coverage"] == 2 / 3
+        assert matches[0]["covered_ingredient_count"] == 2
+        assert [i["content"] for i in matches[0]["missing_ingredients"]] == ["1 lime"]
+        # "1 pinch" does not name an ingredient, so it is not counted.
+        assert matches[1]["ingredient_count"] == 4
+        assert matches[1]["coverage"] == 0.5
+        assert [i["content"] for i in matches[1]["missing_ingredients"]] == [
+            "3 cloves garlic",
+            "1 cup rice",
+        ]
+
+        # Every word of an ingredient on hand must match.
+        assert self.cook_with(created_user.id, "kidney beans") == []
+        assert self.cook_with(created_user.id, "2 cups") == []
+
+    def test_cook_with_follows_ingredient_edits(self):
+        created_user = self.create_and_login_user()
+        recipe_id = self.create_recipe_with_details("Chili", ["1 can beans", "rice"])
+        ingredients = self.client.get(f"/recipes/{recipe_id}/").json()["ingredients"]
+
+        self.client.post(
+            f"/recipes/ingredients/{ingredients[0]['id']}/",
+            json={"content": "1 can lentils"},
+        )
+        self.client.delete(f"/recipes/ingredients/{ingredients[1]['id']}/")
+
+        assert self.cook_with(created_user.id, "beans") == []
+        [match] = self.cook_with(created_user.id, "lentils")
+        assert (match["coverage"], match["ingredient_count"]) == (1, 1)
+        self.assertEqual(
+            self.db.query(models.IngredientTerm.term).all(), [("lentil",)]
+        )
+
+    def test_cook_with_is_restricted_to_own_recipes(self):
+        self.create_and_login_user()
+        other_user = self.create_user(email="other@example.com")
+
+        response = self.client.get(
+            f"/users/{other_user.id}/recipes/cook-with/", params={"ingredients": "egg"}
+        )
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_recipe_reads_are_cached_until_the_recipe_changes(self):
+        self.create_and_login_user()
+        recipe_id = self.create_recipe_with_details("Chili", ["1 can beans"], ["Stir"])
+        recipe = self.client.get(f"/recipes/{recipe_id}/").json()
+
+        with self.record_queries() as queries:
+            response = self.client.get(f"/recipes/{recipe_id}/")
+        assert response.json() == recipe
+        assert not [query for query in queries if "recipes" in query], queries
+
+        # Every write to the recipe invalidates it.
+        ingredient_id = recipe["ingredients"][0]["id"]
+        step_id = recipe["steps"][0]["id"]
+        writes = [
+            lambda: self.client.post(f"/recipes/{recipe_id}/", json={"name": "Stew"}),
+            lambda: self.client.post(
+                f"/recipes/{recipe_id}/ingredients/", json={"content": "1 onion"}
+            ),
+            lambda: self.client.post(
+                f"/recipes/ingredients/{ingredient_id}/", json={"content": "lentils"}
+            ),
+            lambda: self.client.delete(f"/recipes/ingredients/{ingredient_id}/"),
+            lambda: self.client.post(
+                f"/recipes/{recipe_id}/steps/", json={"content": "Simmer"}
+            ),
+            lambda: self.client.post(
+                f"/recipes/steps/{step_id}/", json={"content": "Stir well"}
+            ),
+            lambda: self.client.delete(f"/recipes/steps/{step_id}/"),
+        ]
+        for write in writes:
+            response = write()
+            assert response.status_code == status.HTTP_200_OK, response.json()
+            fresh = self.run_crud(crud.get_recipe, recipe_id, with_details=True)
+            cached = self.client.get(f"/recipes/{recipe_id}/").json()
+            assert cached == json.loads(schemas.RecipeInDB.from_orm(fresh).json())
+
     def test_create_user_recipe(self):
         session_user = self.create_and_login_user()
 
@@ -187,6 +516,66 @@ class GetRecipesTest(DBTestCase):
             recipe_count_after, recipe_count_before + 1
         )  # new recipe created.
 
+    def test_create_recipe_with_ingredients_and_steps(self):
+        session_user = self.create_and_login_user()
+        ingredient_list = [f"{n} cups chickpeas" for n in range(15)]
+        step_list = [f"Step {n}" for n in range(10)]
+
+        with self.record_queries() as queries:
+            response = self.client.post(
+                "/recipes/",
+                json={
+                    "name": "Hummus",
+                    "ingredients": [{"content": c} for c in ingredient_list],
+                    "steps": [{"content": c} for c in step_list],
+                },
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        data = response.json()
+        self.assertEqual(
+            [(i["content"], i["position"]) for i in data["ingredients"]],
+            [(content, n) for n, content in enumerate(ingredient_list)],
+        )
+        self.assertEqual(
+            [(s["content"], s["position"]) for s in data["steps"]],
+            [(content, n) for n, content in enumerate(step_list)],
+        )
+        # Each kind of row is inserted with a single executemany.
+        for table in ["ingredients", "recipe_steps", "ingredient_terms"]:
+            inserts = [q for q in queries if q.startswith(f"INSERT INTO {table} ")]
+            self.assertEqual(len(inserts), 1, inserts)
+
+        # The recipe is counted and indexed like one built up row by row.
+        self.assertEqual(self.run_crud(crud.get_recipe_count, session_user.id), 1)
+        [found] = self.search("chickpea")["data"]
+        self.assertEqual(found["id"], data["id"])
+        [match] = self.cook_with(session_user.id, "chickpeas")
+        self.assertEqual(match["covered_ingredient_count"], 15)
+
+    def test_created_recipes_get_their_own_ids(self):
+        session_user = self.create_and_login_user()
+        # A recipe of the same author, created at the same time, must not be mixed up
+        # with the new ones.
+        created_at = datetime.datetime(2021, 11, 14)
+        other = models.Recipe(
+            name="Other", author_id=session_user.id, created_at=created_at
+        )
+        self.db.add(other)
+        self.db.commit()
+        recipes = [schemas.RecipeCreate(name=f"Recipe {n}") for n in range(3)]
+
+        with mock.patch.object(crud, "datetime") as crud_datetime:
+            crud_datetime.utcnow.return_value = created_at
+            recipe_ids = self.run_crud(crud.create_recipes, session_user.id, recipes)
+
+        self.db.expire_all()
+        self.assertEqual(
+            [self.db.get(models.Recipe, recipe_id).name for recipe_id in recipe_ids],
+            ["Recipe 0", "Recipe 1", "Recipe 2"],
+        )
+        self.assertNotIn(other.id, recipe_ids)
+
     def test_get_recipe_with_ingredients_and_steps(self):
         user = self.create_and_login_user(email="test@example.com")
 
@@ -495,6 +884,70 @@ class StepsTest(DBTestCase):
         super().setUp()
         self.user = self.create_and_login_user()
 
+    def test_concurrent_appends_get_their_own_positions(self):
+        recipe = models.Recipe(
+            name="Chili", author_id=self.user.id, created_at=datetime.datetime.utcnow()
+        )
+        self.db.add(recipe)
+        self.db.commit()
+
+        async def append(n):
+            async with self.AsyncTestingSessionLocal() as db:
+                step = schemas.RecipeStepCreate(content=f"Step {n}")
+                await crud.append_recipe_step(db, recipe.id, step)
+
+        async def append_all():
+            await asyncio.gather(*[append(n) for n in range(10)])
+
+        self.run_async(append_all())
+
+        positions = [
+            position
+            for (position,) in self.db.query(models.RecipeStep.position).filter(
+                models.RecipeStep.recipe_id == recipe.id
+            )
+        ]
+        self.assertEqual(len(positions), 10)
+        self.assertEqual(len(set(positions)), 10)
+
+    def test_appends_are_retried_when_they_lose_a_race(self):
+        recipe = models.Recipe(
+            name="Chili", author_id=self.user.id, created_at=datetime.datetime.utcnow()
+        )
+        self.db.add(recipe)
+        self.db.commit()
+        execute = AsyncSession.execute
+        lost = []
+
+        async def lose_the_first_insert(db, statement, *args, **kwargs):
+            if isinstance(statement, Insert) and not lost:
+                lost.append(statement)
+                raise IntegrityError(str(statement), {}, Exception("UNIQUE failed"))
+            return await execute(db, statement, *args, **kwargs)
+
+        with mock.patch.object(AsyncSession, "execute", lose_the_first_insert):
+            response = self.client.post(
+                f"/recipes/{recipe.id}/steps/", json={"content": "Stir"}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.assertEqual([step["content"] for step in response.json()], ["Stir"])
+        self.assertEqual(len(lost), 1)
+
+    def test_steps_cannot_share_a_position(self):
+        recipe = models.Recipe(
+            name="Chili", author_id=self.user.id, created_at=datetime.datetime.utcnow()
+        )
+        self.db.add(recipe)
+        self.db.commit()
+
+        self.db.add_all(
+            models.RecipeStep(content=content, recipe_id=recipe.id, position=0)
+            for content in ["chop garlic", "chop onions"]
+        )
+        with self.assertRaises(IntegrityError):
+            self.db.commit()
+
     def test_put_step_to_recipe(self):
         # Create a recipe without steps
         recipe = models.Recipe(
@@ -661,4 +1114,212 @@ class StepsTest(DBTestCase):
         response_a = self.client.delete(f"/recipes/steps/{response.json()[0]['id']}/")
         response_b = self.client.delete(f"/recipes/steps/{response.json()[-1]['id']}/")
         self.assertEqual(response_a.status_code, status.HTTP_200_OK)
-        self.assertEqual(response_b.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(response_b.status_code, status.HTTP_200_OK)
+
+class PatchRecipeTest(DBTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_and_login_user()
+        response = self.client.post(
+            "/recipes/",
+            json={
+                "name": "Chili",
+                "ingredients": [
+                    {"content": c} for c in ["1 onion", "2 carrots", "1 lb beef"]
+                ],
+                "steps": [{"content": c} for c in ["Chop", "Brown", "Simmer"]],
+            },
+        )
+        self.recipe = response.json()
+        self.ingredient_ids = [i["id"] for i in self.recipe["ingredients"]]
+        self.step_ids = [s["id"] for s in self.recipe["steps"]]
+
+    def patch(self, *operations):
+        return self.client.patch(
+            f"/recipes/{self.recipe['id']}/", json={"operations": list(operations)}
+        )
+
+    def test_operations_are_applied_in_order(self):
+        onion, carrots, beef = self.ingredient_ids
+        chop, brown, simmer = self.step_ids
+
+        with self.record_queries() as queries:
+            response = self.patch(
+                dict(
+                    op="insert",
+                    target="ingredient",
+                    content="1 can tomatoes",
+                    position=1,
+                ),
+                dict(op="edit", target="ingredient", id=carrots, content="3 carrots"),
+                dict(op="delete", target="ingredient", id=onion),
+                dict(op="move", target="ingredient", id=beef, position=0),
+                dict(op="insert", target="step", content="Serve"),
+                dict(op="move", target="step", id=simmer, position=0),
+                dict(op="delete", target="step", id=brown),
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        recipe = response.json()
+        self.assertEqual(
+            [(i["content"], i["position"]) for i in recipe["ingredients"]],
+            [("1 lb beef", 0), ("1 can tomatoes", 1), ("3 carrots", 2)],
+        )
+        # Edited and moved rows keep their ids.
+        self.assertEqual(recipe["ingredients"][0]["id"], beef)
+        self.assertEqual(recipe["ingredients"][2]["id"], carrots)
+        self.assertEqual(
+            [(s["content"], s["position"]) for s in recipe["steps"]],
+            [("Simmer", 0), ("Chop", 1), ("Serve", 2)],
+        )
+        cached = self.client.get(f"/recipes/{self.recipe['id']}/").json()
+        self.assertEqual(cached, recipe)
+        # The same two bulk updates per table, however many rows moved: one parks
+        # the moved rows, the other writes their new positions and contents.
+        updates = [q for q in queries if q.startswith("UPDATE ingredients ")]
+        self.assertEqual(len(updates), 2, updates)
+
+        # The search and ingredient indexes follow the patch.
+        search = self.client.get("/recipes/", params={"q": "tomatoes"}).json()
+        self.assertEqual([r["id"] for r in search["data"]], [self.recipe["id"]])
+        search = self.client.get("/recipes/", params={"q": "onion"}).json()
+        self.assertEqual(search["data"], [])
+        cook_with = self.client.get(
+            f"/users/{self.user.id}/recipes/cook-with/",
+            params={"ingredients": ["carrots", "onions"]},
+        ).json()
+        self.assertEqual(cook_with[0]["covered_ingredient_count"], 1)
+
+    def test_only_moved_rows_are_written(self):
+        onion, carrots, beef = self.ingredient_ids
+
+        def stored_positions():
+            self.db.expire_all()
+            ingredient = models.RecipeIngredient
+            return dict(self.db.query(ingredient.id, ingredient.position))
+
+        before = stored_positions()
+        response = self.patch(dict(op="move", target="ingredient", id=beef, position=0))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.assertEqual(
+            [(i["id"], i["position"]) for i in response.json()["ingredients"]],
+            [(beef, 0), (onion, 1), (carrots, 2)],
+        )
+        after = stored_positions()
+        self.assertEqual({id for id in after if after[id] != before[id]}, {beef})
+
+        # Deletes leave the other rows alone too.
+        self.client.delete(f"/recipes/ingredients/{onion}/")
+        del after[onion]
+        self.assertEqual(stored_positions(), after)
+
+    def test_renumbered_rows_never_share_a_position(self):
+        # Positions that leave no room for an insert after the first row, so the list
+        # is renumbered, and the second row moves to the fourth row's position.
+        recipe = models.Recipe(
+            name="Soup", author_id=self.user.id, created_at=datetime.datetime.utcnow()
+        )
+        self.db.add(recipe)
+        self.db.commit()
+        self.db.add_all(
+            models.RecipeStep(content=content, recipe_id=recipe.id, position=position)
+            for content, position in [("a", 0), ("b", 1), ("c", 2), ("d", 1024)]
+        )
+        self.db.commit()
+
+        response = self.client.patch(
+            f"/recipes/{recipe.id}/",
+            json={
+                "operations": [
+                    dict(op="insert", target="step", content="new", position=1)
+                ]
+            },
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.assertEqual(
+            [step["content"] for step in response.json()["steps"]],
+            ["a", "new", "b", "c", "d"],
+        )
+
+    def test_patch_is_planned_again_after_a_concurrent_append(self):
+        execute = AsyncSession.execute
+        appending = []
+
+        async def append_first(db, statement, *args, **kwargs):
+            # Another request appends a step just before the patch writes its own.
+            if isinstance(statement, Insert) and not appending:
+                appending.append(statement)
+                async with self.AsyncTestingSessionLocal() as other_db:
+                    step = schemas.RecipeStepCreate(content="Rest")
+                    await crud.append_recipe_step(other_db, self.recipe["id"], step)
+            return await execute(db, statement, *args, **kwargs)
+
+        with mock.patch.object(AsyncSession, "execute", append_first):
+            response = self.patch(dict(op="insert", target="step", content="Serve"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.json())
+        self.assertEqual(
+            [step["content"] for step in response.json()["steps"]],
+            ["Chop", "Brown", "Simmer", "Rest", "Serve"],
+        )
+
+    def test_patch_that_keeps_losing_races_conflicts(self):
+        execute = AsyncSession.execute
+
+        async def lose_every_insert(db, statement, *args, **kwargs):
+            if isinstance(statement, Insert):
+                raise IntegrityError(str(statement), {}, Exception("UNIQUE failed"))
+            return await execute(db, statement, *args, **kwargs)
+
+        with mock.patch.object(AsyncSession, "execute", lose_every_insert):
+            response = self.patch(
+                dict(op="edit", target="step", id=self.step_ids[0], content="Dice"),
+                dict(op="insert", target="step", content="Serve"),
+            )
+
+        self.assertEqual(
+            response.status_code, status.HTTP_409_CONFLICT, response.json()
+        )
+        recipe = self.client.get(f"/recipes/{self.recipe['id']}/").json()
+        self.assertEqual(recipe, self.recipe)
+
+    def test_invalid_operations_apply_nothing(self):
+        onion, carrots, beef = self.ingredient_ids
+
+        response = self.patch(
+            dict(op="edit", target="ingredient", id=onion, content="2 onions"),
+            dict(op="delete", target="step", id=onion + 100),
+            dict(op="move", target="ingredient", id=beef, position=3),
+        )
+
+        self.assertEqual(
+            response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY, response.json()
+        )
+        self.assertEqual(
+            [error["loc"] for error in response.json()["detail"]],
+            [["body", "operations", 1], ["body", "operations", 2]],
+        )
+        recipe = self.client.get(f"/recipes/{self.recipe['id']}/").json()
+        self.assertEqual(recipe, self.recipe)
+
+    def test_operations_must_have_their_fields(self):
+        response = self.patch(dict(op="insert", target="step"))
+
+        self.assertEqual(
+            response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY, response.json()
+        )
+
+    def test_patch_recipe_no_access(self):
+        self.create_and_login_user(
+            "test2@example.com", password="lkajsdlkjasdLKJASDLKJ123!:!:!"
+        )
+
+        response = self.patch(
+            dict(op="delete", target="ingredient", id=self.ingredient_ids[0])
+        )
+
+        self.assertEqual(
+            response.status_code, status.HTTP_403_FORBIDDEN, response.json()
+        )
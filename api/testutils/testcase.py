@@ -1,17 +1,29 @@
+import asyncio
 import os
-from typing import Optional
-from unittest import TestCase
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, List
+from unittest import TestCase, mock
 import logging
 
-from fastapi import status
+from fastapi import Response, status
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker, Session
 
-from api.database import Base
-from api.main import app, get_db
+from api import maintenance
+from api.cookbooks import jobs
+from api.database import (
+    Base,
+    create_app_engine,
+    create_async_sessionmaker,
+    create_sync_engine,
+    get_db,
+    get_read_db,
+)
+from api.main import app
 from api.schemas import UserCreate, User
 from api.crud import create_user
+from api.recipe_cache import recipe_cache
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +42,12 @@ class DBTestCase(TestCase):
     ```python
     user_count = self.db.query(models.User).count()
     ```
+
+    The app's async crud functions can be called on the test DB with `self.run_crud`
+    e.g.
+    ```python
+    user = self.run_crud(crud.get_user, user_id)
+    ```
     """
 
     TEST_DB_LOCATION = "./test.db"
@@ -48,40 +66,100 @@ class DBTestCase(TestCase):
     def db_setup(self):
         # create test db
         self.test_db_url = f"sqlite:///{self.TEST_DB_LOCATION}"
-        engine = create_engine(
-            self.test_db_url, connect_args={"check_same_thread": False}
-        )
+        self.engine = engine = create_sync_engine(self.test_db_url)
         # Create all of the required tables. TODO: run migrations instead.
         logger.debug("Creating a test DB.")
         Base.metadata.create_all(bind=engine)
         TestingSessionLocal = sessionmaker(
             autocommit=False, autoflush=False, bind=engine
         )
+        # The app's sessions, on an engine built like the app's own.
+        self.async_engine = create_app_engine(self.test_db_url)
+        self.AsyncTestingSessionLocal = create_async_sessionmaker(self.async_engine)
 
-        def override_get_test_db():
-            db: Optional[Session] = None
-            try:
-                db = TestingSessionLocal()
+        async def override_get_test_db(response: Response):
+            async with self.AsyncTestingSessionLocal() as db:
+                db.info["response"] = response
                 yield db
-            finally:
-                if db:
-                    db.close()
 
-        # Change the main client's get_db function to use the test db.
+        async def override_get_test_read_db():
+            async with self.AsyncTestingSessionLocal() as db:
+                yield db
+
+        # Change the main client's session dependencies to use the test db. Its reads
+        # and writes both go to the one test db.
         app.dependency_overrides[get_db] = override_get_test_db
+        app.dependency_overrides[get_read_db] = override_get_test_read_db
+        # Background work opens its own sessions, outside of the dependencies.
+        self.session_patches = [
+            mock.patch.object(
+                module, "AsyncSessionLocal", self.AsyncTestingSessionLocal
+            )
+            for module in (jobs, maintenance)
+        ]
+        self.session_patches.append(
+            mock.patch.object(
+                jobs, "read_sessionmaker", lambda _: self.AsyncTestingSessionLocal
+            )
+        )
+        for patch in self.session_patches:
+            patch.start()
 
         self.client = TestClient(app)
         self.db: Session = TestingSessionLocal()
+        # Recipe ids start over in every test DB.
+        self.run_async(recipe_cache.clear())
 
     def db_teardown(self):
+        for patch in self.session_patches:
+            patch.stop()
         if self.db:
             self.db.close()
+        # Close the pooled connections, so none are left open on the deleted database.
+        self.engine.dispose()
+        self.run_async(self.async_engine.dispose())
 
         # destroy the test db by simply deleting the file.
 
         logger.debug("Destroying the test DB.")
         os.remove(self.TEST_DB_LOCATION)
 
+    @contextmanager
+    def record_queries(self) -> Iterator[List[str]]:
+        """Records the SQL statements that run on the test DB inside the block."""
+        statements: List[str] = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # The app runs its queries through the async engine.
+        engine = self.async_engine.sync_engine
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+    def run_crud(self, crud_function: Callable[..., Awaitable[Any]], *args, **kwargs):
+        """Runs an async crud function in a session on the test DB, and returns its
+        result."""
+
+        async def run():
+            async with self.AsyncTestingSessionLocal() as db:
+                return await crud_function(db, *args, **kwargs)
+
+        return self.run_async(run())
+
+    def run_async(self, coroutine: Awaitable[Any]):
+        """Runs the coroutine on the test client's event loop, which is found the same
+        way the test client finds it."""
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+
     def create_user(
         self,
         email="test@example.com",
@@ -92,7 +170,7 @@ class DBTestCase(TestCase):
         new_user = UserCreate(
             password=password, email=email, first_name=first_name, last_name=last_name
         )
-        created_user = create_user(db=self.db, user=new_user)
+        created_user = self.run_crud(create_user, user=new_user)
         return created_user
 
     def login(self, email: str, password: str):
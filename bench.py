@@ -0,0 +1,132 @@
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from typing import List, Optional
+
+import typer
+
+from api.cookbooks.benchmark import COOKBOOK_SIZES, measure
+
+typer_app = typer.Typer()
+
+RESULTS_DIR = os.path.join(".cache", "benchmarks")
+METRICS = ["wall_seconds", "cpu_seconds", "peak_rss_bytes", "pdf_bytes"]
+
+
+@typer_app.command()
+def run(
+    sizes: List[int] = typer.Option(COOKBOOK_SIZES, "--size", help="Recipe counts."),
+    repeat: int = typer.Option(3, help="Runs per size. Results are the median."),
+    shards: int = typer.Option(1, help="Render workers each cookbook is split across."),
+    output: Optional[str] = typer.Option(None, help="Where to write the results."),
+):
+    """Benchmarks generate_pdf_from_recipes on synthetic cookbooks and writes the
+    results as JSON. Every run happens in a fresh process, so peak RSS is per run."""
+    commit = git_commit()
+    results = []
+    for size in sizes:
+        runs = [measure_in_subprocess(size, shards) for _ in range(repeat)]
+        result = dict(runs[0])
+        for metric in METRICS + ["setup_seconds", "rss_before_render_bytes"]:
+            result[metric] = statistics.median(run[metric] for run in runs)
+        result["runs"] = runs
+        results.append(result)
+        typer.echo(
+            f"{size:>5} recipes: {result['wall_seconds']:8.2f}s wall, "
+            f"{result['cpu_seconds']:8.2f}s cpu, "
+            f"{result['peak_rss_bytes'] / 2 ** 20:8.1f} MiB peak RSS, "
+            f"{result['pdf_bytes'] / 2 ** 10:8.1f} KiB PDF"
+        )
+
+    report = {
+        "commit": commit,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{commit}.json")
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=4)
+    typer.echo(f"Wrote results to {output}")
+
+
+@typer_app.command()
+def compare(
+    baseline: str,
+    current: str,
+    fail_above: Optional[float] = typer.Option(
+        None, help="Exit with an error if a metric grew by more than this percentage."
+    ),
+):
+    """Compares two result files written by `run`."""
+    with open(baseline) as baseline_file, open(current) as current_file:
+        baseline_report = json.load(baseline_file)
+        current_report = json.load(current_file)
+    typer.echo(f"{baseline_report['commit']} -> {current_report['commit']}")
+
+    baseline_results = {
+        result["recipes"]: result for result in baseline_report["results"]
+    }
+    regressions = []
+    for result in current_report["results"]:
+        before = baseline_results.get(result["recipes"])
+        if not before:
+            continue
+        changes = []
+        for metric in METRICS:
+            if not before[metric]:
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            changes.append(f"{metric} {change:+6.1f}%")
+            if fail_above is not None and change > fail_above:
+                regressions.append(f"{result['recipes']} recipes: {metric}")
+        typer.echo(f"{result['recipes']:>5} recipes: " + ", ".join(changes))
+
+    if regressions:
+        typer.echo(f"Regressions: {', '.join(regressions)}", err=True, color=True)
+        raise typer.Exit(1)
+
+
+@typer_app.command(hidden=True)
+def measure_once(size: int, shards: int = 1):
+    """Renders one cookbook and prints its measurements as JSON. Used by `run`."""
+    typer.echo(json.dumps(measure(size, shards)))
+
+
+def measure_in_subprocess(size: int, shards: int) -> dict:
+    completed = subprocess.run(
+        [sys.executable, __file__, "measure-once", str(size), "--shards", str(shards)],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # Only the last line is ours. The app may print while it starts up.
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    """The current commit, marked dirty if the working tree has changes."""
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout.strip()
+    dirty = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=no"],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout.strip()
+    return f"{commit}-dirty" if dirty else commit
+
+
+if __name__ == "__main__":
+    typer_app()